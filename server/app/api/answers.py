@@ -1,18 +1,36 @@
 from typing_extensions import Annotated
 from typing import Optional  # Add for Python 3.8 compatibility
-from fastapi import APIRouter, Response, status, Cookie, HTTPException, UploadFile, File
-from sqlalchemy import select, update, insert
+from fastapi import APIRouter, Depends, Response, status, Cookie, HTTPException, UploadFile, File
+from sqlalchemy import select, update, insert, delete, case, cast, literal, literal_column, true, bindparam, Integer, BigInteger, SmallInteger, Boolean, TIMESTAMP
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.sql.elements import BindParameter
 from datetime import datetime
-from ..lib.db import database, Answers, Questions, Users, Notifications, NotificationType
-from ..lib.auth import verify_jwt
-from ..lib.cloudinary import upload_image_file
+from ..lib.db import database, get_connection, answer_columns, Answers, Questions, NotificationType, ImageStatus, Votes
+from ..lib.auth import resolve_principal
+from ..lib.uploads import image_uploads, discard_spooled
+from ..lib.tags import normalize_tags
+from ..lib.notifier import notify
+from ..lib.cache import question_pages
+from ..lib.mappers import answer_response
+from ..lib import queries
+from ..lib.profiler import query_budget
+from ..lib.ratelimit import admit, rate_limit
+from ..lib.trending import question_feeds
+from ..lib.log import get_logger
+import asyncio
 import json
 
+logger = get_logger("api.answers")
+
 # Router for handling answer-related operations
-router = APIRouter(prefix="/api/answers", tags=["Answers"])
+router = APIRouter(prefix="/api/answers", tags=["Answers"], dependencies=[Depends(admit), Depends(get_connection)])
+
+# Accepted vote_type values and the vote they store; "none" retracts the user's vote
+VOTE_VALUES = {"upvote": 1, "downvote": -1, "none": 0}
 
 # POST /api/answers - Create a new answer
 @router.post("/", status_code=status.HTTP_201_CREATED)
+@query_budget(2)
 async def create_answer(
     question_id: int,
     description: str,
@@ -21,12 +39,13 @@ async def create_answer(
     response: Response = None,
     access_token: Annotated[Optional[str], Cookie()] = None  # Changed str | None to Optional[str]
 ):
-    user_id = await verify_jwt(access_token)
-    if not user_id:
+    principal = await resolve_principal(access_token)
+    if not principal:
         response.status_code = status.HTTP_401_UNAUTHORIZED
         return {"message": "Unauthorized"}
+    user_id = principal.user_id
 
-    await database.connect()
+    spooled_path = None
     try:
         # Validate input
         if not question_id or not description:
@@ -40,142 +59,207 @@ async def create_answer(
             tags_list = json.loads(tags) if tags else []
             if not isinstance(tags_list, list):
                 raise ValueError("Tags must be a list")
+            tags_list = normalize_tags(tags_list)
         except ValueError:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Invalid tags format; must be a JSON array"
             )
 
-        # Check if question exists
-        question_query = select(Questions).where(Questions.c.question_id == question_id)
-        question = await database.fetch_one(question_query)
-        if not question:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Question not found"
-            )
-
-        # Handle image upload if provided
-        final_img_url = None
+        # Spool the image to disk; it is uploaded in the background once the answer is committed
         if image:
-            final_img_url = upload_image_file(image.file, folder="answers")
+            spooled_path = await asyncio.to_thread(image_uploads.spool, image.file, image.filename)
 
-        # Insert answer
-        query = insert(Answers).values(
+        # Insert the answer only if its question exists, returning the new row together
+        # with the question's owner and title for the notification
+        result = await queries.fetch_one(
+            queries.statement("answers.create", build_answer_insert),
             question_id=question_id,
             user_id=user_id,
             description=description,
-            img_url=final_img_url,
+            img_status=ImageStatus.pending if spooled_path else None,
             tags=tags_list,
-            upvotes=0,
-            downvotes=0,
-            is_accepted=False,
             created_at=datetime.utcnow()
         )
-        answer_id = await database.execute(query)
-
-        # Create notification for question owner
-        question_owner_id = question["user_id"]
-        if question_owner_id != user_id:  # Prevent self-notification
-            user_query = select(Users).where(Users.c.user_id == user_id)
-            user = await database.fetch_one(user_query)
-            message = f"User {user['username']} answered your question: {question['title']}"
-            notification_query = insert(Notifications).values(
-                user_id=question_owner_id,
-                type=NotificationType.answer,
-                related_id=answer_id,
-                message=message,
-                is_read=False,
-                created_at=datetime.utcnow()
+        if not result:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Question not found"
             )
-            await database.execute(notification_query)
+        answer_id = result["answer_id"]
+        await question_pages.invalidate(question_id)
+        question_feeds.answer_added(question_id, result["created_at"])
 
-        # Fetch the created answer with username
-        result_query = select(Answers, Users.c.username).join(
-            Users, Answers.c.user_id == Users.c.user_id
-        ).where(Answers.c.answer_id == answer_id)
-        result = await database.fetch_one(result_query)
+        if spooled_path:
+            # The answer is committed: from here on the image's fate is recorded in
+            # img_status rather than failing the request
+            path, spooled_path = spooled_path, None
+            try:
+                await image_uploads.enqueue(answer_id, path)
+            except Exception:
+                logger.exception("Could not queue image upload", extra={"answer_id": answer_id})
 
-        return {
-            "answer_id": result["answer_id"],
-            "question_id": result["question_id"],
-            "user_id": result["user_id"],
-            "description": result["description"],
-            "img_url": result["img_url"],
-            "tags": result["tags"],
-            "upvotes": result["upvotes"],
-            "downvotes": result["downvotes"],
-            "is_accepted": result["is_accepted"],
-            "created_at": result["created_at"],
-            "updated_at": result["updated_at"],
-            "username": result["username"]
-        }
+        # Notify the question owner once this request is done
+        question_owner_id = result["question_user_id"]
+        if question_owner_id != user_id:  # Prevent self-notification
+            message = f"User {principal.username} answered your question: {result['question_title']}"
+            await notify(question_owner_id, NotificationType.answer, answer_id, message)
+
+        return answer_response(result, username=principal.username)
+    except HTTPException as e:
+        response.status_code = e.status_code
+        return {"message": e.detail}
     except Exception as e:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {"message": f"Error creating answer: {str(e)}"}
     finally:
-        await database.disconnect()
+        # The answer was not committed, so nobody will upload this image
+        if spooled_path:
+            discard_spooled(spooled_path)
+
+def build_answer_insert():
+    """
+    INSERT ... SELECT FROM questions, so a missing question inserts (and returns) nothing.
+    Binds :question_id plus the user-supplied answer columns; SELECT-list values are
+    cast so PostgreSQL types them from the target columns.
+    """
+    question = select(Questions.c.question_id, Questions.c.user_id, Questions.c.title).where(
+        Questions.c.question_id == bindparam("question_id")
+    ).cte("question")
+    values = {
+        "user_id": bindparam("user_id", type_=Answers.c.user_id.type),
+        "description": bindparam("description", type_=Answers.c.description.type),
+        "img_url": None,
+        "img_status": bindparam("img_status", type_=Answers.c.img_status.type),
+        "tags": bindparam("tags", type_=Answers.c.tags.type),
+        "upvotes": 0,
+        "downvotes": 0,
+        "is_accepted": False,
+        "created_at": bindparam("created_at", type_=Answers.c.created_at.type)
+    }
+    inserted = insert(Answers).from_select(
+        ["question_id", *values],
+        select(question.c.question_id, *[
+            cast(value if isinstance(value, BindParameter) else literal(value), Answers.c[name].type)
+            for name, value in values.items()
+        ])
+    ).returning(*answer_columns).cte("inserted")
+    return select(
+        inserted,
+        question.c.user_id.label("question_user_id"),
+        question.c.title.label("question_title")
+    ).select_from(inserted.join(question, true()))
 
-# POST /api/answers/<id>/vote - Upvote or downvote an answer
+# POST /api/answers/<id>/vote - Upvote, downvote or retract a vote on an answer
 @router.post("/{answer_id}/vote")
+@query_budget(3)
+@rate_limit("vote")
 async def vote_answer(
     answer_id: int,
     vote: dict,
     response: Response,
     access_token: Annotated[Optional[str], Cookie()] = None  # Changed str | None to Optional[str]
 ):
-    user_id = await verify_jwt(access_token)
-    if not user_id:
+    principal = await resolve_principal(access_token)
+    if not principal:
         response.status_code = status.HTTP_401_UNAUTHORIZED
         return {"message": "Unauthorized"}
+    user_id = principal.user_id
 
-    await database.connect()
     try:
-        # Check if answer exists
-        answer_query = select(Answers).where(Answers.c.answer_id == answer_id)
-        answer = await database.fetch_one(answer_query)
-        if not answer:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Answer not found"
-            )
-
         # Validate vote type
-        vote_type = vote.get("vote_type")  # Expecting "upvote" or "downvote"
-        if vote_type not in ["upvote", "downvote"]:
+        vote_type = vote.get("vote_type")  # Expecting "upvote", "downvote" or "none" to retract
+        if vote_type not in VOTE_VALUES:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Invalid vote type. Must be 'upvote' or 'downvote'"
+                detail="Invalid vote type. Must be 'upvote', 'downvote' or 'none'"
             )
 
-        # Check if user has already voted (simple check, assumes one vote per user)
-        if answer["upvotes"] > 0 or answer["downvotes"] > 0:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="User has already voted on this answer"
-            )
-
-        # Update vote count
-        update_values = {}
-        if vote_type == "upvote":
-            update_values["upvotes"] = Answers.c.upvotes + 1
-        else:  # downvote
-            update_values["downvotes"] = Answers.c.downvotes + 1
-        update_values["updated_at"] = datetime.utcnow()
-
-        update_query = update(Answers).where(
-            Answers.c.answer_id == answer_id
-        ).values(**update_values)
-        await database.execute(update_query)
+        # Record the vote and adjust the answer's counters in one statement
+        value = VOTE_VALUES[vote_type]
+        result = await queries.fetch_one(
+            queries.statement(("answers.vote", bool(value)), lambda: build_vote_query(retract=not value)),
+            user_id=user_id,
+            answer_id=answer_id,
+            value=value,
+            now=datetime.utcnow()
+        )
+        if result is None:
+            # Nothing changed: either the answer doesn't exist or the vote was already in this state
+            counts_query = select(Answers.c.upvotes, Answers.c.downvotes).where(Answers.c.answer_id == answer_id)
+            result = await database.fetch_one(counts_query)
+            if not result:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Answer not found"
+                )
+        else:
+            await question_pages.invalidate(result["question_id"])
+            question_feeds.votes_changed(result["question_id"], result["net_delta"], datetime.utcnow())
 
         return {
             "success": True,
-            "message": f"Answer {vote_type}d successfully",
-            "answer_id": answer_id
+            "message": "Vote retracted successfully" if vote_type == "none" else f"Answer {vote_type}d successfully",
+            "answer_id": answer_id,
+            "vote_type": vote_type,
+            "upvotes": result["upvotes"],
+            "downvotes": result["downvotes"]
         }
+    except HTTPException as e:
+        response.status_code = e.status_code
+        return {"message": e.detail}
     except Exception as e:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {"message": f"Error voting on answer: {str(e)}"}
-    finally:
-        await database.disconnect()
-        
\ No newline at end of file
+
+# Inlined so PostgreSQL types the CASE branches as integers rather than untyped parameters
+_ONE, _ZERO, _MINUS_ONE = literal_column("1", Integer), literal_column("0", Integer), literal_column("-1", Integer)
+
+def build_vote_query(retract: bool):
+    """
+    Build one statement that sets (:value 1/-1) or retracts the user's vote and
+    applies the resulting delta to answers.upvotes/downvotes. Binds :user_id,
+    :answer_id, :now and, unless retracting, :value.
+    Returns the answer's new counts and the change in its net votes, or no row if
+    nothing changed.
+
+    Casting/changing a vote upserts the votes row; the conflict branch only fires
+    when the stored vote differs, so an update always means the old vote was -value.
+    Retracting deletes the row and reads the old vote from RETURNING. Row locks
+    taken by the upsert/delete serialize concurrent votes by the same user.
+    """
+    user_id = bindparam("user_id", type_=BigInteger)
+    answer_id = bindparam("answer_id", type_=BigInteger)
+    now = bindparam("now", type_=TIMESTAMP)
+    if not retract:
+        upsert = pg_insert(Votes).from_select(
+            ["user_id", "answer_id", "vote", "created_at"],
+            select(
+                cast(user_id, BigInteger),
+                cast(answer_id, BigInteger),
+                cast(bindparam("value"), SmallInteger),
+                cast(now, TIMESTAMP)
+            ).where(Answers.c.answer_id == answer_id)
+        )
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[Votes.c.user_id, Votes.c.answer_id],
+            set_={"vote": upsert.excluded.vote, "updated_at": now},
+            where=Votes.c.vote != upsert.excluded.vote
+        ).returning(Votes.c.vote, literal_column("(xmax = 0)", Boolean).label("inserted"))
+        change = upsert.cte("vote_change")
+        up_delta = case((change.c.vote == 1, _ONE), (change.c.inserted, _ZERO), else_=_MINUS_ONE)
+        down_delta = case((change.c.vote == -1, _ONE), (change.c.inserted, _ZERO), else_=_MINUS_ONE)
+    else:
+        change = delete(Votes).where(
+            (Votes.c.user_id == user_id) & (Votes.c.answer_id == answer_id)
+        ).returning(Votes.c.vote).cte("vote_change")
+        up_delta = case((change.c.vote == 1, _MINUS_ONE), else_=_ZERO)
+        down_delta = case((change.c.vote == -1, _MINUS_ONE), else_=_ZERO)
+
+    return update(Answers).where(
+        (Answers.c.answer_id == answer_id) & change.c.vote.isnot(None)
+    ).values(
+        upvotes=Answers.c.upvotes + up_delta,
+        downvotes=Answers.c.downvotes + down_delta,
+        updated_at=now
+    ).returning(Answers.c.question_id, Answers.c.upvotes, Answers.c.downvotes, (up_delta - down_delta).label("net_delta"))
@@ -1,18 +1,22 @@
-from fastapi import APIRouter,Response,status,Cookie
+from fastapi import APIRouter,Depends,Response,status,Cookie
 from typing import Annotated
 from ..lib.models import SignupRequest,SigninRequest
 from ..lib.crud import create_user
-import bcrypt
-from ..lib.db import Users,database
+from ..lib.db import Users,database,get_connection
 from ..lib.auth import create_session,verify_jwt
-from sqlalchemy import select
+from ..lib.passwords import hash_password,verify_password,needs_rehash,PasswordPoolSaturated
+from ..lib.log import get_logger
+from ..lib.ratelimit import admit,rate_limit
+from sqlalchemy import select,update
 
-userRouter = APIRouter(prefix="/api/auth")
+logger = get_logger("api.auth")
+
+userRouter = APIRouter(prefix="/api/auth",dependencies=[Depends(admit),Depends(get_connection)])
 
 @userRouter.post("/signup")
+@rate_limit("auth")
 async def signup(response: Response,user: SignupRequest):
     try:
-        await database.connect()
         stmt = select(Users).where((Users.c.username == user.username) | (Users.c.email == user.email))
         user_exists = await database.fetch_one(stmt)
         if(user_exists != None):
@@ -20,11 +24,9 @@ async def signup(response: Response,user: SignupRequest):
             return {
                 "message": "User with email or username already exists"
             }
-        bytes = user.password.encode('utf-8')
-        hashedPassword = bcrypt.hashpw(bytes,bcrypt.gensalt()).decode('utf-8')
-        user.password = hashedPassword
+        user.password = await hash_password(user.password)
         user_id = await create_user(user=user)
-        print("User created: ",user_id)
+        logger.info("User signed up", extra={"user_id": user_id})
 
         access_token = await create_session(user_id)
 
@@ -43,14 +45,18 @@ async def signup(response: Response,user: SignupRequest):
             "message": "User signed up successfully",
             "success": True
         }
-    except Exception as e:
-        print(e)
+    except PasswordPoolSaturated:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        response.headers["Retry-After"] = "1"
+        return {
+            "message": "Server busy, please retry"
+        }
+    except Exception:
+        logger.exception("Signup failed")
         response.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
         return {
             "message": "server error"
         }
-    finally:
-        await database.disconnect()
 
 @userRouter.post("/logout")
 async def logout(response: Response,access_token: Annotated[str | None,Cookie()] = None):
@@ -70,7 +76,7 @@ async def logout(response: Response,access_token: Annotated[str | None,Cookie()]
             "message": "User logged out successfully"
         }
     except Exception as e:
-        print(e)
+        logger.exception("Logout failed")
         response.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
         return {
             "message": "Error while logging out",
@@ -79,37 +85,37 @@ async def logout(response: Response,access_token: Annotated[str | None,Cookie()]
         
     
 
-@userRouter.post("/login")   
+@userRouter.post("/login")
+@rate_limit("auth")
 async def login(response: Response,user: SigninRequest):
     try:
-        await database.connect()
         stmt = select(Users).where(Users.c.username == user.username)
-        print("Fetching user with username:", user.username)
         user_exists = await database.fetch_one(stmt)
-        if(user_exists.count == 0):
-            print("User with given username not found")
+        if(user_exists is None):
+            logger.info("Login for unknown username", extra={"username": user.username})
             response.status_code = status.HTTP_404_NOT_FOUND
             return {
                 "message": "User with given username not found"
             }
-        # bytes = user.password.encode('utf-8')
-        # hashedPassword = bcrypt.hashpw(bytes,bcrypt.gensalt()).decode('utf-8')
-
-        # decoded_password = bcrypt.checkpw()
-
-        # print("Input Password: ",hashedPassword)
-        # print("DB Password: ",user_exists["password"])
-        if bcrypt.checkpw(user.password.encode('utf-8'),user_exists["password_hash"].encode('utf-8')) == False:
-            print("User password does not match")
+        if await verify_password(user.password,user_exists["password_hash"]) == False:
+            logger.info("Login with wrong password", extra={"user_id": user_exists["user_id"]})
             response.status_code = status.HTTP_401_UNAUTHORIZED            
             return {
                 "message": "User password does not match"
             }
+
+        # Upgrade the stored hash if BCRYPT_ROUNDS changed since it was written
+        if needs_rehash(user_exists["password_hash"]):
+            try:
+                new_hash = await hash_password(user.password)
+                await database.execute(
+                    update(Users).where(Users.c.user_id == user_exists["user_id"]).values(password_hash=new_hash)
+                )
+            except PasswordPoolSaturated:
+                pass  # Not worth failing the login over; retried on the next one
         
-        print("Creating session for user_id:", user_exists["user_id"])
         access_token = await create_session(user_exists["user_id"])
 
-        print("Setting access token in response")
         response.set_cookie(
             key="access_token",
             value=str(access_token),
@@ -125,15 +131,18 @@ async def login(response: Response,user: SigninRequest):
             "message": "User signed in successfully",
             "success": True
         }
-    except Exception as e:       
-        print("Exception occured while signing in:", e)
+    except PasswordPoolSaturated:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        response.headers["Retry-After"] = "1"
+        return {
+            "message": "Server busy, please retry"
+        }
+    except Exception:
+        logger.exception("Login failed")
         response.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
         return {
                 "message": "Some internal error occured"
             }
-    finally: 
-        print("Disconnecting database")
-        await database.disconnect()
     
 
 
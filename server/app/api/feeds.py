@@ -0,0 +1,79 @@
+import os
+from typing import Literal
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import select, func, bindparam, BigInteger
+from sqlalchemy.dialects.postgresql import ARRAY
+from ..lib.db import get_connection, question_columns, Questions, Users
+from ..lib.mappers import question_response
+from ..lib.models import RankedFeed
+from ..lib.profiler import query_budget
+from ..lib.ratelimit import admit
+from ..lib.trending import question_feeds, FEED_SIZE
+from ..lib import queries
+
+DEFAULT_PAGE_SIZE = int(os.environ.get("FEEDS_PAGE_SIZE", 20))
+
+# Router for the ranked question feeds; rankings live in memory (lib/trending.py)
+router = APIRouter(prefix="/api/feeds", tags=["Feeds"], dependencies=[Depends(admit), Depends(get_connection)])
+
+
+def build_questions_by_id_query():
+    # Binds :ids; rows come back unordered
+    return select(*question_columns, Users.c.username).join(
+        Users, Questions.c.user_id == Users.c.user_id
+    ).where(Questions.c.question_id == func.any(bindparam("ids", type_=ARRAY(BigInteger))))
+
+
+async def ranked_page(feed: Literal["hot", "trending"], limit: int, offset: int) -> dict:
+    # Only the page's rows are read from the database, by primary key
+    ranked = question_feeds.top(feed)
+    page = ranked[offset:offset + limit]
+    rows = {}
+    if page:
+        rows = {
+            row["question_id"]: row
+            for row in await queries.fetch_all(
+                queries.statement("feeds.questions", build_questions_by_id_query),
+                ids=[question_id for question_id, _ in page]
+            )
+        }
+    return {
+        # A question deleted since it was ranked is skipped
+        "questions": [
+            question_response(rows[question_id], score=round(score, 4))
+            for question_id, score in page if question_id in rows
+        ],
+        "next_offset": offset + limit if offset + limit < len(ranked) else None
+    }
+
+
+# GET /api/feeds/hot - Questions ranked by their votes, answers and acceptance, decayed by age
+@router.get("/hot", response_model=RankedFeed)
+@query_budget(1)
+async def get_hot(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=FEED_SIZE),
+    offset: int = Query(0, ge=0, lt=FEED_SIZE)
+):
+    try:
+        return await ranked_page("hot", limit, offset)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error fetching hot questions: {str(e)}"
+        )
+
+
+# GET /api/feeds/trending - Questions ranked by their recent answers, votes and acceptance
+@router.get("/trending", response_model=RankedFeed)
+@query_budget(1)
+async def get_trending(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=FEED_SIZE),
+    offset: int = Query(0, ge=0, lt=FEED_SIZE)
+):
+    try:
+        return await ranked_page("trending", limit, offset)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error fetching trending questions: {str(e)}"
+        )
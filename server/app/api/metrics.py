@@ -0,0 +1,75 @@
+import os
+import secrets
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException, status
+from fastapi.responses import PlainTextResponse
+from dotenv import load_dotenv
+from ..lib.db import database, replicas
+from ..lib.metrics import registry, CounterFunction, GaugeFunction
+from ..lib.notifier import notification_queue
+from ..lib.passwords import pending_jobs
+from ..lib.pubsub import notification_hub
+from ..lib.ratelimit import limiter
+from ..lib.trending import question_feeds
+from ..lib.uploads import image_uploads
+
+load_dotenv()
+
+# When set, scrapers must send "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+# Router for the Prometheus scrape endpoint; no database connection needed
+router = APIRouter(tags=["Metrics"])
+
+
+def _pool_size(idle: bool) -> int:
+    pool = getattr(database._backend, "_pool", None)
+    if pool is None:
+        return 0
+    return pool.get_idle_size() if idle else pool.get_size()
+
+
+registry.register(GaugeFunction(
+    "notification_queue_depth", "Notifications waiting to be written", lambda: notification_queue.depth
+))
+registry.register(CounterFunction(
+    "notifications_dropped_total", "Notifications dropped after exhausting retries", lambda: notification_queue.failed
+))
+registry.register(GaugeFunction(
+    "image_upload_queue_depth", "Answer images waiting to be uploaded", lambda: image_uploads.depth
+))
+registry.register(GaugeFunction(
+    "notification_stream_subscribers", "Open notification streams in this process", lambda: notification_hub.subscriber_count
+))
+registry.register(GaugeFunction(
+    "password_hash_pending", "Password hashes queued or running", pending_jobs
+))
+registry.register(GaugeFunction(
+    "db_pool_connections", "Connections open in the database pool", lambda: _pool_size(idle=False)
+))
+registry.register(GaugeFunction(
+    "db_pool_idle_connections", "Idle connections in the database pool", lambda: _pool_size(idle=True)
+))
+registry.register(GaugeFunction(
+    "admission_in_flight", "Requests holding a concurrency slot", lambda: limiter.active
+))
+registry.register(GaugeFunction(
+    "admission_waiting", "Requests queued for a concurrency slot", lambda: limiter.waiting
+))
+registry.register(GaugeFunction(
+    "feed_questions_tracked", "Questions ranked in memory for the hot and trending feeds", lambda: question_feeds.tracked
+))
+registry.register(GaugeFunction(
+    "db_replicas_healthy", "Read replicas currently serving GET requests", lambda: replicas.healthy_count
+))
+
+
+# GET /metrics - Request, database and queue metrics in the Prometheus text format
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics(authorization: Optional[str] = Header(None)):
+    if METRICS_TOKEN and not secrets.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Unauthorized"
+        )
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -1,195 +1,333 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from databases import Database
-from typing import List
-from datetime import datetime
-import re
-from .db import database, Notifications, NotificationType, Users, Questions, Answers
-from .model import NotificationResponse
-from fastapi_jwt_auth import AuthJWT
-
-router = APIRouter(prefix="/api/notifications", tags=["Notifications"])
-
-@router.get("/", response_model=List[NotificationResponse])
-async def get_notifications(Authorize: AuthJWT = Depends()):
-    Authorize.jwt_required()
-    user_id = int(Authorize.get_jwt_subject())
-    
-    await database.connect()
-    query = Notifications.select().where(Notifications.c.user_id == user_id).order_by(Notifications.c.created_at.desc())
-    notifications = await database.fetch_all(query)
-    await database.disconnect()
-    
-    return [
-        NotificationResponse(
-            notification_id=notification["notification_id"],
-            user_id=notification["user_id"],
-            type=notification["type"],
-            related_id=notification["related_id"],
-            message=notification["message"],
-            is_read=notification["is_read"],
-            created_at=notification["created_at"]
-        )
-        for notification in notifications
-    ]
-
-@router.put("/{notification_id}/read")
-async def mark_notification_read(notification_id: int, Authorize: AuthJWT = Depends()):
-    Authorize.jwt_required()
-    user_id = int(Authorize.get_jwt_subject())
-    
-    await database.connect()
-    query = Notifications.select().where(
-        Notifications.c.notification_id == notification_id,
-        Notifications.c.user_id == user_id
-    )
-    notification = await database.fetch_one(query)
-    
-    if not notification:
-        await database.disconnect()
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Notification not found or not authorized"
-        )
-    
-    update_query = (
-        Notifications.update()
-        .where(Notifications.c.notification_id == notification_id)
-        .values(is_read=True)
-    )
-    await database.execute(update_query)
-    await database.disconnect()
-    
-    return {"message": "Notification marked as read", "notification_id": notification_id}
-
-@router.put("/read-all")
-async def mark_all_notifications_read(Authorize: AuthJWT = Depends()):
-    Authorize.jwt_required()
-    user_id = int(Authorize.get_jwt_subject())
-    
-    await database.connect()
-    update_query = (
-        Notifications.update()
-        .where(Notifications.c.user_id == user_id, Notifications.c.is_read == False)
-        .values(is_read=True)
-    )
-    await database.execute(update_query)
-    await database.disconnect()
-    
-    return {"message": "All notifications marked as read"}
-
-@router.post("/answer")
-async def create_answer_notification(answer_id: int, Authorize: AuthJWT = Depends()):
-    Authorize.jwt_required()
-    current_user_id = int(Authorize.get_jwt_subject())
-    
-    await database.connect()
-    # Fetch answer and related question
-    answer_query = Answers.select().where(Answers.c.id == answer_id)
-    answer = await database.fetch_one(answer_query)
-    
-    if not answer:
-        await database.disconnect()
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Answer not found"
-        )
-    
-    question_query = Questions.select().where(Questions.c.question_id == answer["question_id"])
-    question = await database.fetch_one(question_query)
-    
-    if not question:
-        await database.disconnect()
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Question not found"
-        )
-    
-    # Get question owner's user_id
-    recipient_id = question["user_id"]
-    
-    # Prevent self-notification
-    if recipient_id == current_user_id:
-        await database.disconnect()
-        return {"message": "No notification created (self-answer)"}
-    
-    # Create notification
-    user_query = Users.select().where(Users.c.user_id == current_user_id)
-    user = await database.fetch_one(user_query)
-    message = f"User {user['username']} answered your question: {question['title']}"
-    
-    query = Notifications.insert().values(
-        user_id=recipient_id,
-        type=NotificationType.answer,
-        related_id=answer_id,
-        message=message,
-        is_read=False,
-        created_at=datetime.utcnow()
-    )
-    notification_id = await database.execute(query)
-    await database.disconnect()
-    
-    return {"message": "Notification created", "notification_id": notification_id}
-
-@router.post("/mention")
-async def create_mention_notification(answer_id: int, Authorize: AuthJWT = Depends()):
-    Authorize.jwt_required()
-    current_user_id = int(Authorize.get_jwt_subject())
-    
-    await database.connect()
-    # Fetch answer
-    answer_query = Answers.select().where(Answers.c.id == answer_id)
-    answer = await database.fetch_one(answer_query)
-    
-    if not answer:
-        await database.disconnect()
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Answer not found"
-        )
-    
-    # Parse answer description for mentions
-    mentions = re.findall(r'@(\w+)', answer["description"])
-    if not mentions:
-        await database.disconnect()
-        return {"message": "No mentions found in answer"}
-    
-    # Fetch question for context
-    question_query = Questions.select().where(Questions.c.question_id == answer["question_id"])
-    question = await database.fetch_one(question_query)
-    if not question:
-        await database.disconnect()
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Question not found"
-        )
-    
-    current_user_query = Users.select().where(Users.c.user_id == current_user_id)
-    current_user = await database.fetch_one(current_user_query)
-    
-    notification_ids = []
-    for username in mentions:
-        # Fetch mentioned user
-        user_query = Users.select().where(Users.c.id == username)
-        mentioned_user = await database.fetch_one(user_query)
-        
-        if not mentioned_user or mentioned_user["user_id"] == current_user_id:
-            continue  # Skip if user not found or self-mention
-        
-        # Create notification
-        message = f"User {current_user['username']} mentioned you in an answer to question: {question['title']}"
-        query = Notifications.insert().values(
-            user_id=mentioned_user["user_id"],
-            type=NotificationType.mention,
-            related_id=answer_id,
-            message=message,
-            is_read=False,
-            created_at=datetime.utcnow()
-        )
-        notification_id = await database.execute(query)
-        notification_ids.append(notification_id)
-    
-    await database.disconnect()
-    
-    if not notification_ids:
-        return {"message": "No valid mentions processed"}
-    return {"message": "Notifications created", "notification_ids": notification_ids}
\ No newline at end of file
+from typing_extensions import Annotated
+from fastapi import APIRouter, Cookie, Depends, Header, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
+from datetime import datetime
+import asyncio
+import json
+import os
+import re
+from sqlalchemy import select, insert, literal, cast, false, func, tuple_, bindparam
+from ..lib.db import database, get_connection, Notifications, NotificationCounters, NotificationType, Users, Questions, Answers
+from ..lib.models import NotificationResponse, NotificationPage, Principal
+from ..lib.auth import resolve_principal
+from ..lib.pagination import encode_cursor, decode_cursor, NEXT
+from ..lib import queries
+from ..lib.profiler import query_budget
+from ..lib.notifier import notification_queue, insert_notifications, build_notification, publish_notifications, count_unread
+from ..lib.pubsub import notification_hub, notification_event, OVERFLOW
+
+router = APIRouter(prefix="/api/notifications", tags=["Notifications"], dependencies=[Depends(get_connection)])
+# Long-lived streams must not hold a pooled connection, so they get their own router
+stream_router = APIRouter(prefix="/api/notifications", tags=["Notifications"])
+
+# Page size for the inbox; clients may request up to MAX_PAGE_SIZE
+DEFAULT_PAGE_SIZE = int(os.environ.get("NOTIFICATIONS_PAGE_SIZE", 20))
+MAX_PAGE_SIZE = int(os.environ.get("NOTIFICATIONS_MAX_PAGE_SIZE", 100))
+# Mentions beyond this many distinct usernames in one post are ignored
+MAX_MENTIONS_PER_POST = int(os.environ.get("MAX_MENTIONS_PER_POST", 20))
+# Seconds between keepalive comments on an idle stream
+STREAM_KEEPALIVE = float(os.environ.get("NOTIFICATION_STREAM_KEEPALIVE", 15))
+# Missed notifications are replayed, when a stream resumes, in pages of this many
+STREAM_REPLAY_LIMIT = int(os.environ.get("NOTIFICATION_STREAM_REPLAY_LIMIT", 500))
+
+async def require_principal(access_token: Annotated[Optional[str], Cookie()] = None) -> Principal:
+    # Resolve the access_token cookie to the acting user, or reject the request
+    principal = await resolve_principal(access_token)
+    if not principal:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Unauthorized"
+        )
+    return principal
+
+async def require_user(principal: Principal = Depends(require_principal)) -> int:
+    return principal.user_id
+
+def extract_mentions(text: str) -> List[str]:
+    # Distinct @usernames in order of first appearance, capped at MAX_MENTIONS_PER_POST
+    mentions = list(dict.fromkeys(re.findall(r'@(\w+)', text)))
+    return mentions[:MAX_MENTIONS_PER_POST]
+
+def build_inbox_query(unread_only: bool, cursor: bool):
+    query = select(*Notifications.c).where(Notifications.c.user_id == bindparam("user_id"))
+    if unread_only:
+        # Matches the predicate of the partial unread index
+        query = query.where(Notifications.c.is_read == false())
+    if cursor:
+        query = query.where(
+            tuple_(Notifications.c.created_at, Notifications.c.notification_id) < tuple_(
+                bindparam("cursor_created_at", type_=Notifications.c.created_at.type),
+                bindparam("cursor_id", type_=Notifications.c.notification_id.type)
+            )
+        )
+    return query.order_by(
+        Notifications.c.created_at.desc(), Notifications.c.notification_id.desc()
+    ).limit(bindparam("limit"))
+
+# GET /api/notifications - A page of the user's notifications, newest first
+@router.get("/", response_model=NotificationPage)
+@query_budget(2)
+async def get_notifications(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    unread_only: bool = False,
+    user_id: int = Depends(require_user)
+):
+    # Keyset pagination over (created_at, notification_id) within the user's inbox
+    values = {"user_id": user_id, "limit": limit + 1}
+    if cursor:
+        cursor_created_at, cursor_id, direction = decode_cursor(cursor)
+        if direction != NEXT:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+        values["cursor_created_at"] = cursor_created_at
+        values["cursor_id"] = cursor_id
+    shape = (unread_only, bool(cursor))
+    query = queries.statement(("notifications.inbox", shape), lambda: build_inbox_query(*shape))
+    notifications = await queries.fetch_all(query, **values)
+    next_cursor = None
+    if len(notifications) > limit:
+        notifications = notifications[:limit]
+        last = notifications[-1]
+        next_cursor = encode_cursor(last["created_at"], last["notification_id"], NEXT)
+
+    return NotificationPage(
+        notifications=[
+            NotificationResponse(
+                notification_id=notification["notification_id"],
+                user_id=notification["user_id"],
+                type=notification["type"],
+                related_id=notification["related_id"],
+                message=notification["message"],
+                is_read=notification["is_read"],
+                created_at=notification["created_at"]
+            )
+            for notification in notifications
+        ],
+        next_cursor=next_cursor
+    )
+
+# GET /api/notifications/unread-count - Unread badge count from the per-user counter
+@router.get("/unread-count")
+@query_budget(2)
+async def get_unread_count(user_id: int = Depends(require_user)):
+    query = queries.statement("notifications.unread_count", lambda: select(
+        NotificationCounters.c.unread_count
+    ).where(NotificationCounters.c.user_id == bindparam("user_id")))
+    unread_count = await queries.fetch_val(query, user_id=user_id)
+    return {"unread_count": unread_count or 0}
+
+@router.put("/{notification_id}/read")
+@query_budget(3)
+async def mark_notification_read(notification_id: int, user_id: int = Depends(require_user)):
+    # Only a row that actually flips from unread to read decrements the counter,
+    # so repeated or concurrent calls cannot double count.
+    update_query = (
+        Notifications.update()
+        .where(
+            Notifications.c.notification_id == notification_id,
+            Notifications.c.user_id == user_id,
+            Notifications.c.is_read == false()
+        )
+        .values(is_read=True)
+        .returning(Notifications.c.notification_id)
+    )
+    async with database.transaction():
+        marked = await database.fetch_one(update_query)
+        if marked:
+            await database.execute(
+                NotificationCounters.update()
+                .where(NotificationCounters.c.user_id == user_id)
+                .values(unread_count=func.greatest(NotificationCounters.c.unread_count - 1, 0))
+            )
+
+    if not marked:
+        # Either already read or not this user's notification
+        query = select(Notifications.c.notification_id).where(
+            Notifications.c.notification_id == notification_id,
+            Notifications.c.user_id == user_id
+        )
+        if await database.fetch_one(query) is None:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Notification not found or not authorized"
+            )
+    
+    return {"message": "Notification marked as read", "notification_id": notification_id}
+
+@router.put("/read-all")
+@query_budget(2)
+async def mark_all_notifications_read(user_id: int = Depends(require_user)):
+    # Subtract exactly the rows this statement flipped rather than zeroing the
+    # counter: a notification written concurrently stays unread and counted
+    marked = (
+        Notifications.update()
+        .where(Notifications.c.user_id == user_id, Notifications.c.is_read == False)
+        .values(is_read=True)
+        .returning(Notifications.c.notification_id)
+        .cte("marked")
+    )
+    flipped = select(func.count()).select_from(marked).scalar_subquery()
+    await database.execute(
+        NotificationCounters.update()
+        .where(NotificationCounters.c.user_id == user_id)
+        .values(unread_count=func.greatest(NotificationCounters.c.unread_count - flipped, 0))
+    )
+    
+    return {"message": "All notifications marked as read"}
+
+# GET /api/notifications/queue - Background notification queue status (admins only)
+@router.get("/queue")
+async def get_notification_queue(principal: Principal = Depends(require_principal)):
+    if principal.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admins only"
+        )
+    return {"depth": notification_queue.depth, "failed": notification_queue.failed}
+
+@router.post("/answer")
+async def create_answer_notification(answer_id: int, principal: Principal = Depends(require_principal)):
+    # The answer and its question's owner and title in one query; the acting
+    # user's name comes from the principal
+    question_query = select(Questions.c.user_id, Questions.c.title).select_from(
+        Answers.join(Questions, Answers.c.question_id == Questions.c.question_id)
+    ).where(Answers.c.answer_id == answer_id)
+    question = await database.fetch_one(question_query)
+    
+    if not question:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Answer not found"
+        )
+    
+    # Get question owner's user_id
+    recipient_id = question["user_id"]
+    
+    # Prevent self-notification
+    if recipient_id == principal.user_id:
+        return {"message": "No notification created (self-answer)"}
+    
+    # Create notification
+    message = f"User {principal.username} answered your question: {question['title']}"
+    
+    # Goes through insert_notifications so the recipient's unread counter stays in step
+    rows = await insert_notifications([
+        build_notification(recipient_id, NotificationType.answer, answer_id, message)
+    ])
+    await publish_notifications(rows)
+    notification_id = rows[0]["notification_id"]
+    
+    return {"message": "Notification created", "notification_id": notification_id}
+
+@router.post("/mention")
+async def create_mention_notification(answer_id: int, principal: Principal = Depends(require_principal)):
+    # Fetch answer together with its question's title
+    answer_query = select(Answers.c.description, Questions.c.title).join(
+        Questions, Answers.c.question_id == Questions.c.question_id
+    ).where(Answers.c.answer_id == answer_id)
+    answer = await database.fetch_one(answer_query)
+    
+    if not answer:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Answer not found"
+        )
+    
+    # Parse answer description for mentions
+    mentions = extract_mentions(answer["description"])
+    if not mentions:
+        return {"message": "No mentions found in answer"}
+    
+    # Resolve every mentioned username and insert all notifications in one statement;
+    # unknown usernames and self-mentions simply match no row. Values are cast so
+    # PostgreSQL types the SELECT list from the target columns.
+    message = f"User {principal.username} mentioned you in an answer to question: {answer['title']}"
+    recipients = select(
+        Users.c.user_id,
+        cast(literal(NotificationType.mention.value), Notifications.c.type.type),
+        cast(literal(answer_id), Notifications.c.related_id.type),
+        cast(literal(message), Notifications.c.message.type),
+        false(),
+        cast(literal(datetime.utcnow()), Notifications.c.created_at.type)
+    ).where(
+        Users.c.username.in_(mentions),
+        Users.c.user_id != principal.user_id
+    )
+    query = insert(Notifications).from_select(
+        ["user_id", "type", "related_id", "message", "is_read", "created_at"],
+        recipients
+    ).returning(*Notifications.c)
+    async with database.transaction():
+        rows = await database.fetch_all(query)
+        await count_unread(rows)
+    notification_ids = [row["notification_id"] for row in rows]
+    
+    if not notification_ids:
+        return {"message": "No valid mentions processed"}
+    await publish_notifications(rows)
+    return {"message": "Notifications created", "notification_ids": notification_ids}
+
+def format_event(event: dict) -> str:
+    return f"id: {event['notification_id']}\nevent: notification\ndata: {json.dumps(event)}\n\n"
+
+# GET /api/notifications/stream - Server-Sent Events stream of new notifications.
+# Reconnecting clients send Last-Event-ID (or ?last_id=) and first receive what they missed.
+@stream_router.get("/stream")
+async def stream_notifications(
+    last_event_id: Annotated[Optional[str], Header()] = None,
+    last_id: Optional[int] = Query(None, ge=0),
+    user_id: int = Depends(require_user)
+):
+    resume_from = last_id
+    if last_event_id is not None:
+        try:
+            resume_from = int(last_event_id)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid Last-Event-ID"
+            )
+
+    async def events():
+        # Subscribe before replaying so nothing written in between is lost
+        queue = notification_hub.subscribe(user_id)
+        try:
+            replayed = set()
+            after = resume_from
+            # Page through everything missed, however much that is, before going live
+            while after is not None:
+                query = select(*Notifications.c).where(
+                    Notifications.c.user_id == user_id,
+                    Notifications.c.notification_id > after
+                ).order_by(Notifications.c.notification_id).limit(STREAM_REPLAY_LIMIT)
+                rows = await database.fetch_all(query)
+                for row in rows:
+                    replayed.add(row["notification_id"])
+                    yield format_event(notification_event(row))
+                after = rows[-1]["notification_id"] if len(rows) == STREAM_REPLAY_LIMIT else None
+            # Tell the browser how long to wait before reconnecting
+            yield "retry: 3000\n\n"
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is OVERFLOW:
+                    return
+                if event["notification_id"] in replayed:
+                    continue
+                yield format_event(event)
+        finally:
+            notification_hub.unsubscribe(user_id, queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
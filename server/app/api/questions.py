@@ -1,109 +1,289 @@
 from typing_extensions import Annotated
-from typing import Optional
-from fastapi import APIRouter, Response, status, Cookie, HTTPException
-from sqlalchemy import select, update, insert
+from typing import List, Literal, Optional, Tuple
+from fastapi import APIRouter, Depends, Request, Response, status, Cookie, Header, HTTPException, Query
+from sqlalchemy import select, update, insert, tuple_, or_, true, case, cast, literal_column, func, bindparam, Text, TIMESTAMP, BigInteger, Boolean, Integer
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from datetime import datetime
-from ..lib.db import database, Questions, Answers, Users, Notifications, NotificationType
-from ..lib.auth import verify_jwt
+from ..lib.db import database, get_connection, request_connection, reading_from_replica, pinned_to_primary, DB_REPLICA_MAX_LAG, question_columns, answer_columns, answer_score, answer_order, Questions, Answers, Users, NotificationType
+from ..lib.auth import resolve_principal
+from ..lib.pagination import encode_cursor, decode_cursor, encode_key, decode_key, naive_utc, NEXT, PREV
+from ..lib.tags import normalize_tags, adjust_tag_counts
+from ..lib.notifier import notify
+from ..lib.cache import question_pages, make_etag, etag_matches
+from ..lib.mappers import question_response
+from ..lib.models import QuestionFeed, QuestionPage, AnswerPage
+from ..lib import queries
+from ..lib.profiler import query_budget
+from ..lib.ratelimit import admit
+from ..lib.trending import question_feeds
 import json
+import os
+import orjson
+
+# Page size for the question feed; clients may request up to MAX_PAGE_SIZE
+DEFAULT_PAGE_SIZE = int(os.environ.get("QUESTIONS_PAGE_SIZE", 20))
+MAX_PAGE_SIZE = int(os.environ.get("QUESTIONS_MAX_PAGE_SIZE", 100))
+
+# Answers shown with a question, and the most a client may request per further page
+ANSWERS_PAGE_SIZE = int(os.environ.get("ANSWERS_PAGE_SIZE", 20))
+ANSWERS_MAX_PAGE_SIZE = int(os.environ.get("ANSWERS_MAX_PAGE_SIZE", 100))
+
+# SQLSTATE raised when the one-accepted-answer constraint rejects a commit
+EXCLUSION_VIOLATION = "23P01"
 
 # Router for handling question-related operations
-router = APIRouter(prefix="/api/questions", tags=["Questions"])
+router = APIRouter(prefix="/api/questions", tags=["Questions"], dependencies=[Depends(admit)])
 
-# GET /api/questions - Fetch all questions
-@router.get("/")
-async def get_questions():
+# GET /api/questions - Fetch a page of questions, newest first
+@router.get("/", response_model=QuestionFeed, dependencies=[Depends(get_connection)])
+@query_budget(1)
+async def get_questions(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    author: Optional[str] = None,
+    tag: Optional[List[str]] = Query(None),
+    tag_mode: Literal["any", "all"] = "all",
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None
+):
+    # Keyset pagination over (created_at, question_id): each page is an index range scan
+    # of at most limit + 1 rows, however deep into the feed the cursor points.
+    direction = NEXT
+    if cursor:
+        cursor_created_at, cursor_id, direction = decode_cursor(cursor)
     try:
-        query = select(Questions, Users.c.username).join(
-            Users, Questions.c.user_id == Users.c.user_id
-        )
-        questions = await database.fetch_all(query)
-        return [
-            {
-                "question_id": q["question_id"],
-                "user_id": q["user_id"],
-                "title": q["title"],
-                "description": q["description"],
-                "tags": q["tags"],
-                "created_at": q["created_at"],
-                "updated_at": q["updated_at"],
-                "username": q["username"]
-            }
-            for q in questions
-        ]
+        tags = normalize_tags(tag or [])
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    try:
+        # One registered statement per combination of filters in use
+        values = {"limit": limit + 1}
+        if author:
+            values["author"] = author
+        if tags:
+            values["tags"] = tags
+        if created_after:
+            values["created_after"] = naive_utc(created_after)
+        if created_before:
+            values["created_before"] = naive_utc(created_before)
+        if cursor:
+            values["cursor_created_at"] = cursor_created_at
+            values["cursor_id"] = cursor_id
+        shape = (bool(author), tag_mode if tags else None, bool(created_after), bool(created_before), direction, bool(cursor))
+        query = queries.statement(("questions.feed", shape), lambda: build_feed_query(*shape))
+
+        # Fetch one extra row to know whether another page exists
+        rows = await queries.fetch_all(query, **values)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if direction == PREV:
+            rows.reverse()
+
+        next_cursor = None
+        prev_cursor = None
+        if rows:
+            first, last = rows[0], rows[-1]
+            if direction == NEXT:
+                if has_more:
+                    next_cursor = encode_cursor(last["created_at"], last["question_id"], NEXT)
+                if cursor:
+                    prev_cursor = encode_cursor(first["created_at"], first["question_id"], PREV)
+            else:
+                if has_more:
+                    prev_cursor = encode_cursor(first["created_at"], first["question_id"], PREV)
+                next_cursor = encode_cursor(last["created_at"], last["question_id"], NEXT)
+
+        return {
+            "questions": [question_response(q) for q in rows],
+            "next_cursor": next_cursor,
+            "prev_cursor": prev_cursor
+        }
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error fetching questions: {str(e)}"
         )
 
-# GET /api/questions/<id> - Fetch a specific question with its answers
-@router.get("/{question_id}")
-async def get_question(question_id: int):
-    try:
-        # Fetch question
-        query = select(Questions, Users.c.username).join(
-            Users, Questions.c.user_id == Users.c.user_id
-        ).where(Questions.c.question_id == question_id)
-        question = await database.fetch_one(query)
-        
-        if not question:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Question not found"
-            )
+def build_feed_query(author: bool, tag_mode: Optional[str], created_after: bool, created_before: bool, direction: str, cursor: bool):
+    """
+    The feed statement for one combination of filters, with bind parameters named
+    after the values get_questions passes.
+    """
+    query = select(*question_columns, Users.c.username).join(
+        Users, Questions.c.user_id == Users.c.user_id
+    )
 
-        # Fetch answers
-        answers_query = select(Answers, Users.c.username).join(
-            Users, Answers.c.user_id == Users.c.user_id
-        ).where(Answers.c.question_id == question_id)
-        answers = await database.fetch_all(answers_query)
+    # Optional filters
+    if author:
+        query = query.where(Users.c.username == bindparam("author"))
+    if tag_mode == "all":
+        # Both operators are served by the GIN index on tags
+        query = query.where(Questions.c.tags.contains(bindparam("tags", type_=Questions.c.tags.type)))
+    elif tag_mode == "any":
+        query = query.where(Questions.c.tags.overlap(bindparam("tags", type_=Questions.c.tags.type)))
+    if created_after:
+        query = query.where(Questions.c.created_at >= bindparam("created_after", type_=TIMESTAMP))
+    if created_before:
+        query = query.where(Questions.c.created_at < bindparam("created_before", type_=TIMESTAMP))
 
-        return {
-            "question": {
-                "question_id": question["question_id"],
-                "user_id": question["user_id"],
-                "title": question["title"],
-                "description": question["description"],
-                "tags": question["tags"],
-                "created_at": question["created_at"],
-                "updated_at": question["updated_at"],
-                "username": question["username"]
-            },
-            "answers": [
-                {
-                    "answer_id": a["answer_id"],
-                    "user_id": a["user_id"],
-                    "description": a["description"],
-                    "img_url": a["img_url"],
-                    "tags": a["tags"],
-                    "upvotes": a["upvotes"],
-                    "downvotes": a["downvotes"],
-                    "is_accepted": a["is_accepted"],
-                    "created_at": a["created_at"],
-                    "updated_at": a["updated_at"],
-                    "username": a["username"]
-                }
-                for a in answers
-            ]
-        }
+    key = tuple_(Questions.c.created_at, Questions.c.question_id)
+    after = tuple_(bindparam("cursor_created_at", type_=TIMESTAMP), bindparam("cursor_id", type_=BigInteger))
+    if direction == NEXT:
+        if cursor:
+            query = query.where(key < after)
+        query = query.order_by(Questions.c.created_at.desc(), Questions.c.question_id.desc())
+    else:
+        query = query.where(key > after)
+        query = query.order_by(Questions.c.created_at.asc(), Questions.c.question_id.asc())
+    return query.limit(bindparam("limit"))
+
+def answers_page(question_id, after: bool = False):
+    """
+    SELECT producing one page of a question's answers as a JSON array (text), accepted
+    answer first, then by score. Binds :limit (pass one more than the page size so
+    callers can tell whether another page exists) and, with after, the previous
+    page's last key as :after_accepted, :after_score, :after_id. question_id is a
+    bind parameter or a correlated column.
+    """
+    page = select(
+        *answer_columns, Users.c.username, answer_score.label("score")
+    ).join(
+        Users, Answers.c.user_id == Users.c.user_id
+    ).where(Answers.c.question_id == question_id)
+    if after:
+        # Served by ix_answers_question_id_rank, which has the same key order
+        page = page.where(tuple_(Answers.c.is_accepted, answer_score, Answers.c.answer_id) < tuple_(
+            bindparam("after_accepted", type_=Boolean),
+            bindparam("after_score", type_=Integer),
+            bindparam("after_id", type_=BigInteger)
+        ))
+    # correlate() keeps a column question_id pointing at the enclosing query's row
+    page = page.order_by(*answer_order).limit(bindparam("limit")).correlate(Questions).subquery("page")
+
+    # Keys are inlined: json_build_object takes "any", so bound keys would be untyped
+    answer = func.json_build_object(*[part for c in page.c for part in (literal_column(f"'{c.name}'"), c)])
+    answers = func.json_agg(aggregate_order_by(
+        answer, page.c.is_accepted.desc(), page.c.score.desc(), page.c.answer_id.desc()
+    ))
+    return select(cast(func.coalesce(answers, literal_column("'[]'::json")), Text).label("answers"))
+
+def split_answers_page(raw: str, limit: int) -> Tuple[list, Optional[str]]:
+    answers = orjson.loads(raw)
+    next_cursor = None
+    if len(answers) > limit:
+        answers = answers[:limit]
+        last = answers[-1]
+        next_cursor = encode_key(last["is_accepted"], last["score"], last["answer_id"])
+    return answers, next_cursor
+
+# GET /api/questions/<id> - Fetch a specific question with the first page of its answers.
+# No router-wide connection: it is acquired inside, only when the page isn't cached.
+@router.get("/{question_id}", response_model=QuestionPage)
+@query_budget(1)
+async def get_question(
+    question_id: int,
+    request: Request,
+    if_none_match: Annotated[Optional[str], Header()] = None
+):
+    try:
+        # Read the version before querying so a render that races a write is
+        # cached under the superseded version and never served
+        version = await question_pages.version(question_id)
+        # A client that just wrote renders from the primary rather than trusting a
+        # page a lagging replica may have rendered after the invalidation
+        cached = None if pinned_to_primary(request) else await question_pages.get(question_id, version)
+        if cached is None:
+            # Only a miss takes a pooled connection; cache hits and 304s never touch the database
+            async with request_connection(request):
+                cached = await render_question(question_id)
+                # Replica renders can miss the latest write, so they're kept no longer
+                # than a replica may lag before it is taken out of rotation
+                ttl = DB_REPLICA_MAX_LAG if reading_from_replica() else None
+            await question_pages.set(question_id, version, cached, ttl)
+        etag, content = cached
+
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(content=content, media_type="application/json", headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error fetching question: {str(e)}"
         )
 
+async def render_question(question_id: int) -> Tuple[str, bytes]:
+    # Query and serialize a question page once; the bytes are reused until invalidated.
+    # The question, its author and the first page of answers come back in one row.
+    question = await queries.fetch_one(
+        queries.statement("questions.detail", build_detail_query),
+        question_id=question_id,
+        limit=ANSWERS_PAGE_SIZE + 1
+    )
+    
+    if not question:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Question not found"
+        )
+
+    answers, next_cursor = split_answers_page(question["answers"], ANSWERS_PAGE_SIZE)
+    page = {
+        "question": question_response(question),
+        "answers": answers,
+        "answers_next_cursor": next_cursor
+    }
+    # The page holds only JSON-native values and datetimes, which orjson encodes directly
+    content = orjson.dumps(page)
+    return make_etag(content), content
+
+def build_detail_query():
+    answers = answers_page(Questions.c.question_id).lateral("answer_page")
+    return select(*question_columns, Users.c.username, answers.c.answers).select_from(
+        Questions.join(Users, Questions.c.user_id == Users.c.user_id).join(answers, true())
+    ).where(Questions.c.question_id == bindparam("question_id"))
+
+# GET /api/questions/<id>/answers?cursor=... - Further pages of a question's answers
+@router.get("/{question_id}/answers", response_model=AnswerPage, dependencies=[Depends(get_connection)])
+@query_budget(1)
+async def get_answers(
+    question_id: int,
+    cursor: str,
+    limit: int = Query(ANSWERS_PAGE_SIZE, ge=1, le=ANSWERS_MAX_PAGE_SIZE)
+):
+    after_accepted, after_score, after_id = decode_key(cursor, bool, int, int)
+    try:
+        raw = await queries.fetch_val(
+            queries.statement("questions.answers_page", lambda: answers_page(bindparam("question_id"), after=True)),
+            question_id=question_id,
+            limit=limit + 1,
+            after_accepted=after_accepted,
+            after_score=after_score,
+            after_id=after_id
+        )
+        answers, next_cursor = split_answers_page(raw, limit)
+        return {"answers": answers, "next_cursor": next_cursor}
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error fetching answers: {str(e)}"
+        )
+
 # POST /api/questions - Create a new question
-@router.post("/", status_code=status.HTTP_201_CREATED)
+@router.post("/", status_code=status.HTTP_201_CREATED, dependencies=[Depends(get_connection)])
 async def create_question(
     question: dict,
     response: Response,
     access_token: Annotated[Optional[str], Cookie()] = None
 ):
-    user_id = await verify_jwt(access_token)
-    if not user_id:
+    principal = await resolve_principal(access_token)
+    if not principal:
         response.status_code = status.HTTP_401_UNAUTHORIZED
         return {"message": "Unauthorized"}
+    user_id = principal.user_id
 
     try:
         # Validate input
@@ -128,33 +308,26 @@ async def create_question(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Invalid tags format; must be a JSON array"
                 )
+        tags = normalize_tags(tags)
 
-        # Insert question
-        query = insert(Questions).values(
-            user_id=user_id,
-            title=title,
-            description=description,
-            tags=tags,
-            created_at=datetime.utcnow()
-        )
-        question_id = await database.execute(query)
-        
-        # Fetch the created question with username
-        result_query = select(Questions, Users.c.username).join(
-            Users, Questions.c.user_id == Users.c.user_id
-        ).where(Questions.c.question_id == question_id)
-        result = await database.fetch_one(result_query)
+        # Insert question and count its tags atomically
+        async with database.transaction():
+            query = insert(Questions).values(
+                user_id=user_id,
+                title=title,
+                description=description,
+                tags=tags,
+                created_at=datetime.utcnow()
+            ).returning(*question_columns)
+            result = await database.fetch_one(query)
+            await adjust_tag_counts(added=tags)
+        question_feeds.question_created(result["question_id"], result["created_at"])
 
-        return {
-            "question_id": result["question_id"],
-            "user_id": result["user_id"],
-            "title": result["title"],
-            "description": result["description"],
-            "tags": result["tags"],
-            "created_at": result["created_at"],
-            "updated_at": result["updated_at"],
-            "username": result["username"]
-        }
+        # The author is the caller, so the username comes from the principal
+        return question_response(result, username=principal.username)
+    except HTTPException as e:
+        response.status_code = e.status_code
+        return {"message": e.detail}
     except (json.JSONDecodeError, ValueError) as e:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {"message": f"Error creating question: {str(e)}"}
@@ -163,35 +336,20 @@ async def create_question(
         return {"message": f"Unexpected error: {str(e)}"}
 
 # PUT /api/questions/<id> - Update a question
-@router.put("/{question_id}")
+@router.put("/{question_id}", dependencies=[Depends(get_connection)])
 async def update_question(
     question_id: int,
     question: dict,
     response: Response,
     access_token: Annotated[Optional[str], Cookie()] = None
 ):
-    user_id = await verify_jwt(access_token)
-    if not user_id:
+    principal = await resolve_principal(access_token)
+    if not principal:
         response.status_code = status.HTTP_401_UNAUTHORIZED
         return {"message": "Unauthorized"}
+    user_id = principal.user_id
 
     try:
-        # Check if question exists and user is owner
-        query = select(Questions).where(Questions.c.question_id == question_id)
-        existing_question = await database.fetch_one(query)
-        
-        if not existing_question:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Question not found"
-            )
-        
-        if existing_question["user_id"] != user_id:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Not authorized to edit this question"
-            )
-
         # Prepare update values
         update_values = {}
         if "title" in question and question["title"]:
@@ -205,37 +363,54 @@ async def update_question(
                     tags = json.loads(tags)
                 if not isinstance(tags, list):
                     raise ValueError("Tags must be a list")
-                update_values["tags"] = tags
+                update_values["tags"] = normalize_tags(tags)
             except (json.JSONDecodeError, ValueError):
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Invalid tags format; must be a JSON array"
                 )
-        if update_values:
-            update_values["updated_at"] = datetime.utcnow()
+        if not update_values:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Nothing to update"
+            )
+        update_values["updated_at"] = datetime.utcnow()
 
-        # Update question
-        update_query = update(Questions).where(
-            Questions.c.question_id == question_id
-        ).values(**update_values)
-        await database.execute(update_query)
+        async with database.transaction():
+            # Update only if the caller owns the question. The old tags come from a
+            # row-locked read in the same statement, so tag counts stay consistent.
+            old = select(Questions.c.question_id, Questions.c.tags).where(
+                Questions.c.question_id == question_id
+            ).with_for_update().subquery("old")
+            update_query = update(Questions).where(
+                Questions.c.question_id == old.c.question_id,
+                Questions.c.user_id == user_id
+            ).values(**update_values).returning(*question_columns, old.c.tags.label("old_tags"))
+            result = await database.fetch_one(update_query)
 
-        # Fetch updated question with username
-        result_query = select(Questions, Users.c.username).join(
-            Users, Questions.c.user_id == Users.c.user_id
-        ).where(Questions.c.question_id == question_id)
-        result = await database.fetch_one(result_query)
+            if result and "tags" in update_values:
+                old_tags, new_tags = set(result["old_tags"]), set(update_values["tags"])
+                await adjust_tag_counts(added=new_tags - old_tags, removed=old_tags - new_tags)
 
-        return {
-            "question_id": result["question_id"],
-            "user_id": result["user_id"],
-            "title": result["title"],
-            "description": result["description"],
-            "tags": result["tags"],
-            "created_at": result["created_at"],
-            "updated_at": result["updated_at"],
-            "username": result["username"]
-        }
+        if not result:
+            # Nothing updated; work out why only on this failure path
+            owner_query = select(Questions.c.user_id).where(Questions.c.question_id == question_id)
+            owner = await database.fetch_one(owner_query)
+            if not owner:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Question not found"
+                )
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Not authorized to edit this question"
+            )
+        await question_pages.invalidate(question_id)
+
+        return question_response(result, username=principal.username)
+    except HTTPException as e:
+        response.status_code = e.status_code
+        return {"message": e.detail}
     except (json.JSONDecodeError, ValueError) as e:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {"message": f"Error updating question: {str(e)}"}
@@ -243,72 +418,97 @@ async def update_question(
         response.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
         return {"message": f"Unexpected error: {str(e)}"}
 
+def build_accept_query():
+    target_answer = Answers.alias("target")
+    target = select(target_answer.c.answer_id).where(
+        target_answer.c.answer_id == bindparam("answer_id"),
+        target_answer.c.question_id == bindparam("question_id")
+    ).exists()
+    # Read before the update, so moving the flag keeps the question's acceptance time
+    accepted = Answers.alias("accepted")
+    accepted_at = select(func.min(accepted.c.accepted_at)).where(
+        accepted.c.question_id == bindparam("question_id"),
+        accepted.c.is_accepted == true()
+    ).scalar_subquery()
+    now = bindparam("now", type_=Answers.c.updated_at.type)
+    return (
+        update(Answers)
+        .where(
+            Answers.c.question_id == Questions.c.question_id,
+            Answers.c.question_id == bindparam("question_id"),
+            Questions.c.user_id == bindparam("user_id"),
+            or_(Answers.c.answer_id == bindparam("answer_id"), Answers.c.is_accepted == true()),
+            target
+        )
+        .values(
+            is_accepted=Answers.c.answer_id == bindparam("answer_id"),
+            accepted_at=case(
+                (Answers.c.answer_id == bindparam("answer_id"), func.coalesce(accepted_at, now)),
+                else_=None
+            ),
+            updated_at=case(
+                (Answers.c.answer_id == bindparam("answer_id"), now),
+                else_=Answers.c.updated_at
+            )
+        )
+        .returning(Answers.c.answer_id, Answers.c.user_id, Answers.c.is_accepted, Questions.c.title)
+    )
+
 # POST /api/questions/<question_id>/accept/<answer_id> - Accept an answer
-@router.post("/{question_id}/accept/{answer_id}")
+@router.post("/{question_id}/accept/{answer_id}", dependencies=[Depends(get_connection)])
+@query_budget(3)
 async def accept_answer(
     question_id: int,
     answer_id: int,
     response: Response,
     access_token: Annotated[Optional[str], Cookie()] = None
 ):
-    user_id = await verify_jwt(access_token)
-    if not user_id:
+    principal = await resolve_principal(access_token)
+    if not principal:
         response.status_code = status.HTTP_401_UNAUTHORIZED
         return {"message": "Unauthorized"}
+    user_id = principal.user_id
 
     try:
-        # Check if question exists and user is owner
-        question_query = select(Questions).where(Questions.c.question_id == question_id)
-        question = await database.fetch_one(question_query)
-        if not question:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Question not found"
-            )
-        if question["user_id"] != user_id:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Not authorized to accept answers for this question"
-            )
-
-        # Check if answer exists and belongs to the question
-        answer_query = select(Answers).where(
-            (Answers.c.answer_id == answer_id) & (Answers.c.question_id == question_id)
+        # One conditional UPDATE validates ownership and moves the accepted flag:
+        # it touches the target answer and any previously accepted one, and only
+        # when the caller owns the question and the answer belongs to it.
+        rows = await queries.fetch_all(
+            queries.statement("questions.accept", build_accept_query),
+            question_id=question_id,
+            answer_id=answer_id,
+            user_id=user_id,
+            now=datetime.utcnow()
         )
-        answer = await database.fetch_one(answer_query)
-        if not answer:
+        accepted = next((row for row in rows if row["is_accepted"]), None)
+
+        if accepted is None:
+            # Nothing changed; work out why only on this failure path
+            question_query = select(Questions.c.user_id).where(Questions.c.question_id == question_id)
+            question = await database.fetch_one(question_query)
+            if not question:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Question not found"
+                )
+            if question["user_id"] != user_id:
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    detail="Not authorized to accept answers for this question"
+                )
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Answer not found or does not belong to this question"
             )
 
-        # Reset any previously accepted answer
-        reset_query = update(Answers).where(
-            (Answers.c.question_id == question_id) & (Answers.c.is_accepted == True)
-        ).values(is_accepted=False)
-        await database.execute(reset_query)
-
-        # Mark the selected answer as accepted
-        update_query = update(Answers).where(
-            Answers.c.answer_id == answer_id
-        ).values(is_accepted=True, updated_at=datetime.utcnow())
-        await database.execute(update_query)
+        await question_pages.invalidate(question_id)
+        question_feeds.answer_accepted(question_id, datetime.utcnow())
 
-        # Create notification for the answer's author
-        answer_user_id = answer["user_id"]
+        # Notify the answer's author once this request is done
+        answer_user_id = accepted["user_id"]
         if answer_user_id != user_id:  # Prevent self-notification
-            user_query = select(Users).where(Users.c.user_id == user_id)
-            user = await database.fetch_one(user_query)
-            message = f"User {user['username']} accepted your answer to question: {question['title']}"
-            notification_query = insert(Notifications).values(
-                user_id=answer_user_id,
-                type=NotificationType.answer,
-                related_id=answer_id,
-                message=message,
-                is_read=False,
-                created_at=datetime.utcnow()
-            )
-            await database.execute(notification_query)
+            message = f"User {principal.username} accepted your answer to question: {accepted['title']}"
+            await notify(answer_user_id, NotificationType.answer, answer_id, message)
 
         return {
             "success": True,
@@ -316,6 +516,13 @@ async def accept_answer(
             "question_id": question_id,
             "answer_id": answer_id
         }
+    except HTTPException as e:
+        response.status_code = e.status_code
+        return {"message": e.detail}
     except Exception as e:
+        if getattr(e, "sqlstate", None) == EXCLUSION_VIOLATION:
+            # A concurrent accept on the same question committed first
+            response.status_code = status.HTTP_409_CONFLICT
+            return {"message": "Another answer was accepted at the same time; please retry"}
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {"message": f"Error accepting answer: {str(e)}"}
\ No newline at end of file
@@ -0,0 +1,104 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import select, union_all, literal, null, func, desc
+from ..lib.db import database, get_connection, Questions, Answers, Users, SEARCH_CONFIG
+from ..lib.profiler import query_budget
+import os
+
+# Router for full-text search over questions and answers
+router = APIRouter(prefix="/api/search", tags=["Search"], dependencies=[Depends(get_connection)])
+
+SEARCH_PAGE_SIZE = int(os.environ.get("SEARCH_PAGE_SIZE", 20))
+SEARCH_MAX_PAGE_SIZE = int(os.environ.get("SEARCH_MAX_PAGE_SIZE", 50))
+# Ranked results are paged by offset, so deep pages are capped to keep them cheap
+SEARCH_MAX_OFFSET = int(os.environ.get("SEARCH_MAX_OFFSET", 1000))
+
+# ts_headline options for result snippets. title_highlight and snippet are HTML:
+# the source text is escaped before highlighting (see html_escaped), so the only
+# markup in them is <mark>.
+TITLE_HEADLINE_OPTIONS = "HighlightAll=true, StartSel=<mark>, StopSel=</mark>"
+SNIPPET_HEADLINE_OPTIONS = "MaxFragments=2, MaxWords=30, MinWords=10, StartSel=<mark>, StopSel=</mark>"
+
+def html_escaped(text):
+    # & first, so the entities added after it aren't escaped again. The parser reads
+    # entities as single non-word tokens, so matches are never split inside one.
+    for character, entity in (("&", "&amp;"), ("<", "&lt;"), (">", "&gt;"), ('"', "&quot;"), ("'", "&#39;")):
+        text = func.replace(text, character, entity)
+    return text
+
+# GET /api/search?q=... - Ranked search across question titles/descriptions and answer text
+@router.get("/")
+@query_budget(1)
+async def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0, le=SEARCH_MAX_OFFSET)
+):
+    try:
+        tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+
+        # Matching documents come straight off the GIN indexes; ts_rank weights
+        # title (A) > question description (B) > answer text (C).
+        question_hits = select(
+            literal("question").label("type"),
+            Questions.c.question_id.label("question_id"),
+            null().label("answer_id"),
+            func.ts_rank(Questions.c.search_vector, tsquery).label("rank")
+        ).where(Questions.c.search_vector.op("@@")(tsquery))
+        answer_hits = select(
+            literal("answer").label("type"),
+            Answers.c.question_id.label("question_id"),
+            Answers.c.answer_id.label("answer_id"),
+            func.ts_rank(Answers.c.search_vector, tsquery).label("rank")
+        ).where(Answers.c.search_vector.op("@@")(tsquery))
+
+        hits = union_all(question_hits, answer_hits).subquery("hits")
+        page = select(hits).order_by(
+            desc(hits.c.rank), desc(hits.c.question_id), hits.c.answer_id
+        ).limit(limit + 1).offset(offset).subquery("page")
+
+        # Snippets are only generated for the rows on this page (ts_headline is expensive)
+        query = select(
+            page.c.type,
+            page.c.question_id,
+            page.c.answer_id,
+            page.c.rank,
+            Questions.c.title,
+            Users.c.username,
+            func.ts_headline(SEARCH_CONFIG, html_escaped(Questions.c.title), tsquery, TITLE_HEADLINE_OPTIONS).label("title_highlight"),
+            func.ts_headline(
+                SEARCH_CONFIG,
+                html_escaped(func.coalesce(Answers.c.description, Questions.c.description)),
+                tsquery,
+                SNIPPET_HEADLINE_OPTIONS
+            ).label("snippet")
+        ).select_from(
+            page.join(Questions, Questions.c.question_id == page.c.question_id)
+            .outerjoin(Answers, Answers.c.answer_id == page.c.answer_id)
+            .join(Users, Users.c.user_id == func.coalesce(Answers.c.user_id, Questions.c.user_id))
+        ).order_by(desc(page.c.rank), desc(page.c.question_id), page.c.answer_id)
+
+        rows = await database.fetch_all(query)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        return {
+            "results": [
+                {
+                    "type": r["type"],
+                    "question_id": r["question_id"],
+                    "answer_id": r["answer_id"],
+                    "title": r["title"],
+                    "title_highlight": r["title_highlight"],
+                    "snippet": r["snippet"],
+                    "username": r["username"],
+                    "rank": r["rank"]
+                }
+                for r in rows
+            ],
+            "next_offset": offset + limit if has_more and offset + limit <= SEARCH_MAX_OFFSET else None
+        }
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error searching: {str(e)}"
+        )
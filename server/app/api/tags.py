@@ -0,0 +1,40 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import select
+from ..lib.db import database, get_connection, TagCounts
+from ..lib.tags import normalize_tag
+from ..lib.profiler import query_budget
+
+# Router for tag listings
+router = APIRouter(prefix="/api/tags", tags=["Tags"], dependencies=[Depends(get_connection)])
+
+# GET /api/tags - Most used tags with their question counts, optionally filtered by prefix
+@router.get("/")
+@query_budget(1)
+async def get_tags(
+    prefix: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200)
+):
+    try:
+        # Served from the precomputed tag_counts table rather than scanning questions
+        query = select(TagCounts.c.tag, TagCounts.c.question_count).where(
+            TagCounts.c.question_count > 0
+        )
+        if prefix:
+            escaped = normalize_tag(prefix).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            query = query.where(TagCounts.c.tag.like(f"{escaped}%"))
+        query = query.order_by(TagCounts.c.question_count.desc(), TagCounts.c.tag).limit(limit)
+
+        tags = await database.fetch_all(query)
+        return [
+            {
+                "tag": t["tag"],
+                "question_count": t["question_count"]
+            }
+            for t in tags
+        ]
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error fetching tags: {str(e)}"
+        )
@@ -1,18 +1,33 @@
 import os
 from jose import jwt, JWTError
 from dotenv import load_dotenv
-from .db import database, Users
-from sqlalchemy import select
+from .db import Users
+from .cache import TTLCache
+from .log import get_logger
+from .models import Principal
+from . import queries
+from sqlalchemy import select, bindparam, cast, Text
 from fastapi import HTTPException, status
 from typing import Optional  # Add this import
 
 load_dotenv()
 
+logger = get_logger("auth")
+
 # Validate environment variables
 ACCESS_TOKEN_SECRET = os.environ.get("ACCESS_TOKEN_SECRET")
 if not ACCESS_TOKEN_SECRET:
     raise ValueError("ACCESS_TOKEN_SECRET environment variable not set")
 
+# Resolved principals are cached per user_id so authenticated requests skip the users lookup.
+# Whatever bans, deletes, renames or changes the role of a user must invalidate its
+# entry in every worker (crud.set_user_banned and crud.delete_user do, through
+# pubsub.principal_changed); a change made directly in the database is only picked
+# up once the entry expires, up to PRINCIPAL_CACHE_TTL seconds later.
+PRINCIPAL_CACHE_SIZE = int(os.environ.get("PRINCIPAL_CACHE_SIZE", 10000))
+PRINCIPAL_CACHE_TTL = float(os.environ.get("PRINCIPAL_CACHE_TTL", 60))
+_principals = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+
 async def create_session(user_id: int) -> str:
     """
     Generate a JWT access token for a given user_id.
@@ -21,42 +36,90 @@ async def create_session(user_id: int) -> str:
     try:
         # Encode JWT with user_id as payload
         access_token = jwt.encode({"user_id": user_id}, ACCESS_TOKEN_SECRET, algorithm="HS256")
-        print(f"Created access token for user_id {user_id}: {access_token}")
+        logger.debug("Created session", extra={"user_id": user_id})
         return access_token
     except JWTError as e:
-        print(f"JWT encoding error: {e}")
+        logger.error("JWT encoding failed", extra={"user_id": user_id, "error": str(e)})
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to create session",
         )
 
-async def verify_jwt(token: str) -> Optional[int]:  # Changed from int | None to Optional[int]
+async def resolve_principal(token: Optional[str]) -> Optional[Principal]:
     """
-    Verify a JWT token and return the user_id if valid and the user exists.
-    Returns None if the token is invalid or the user doesn't exist.
+    Verify a JWT token and return the Principal for its user.
+    Returns None if the token is invalid or the user doesn't exist or is banned.
     """
+    if not token:
+        return None
     try:
         # Decode JWT
         payload = jwt.decode(token, ACCESS_TOKEN_SECRET, algorithms=["HS256"])
         user_id = int(payload["user_id"])
-        
-        # Query the database for the user
-        query = select([Users]).where(Users.c.user_id == user_id)
-        user = await database.fetch_one(query)
-        
-        if not user:
-            print(f"No user found with user_id {user_id}")
-            return None
-            
-        print(f"Verified user_id {user_id}")
-        return user_id
     except JWTError as e:
-        print(f"JWT decoding error: {e}")
+        logger.info("Rejected invalid token", extra={"error": str(e)})
         return None
     except ValueError as e:
-        print(f"Invalid user_id format: {e}")
+        logger.info("Rejected token with a malformed user_id", extra={"error": str(e)})
+        return None
+
+    principal = _principals.get(user_id)
+    if principal is None:
+        principal = await _load_principal(user_id)
+        if principal is None:
+            return None
+    if principal.is_banned:
+        logger.info("Rejected token for a banned user", extra={"user_id": user_id})
+        return None
+    return principal
+
+async def _load_principal(user_id: int) -> Optional[Principal]:
+    # Cache miss: query the database for the user
+    user = await queries.fetch_one(queries.statement("principal", lambda: select(
+        Users.c.user_id, Users.c.username, cast(Users.c.role, Text).label("role"), Users.c.is_banned
+    ).where(Users.c.user_id == bindparam("user_id"))), user_id=user_id)
+
+    if not user:
+        logger.info("Rejected token for an unknown user", extra={"user_id": user_id})
+        return None
+
+    principal = Principal(
+        user_id=user["user_id"],
+        username=user["username"],
+        role=user["role"],
+        is_banned=user["is_banned"]
+    )
+    # Banned principals are cached too, so their requests don't each query users
+    _principals.set(user_id, principal)
+    return principal
+
+async def verify_jwt(token: str) -> Optional[int]:  # Changed from int | None to Optional[int]
+    """
+    Verify a JWT token and return the user_id if valid and the user exists.
+    Returns None if the token is invalid or the user doesn't exist.
+    """
+    principal = await resolve_principal(token)
+    return principal.user_id if principal else None
+
+def token_user_id(token: Optional[str]) -> Optional[int]:
+    """
+    The user_id a correctly signed token was issued for, without checking that
+    the user still exists. Only for cheap per-user bookkeeping such as rate limits.
+    """
+    if not token:
+        return None
+    try:
+        return int(jwt.decode(token, ACCESS_TOKEN_SECRET, algorithms=["HS256"])["user_id"])
+    except (JWTError, KeyError, TypeError, ValueError):
         return None
-    finally:
-        # Only disconnect if connection was opened here
-        if database.is_connected:
-            await database.disconnect()
\ No newline at end of file
+
+def invalidate_principal(user_id: int) -> None:
+    """
+    Drop a cached principal in this process. Use pubsub.principal_changed, which
+    calls this in every worker, when a user is banned, deleted, renamed or has
+    their role changed.
+    """
+    _principals.pop(user_id)
+
+def clear_principals() -> None:
+    _principals.clear()
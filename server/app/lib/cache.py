@@ -0,0 +1,188 @@
+import hashlib
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class TTLCache:
+    """
+    In-process LRU cache whose entries also expire ttl seconds after being set.
+    Meant to be used from the event loop only; it does no locking.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class CacheBackend(ABC):
+    """
+    Storage behind ResponseCache. The in-process backend below keeps entries per
+    worker, which relies on the bridge (lib/pubsub.py) to carry invalidations
+    between workers; a shared store (e.g. Redis or memcached) implements the same
+    calls so every worker sees the same entries and invalidations.
+    """
+
+    @abstractmethod
+    async def get(self, key: str) -> Any:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    async def incr(self, key: str) -> int:
+        ...
+
+    @abstractmethod
+    async def clear(self) -> None:
+        ...
+
+
+class MemoryBackend(CacheBackend):
+    def __init__(self, maxsize: int = 1024):
+        self._entries = TTLCache(maxsize=maxsize)
+        # Versions are tiny and must outlive the entries they guard, so they are
+        # kept apart from the LRU and never expire
+        self._versions: dict = {}
+
+    async def get(self, key: str) -> Any:
+        if key in self._versions:
+            return self._versions[key]
+        return self._entries.get(key)
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        self._entries.set(key, value, ttl)
+
+    async def delete(self, key: str) -> None:
+        self._entries.pop(key)
+
+    async def incr(self, key: str) -> int:
+        self._versions[key] = self._versions.get(key, 0) + 1
+        return self._versions[key]
+
+    async def clear(self) -> None:
+        self._entries.clear()
+        self._versions.clear()
+
+
+class ResponseCache:
+    """
+    Rendered responses keyed by (namespace, id, version). Writers call
+    invalidate() after committing, which bumps the id's version so every
+    older entry becomes unreachable; readers look up the version before
+    querying, so a render that races a write is stored under the stale
+    version and never served.
+
+    With the Postgres bridge on, lib/pubsub.py sets broadcast so invalidations
+    also reach every other worker, which applies them with invalidate_local().
+    """
+
+    def __init__(self, namespace: str, backend: CacheBackend, ttl: float = 300):
+        self.namespace = namespace
+        self.backend = backend
+        self.ttl = ttl
+        self.broadcast: Optional[Callable[[str, Hashable], Awaitable[None]]] = None
+        response_caches[namespace] = self
+
+    def _version_key(self, item_id: Hashable) -> str:
+        return f"{self.namespace}:{item_id}:version"
+
+    async def version(self, item_id: Hashable) -> int:
+        return await self.backend.get(self._version_key(item_id)) or 0
+
+    async def get(self, item_id: Hashable, version: int) -> Any:
+        return await self.backend.get(f"{self.namespace}:{item_id}:{version}")
+
+    async def set(self, item_id: Hashable, version: int, value: Any, ttl: Optional[float] = None) -> None:
+        await self.backend.set(f"{self.namespace}:{item_id}:{version}", value, self.ttl if ttl is None else ttl)
+
+    async def invalidate(self, item_id: Hashable) -> None:
+        await self.invalidate_local(item_id)
+        if self.broadcast is not None:
+            await self.broadcast(self.namespace, item_id)
+
+    async def invalidate_local(self, item_id: Hashable) -> None:
+        version = await self.backend.incr(self._version_key(item_id))
+        # Free the superseded entry right away rather than waiting for the LRU
+        await self.backend.delete(f"{self.namespace}:{item_id}:{version - 1}")
+
+    async def clear(self) -> None:
+        await self.backend.clear()
+
+
+# Every ResponseCache by namespace, for lib/pubsub.py to route invalidations to
+response_caches: Dict[str, ResponseCache] = {}
+
+
+def get_cache_backend(name: str, maxsize: int = 1024) -> CacheBackend:
+    if name == "memory":
+        return MemoryBackend(maxsize)
+    raise ValueError(f"Unknown cache backend: {name}")
+
+
+def make_etag(content: bytes) -> str:
+    # Derived from the bytes themselves so every worker agrees on it
+    return '"' + hashlib.blake2b(content, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True when an If-None-Match header lists etag (weak comparison) or is *."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in candidates)
+
+
+# Rendered question pages (see api/questions.get_question). Each worker caches
+# its own pages: run several only with NOTIFICATIONS_PG_BRIDGE=1, which carries
+# invalidations between them; otherwise the other workers keep serving (and
+# answering If-None-Match for) a stale page for up to QUESTION_CACHE_TTL seconds.
+QUESTION_CACHE_BACKEND = os.environ.get("QUESTION_CACHE_BACKEND", "memory")
+QUESTION_CACHE_SIZE = int(os.environ.get("QUESTION_CACHE_SIZE", 2048))
+QUESTION_CACHE_TTL = float(os.environ.get("QUESTION_CACHE_TTL", 300))
+question_pages = ResponseCache(
+    "question",
+    get_cache_backend(QUESTION_CACHE_BACKEND, QUESTION_CACHE_SIZE),
+    ttl=QUESTION_CACHE_TTL
+)
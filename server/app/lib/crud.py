@@ -1,11 +1,22 @@
 from .db import database,Users
 from .models import UserRequest
+from .pubsub import principal_changed
 
 async def create_user(user: UserRequest):
-    await database.connect()
     query = Users.insert().values(username = user.username,email= user.email,password_hash=user.password,role=user.role,is_banned=False)
     result = await database.execute(query=query)
-    await database.disconnect()
     return result
 
-    
\ No newline at end of file
+async def set_user_banned(user_id: int, banned: bool = True):
+    # Banned users' tokens are rejected by auth.resolve_principal once every worker drops its cached principal
+    query = Users.update().where(Users.c.user_id == user_id).values(is_banned=banned)
+    result = await database.execute(query=query)
+    await principal_changed(user_id)
+    return result
+
+async def delete_user(user_id: int):
+    # Fails while the user still owns questions, answers, votes or notifications
+    query = Users.delete().where(Users.c.user_id == user_id)
+    result = await database.execute(query=query)
+    await principal_changed(user_id)
+    return result
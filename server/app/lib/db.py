@@ -1,18 +1,56 @@
 import os
+import asyncio
+import math
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional
 from dotenv import load_dotenv
 from sqlalchemy.sql import func
+from fastapi import HTTPException, Request, Response, status
 
 load_dotenv()
 
 from databases import Database
 from sqlalchemy import (
-    Table, Column, Integer, BigInteger, String, Text, Boolean,
-    TIMESTAMP, Enum, ForeignKey, MetaData, ARRAY
+    Table, Column, Integer, SmallInteger, BigInteger, String, Text, Boolean,
+    TIMESTAMP, Enum, ForeignKey, MetaData, Index, Computed, text
 )
+# The PostgreSQL ARRAY type provides the @> / && operators that GIN indexes serve
+from sqlalchemy.dialects.postgresql import ARRAY, TSVECTOR, ExcludeConstraint
+from sqlalchemy.sql.expression import Grouping
 import enum
+from .profiler import QUERY_PROFILE, ProfilingConnection
+from .replicas import Replica, ReplicaSet
 
 DATABASE_URL = os.environ.get("DATABASE_URL")
 
+# Text search configuration used for the search_vector columns and search queries
+SEARCH_CONFIG = "english"
+
+# Connection pool settings. The pool is opened once by the app lifespan (see main.py)
+# and shared by every request; connections are recycled after DB_POOL_MAX_QUERIES
+# queries or DB_POOL_MAX_INACTIVE_LIFETIME seconds idle.
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", 5))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 20))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.environ.get("DB_POOL_ACQUIRE_TIMEOUT", 5))
+DB_POOL_MAX_QUERIES = int(os.environ.get("DB_POOL_MAX_QUERIES", 50000))
+DB_POOL_MAX_INACTIVE_LIFETIME = float(os.environ.get("DB_POOL_MAX_INACTIVE_LIFETIME", 300))
+
+# Optional read replicas (comma-separated URLs). GET requests read from a healthy
+# replica, round-robin; everything else, and GETs from a client that wrote within
+# the last DB_REPLICA_STICKY_SECONDS (tracked with a cookie, so it holds across
+# workers), goes to the primary so users always see their own writes. A replica
+# in rotation can be up to DB_REPLICA_MAX_LAG behind at its last check and fall
+# further behind until the next check completes (up to two check intervals, as a
+# check may take one to time out), so the window defaults to covering both.
+DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+DB_REPLICA_CHECK_INTERVAL = float(os.environ.get("DB_REPLICA_CHECK_INTERVAL", 5))
+DB_REPLICA_MAX_LAG = float(os.environ.get("DB_REPLICA_MAX_LAG", 10))
+DB_REPLICA_STICKY_SECONDS = int(os.environ.get(
+    "DB_REPLICA_STICKY_SECONDS", math.ceil(DB_REPLICA_MAX_LAG + 2 * DB_REPLICA_CHECK_INTERVAL)
+))
+PRIMARY_COOKIE = "db_primary"
+
 metadata = MetaData()
 
 class UserRole(enum.Enum):
@@ -20,6 +58,11 @@ class UserRole(enum.Enum):
     user = "user"
     admin = "admin"
 
+class ImageStatus(enum.Enum):
+    pending = "pending"
+    ready = "ready"
+    failed = "failed"
+
 class NotificationType(enum.Enum):
     answer = "answer"
     comment = "comment"
@@ -39,39 +82,279 @@ Users = Table(
 Questions = Table(
     "questions", metadata,
     Column("question_id", BigInteger, primary_key=True, autoincrement=True),
-    Column("user_id", BigInteger, ForeignKey("Users.user_id"), nullable=False),
+    Column("user_id", BigInteger, ForeignKey("users.user_id"), nullable=False),
     Column("title", String(255), nullable=False),
     Column("description", Text, nullable=False),
     Column("tags", ARRAY(Text), nullable=False),
     Column("created_at", TIMESTAMP, nullable=False),
-    Column("updated_at", TIMESTAMP)
+    Column("updated_at", TIMESTAMP),
+    # Full-text document, kept current by PostgreSQL on every insert/update.
+    # Title is weighted above description (A > B); answer text is weighted C.
+    Column("search_vector", TSVECTOR, Computed(
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(title, '')), 'A') || "
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(description, '')), 'B')",
+        persisted=True
+    )),
+    # Keyset pagination of the question feed walks (created_at, question_id)
+    Index("ix_questions_created_at_id", "created_at", "question_id"),
+    # The feed filtered by author walks one user's questions in feed order
+    Index("ix_questions_user_id_created_at", "user_id", "created_at", "question_id"),
+    Index("ix_questions_search_vector", "search_vector", postgresql_using="gin"),
+    # Serves tag containment (@>) and overlap (&&) filters on the feed
+    Index("ix_questions_tags", "tags", postgresql_using="gin")
 )
 
 Answers = Table(
     "answers", metadata,
     Column("answer_id", BigInteger, primary_key=True, autoincrement=True),
-    Column("question_id", BigInteger, ForeignKey("Questions.question_id"), nullable=False),
-    Column("user_id", BigInteger, ForeignKey("Users.user_id"), nullable=False),
+    Column("question_id", BigInteger, ForeignKey("questions.question_id"), nullable=False),
+    Column("user_id", BigInteger, ForeignKey("users.user_id"), nullable=False),
     Column("description", Text, nullable=False),
     Column("img_url", String(255)),
+    # Set while an attached image is being uploaded in the background (see lib/uploads.py)
+    Column("img_status", Enum(ImageStatus, name="image_status")),
     Column("tags", ARRAY(Text), nullable=False),
     Column("upvotes", Integer, nullable=False, default=0),
     Column("downvotes", Integer, nullable=False, default=0),
     Column("is_accepted", Boolean, nullable=False, default=False),
+    # When the question first had an accepted answer; it moves with the flag, so the
+    # trending feed (lib/trending.py) counts a question's acceptance once
+    Column("accepted_at", TIMESTAMP),
+    Column("created_at", TIMESTAMP, nullable=False),
+    Column("updated_at", TIMESTAMP),
+    Column("search_vector", TSVECTOR, Computed(
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(description, '')), 'C')",
+        persisted=True
+    )),
+    Index("ix_answers_search_vector", "search_vector", postgresql_using="gin"),
+    Index("ix_answers_tags", "tags", postgresql_using="gin"),
+    # Recent answers feed the trending score (lib/trending.py)
+    Index("ix_answers_created_at", "created_at"),
+    Index("ix_answers_accepted_at", "accepted_at", postgresql_where=text("is_accepted")),
+    # At most one accepted answer per question: a partial uniqueness guarantee that,
+    # unlike a unique index, is checked at commit, so one UPDATE can move the flag
+    # between two answers in whatever order it visits them.
+    ExcludeConstraint(
+        ("question_id", "="),
+        name="ex_answers_one_accepted",
+        using="btree",
+        where=text("is_accepted"),
+        deferrable=True,
+        initially="DEFERRED"
+    )
+)
+
+# How a question's answers are ranked: accepted answer first, then by score.
+# The score is parenthesized so it is also valid as an index expression.
+answer_score = Grouping(Answers.c.upvotes - Answers.c.downvotes)
+answer_order = (Answers.c.is_accepted.desc(), answer_score.desc(), Answers.c.answer_id.desc())
+Index("ix_answers_question_id_rank", Answers.c.question_id, *answer_order)
+
+# One row per (user, answer) vote; answers.upvotes/downvotes are denormalized from it
+Votes = Table(
+    "votes", metadata,
+    Column("user_id", BigInteger, ForeignKey("users.user_id"), primary_key=True),
+    Column("answer_id", BigInteger, ForeignKey("answers.answer_id"), primary_key=True),
+    Column("vote", SmallInteger, nullable=False),  # 1 = upvote, -1 = downvote
     Column("created_at", TIMESTAMP, nullable=False),
-    Column("updated_at", TIMESTAMP)
+    Column("updated_at", TIMESTAMP),
+    Index("ix_votes_answer_id", "answer_id"),
+    # Recent votes feed the trending score (lib/trending.py)
+    Index("ix_votes_created_at", "created_at")
+)
+
+# Number of questions carrying each tag, maintained by the question write paths (lib/tags.py)
+TagCounts = Table(
+    "tag_counts", metadata,
+    Column("tag", Text, primary_key=True),
+    Column("question_count", Integer, nullable=False, default=0),
+    Index("ix_tag_counts_question_count", "question_count"),
+    Index("ix_tag_counts_tag_prefix", "tag", postgresql_ops={"tag": "text_pattern_ops"})
 )
 
 Notifications = Table(
     "notifications", metadata,
     Column("notification_id", BigInteger, primary_key=True, autoincrement=True),
-    Column("user_id", BigInteger, ForeignKey("Users.user_id"), nullable=False),
+    Column("user_id", BigInteger, ForeignKey("users.user_id"), nullable=False),
     Column("type", Enum(NotificationType, name="notification_type"), nullable=False),
     Column("related_id", BigInteger, nullable=False),
     Column("message", String(255), nullable=False),
     Column("is_read", Boolean, nullable=False, default=False),
-    Column("created_at", TIMESTAMP, nullable=False)
+    Column("created_at", TIMESTAMP, nullable=False),
+    # Inbox pages are keyset scans of (created_at, notification_id) within one user;
+    # the partial index holds only unread rows, so unread_only pages stay small.
+    Index("ix_notifications_user_id_created_at", "user_id", "created_at", "notification_id"),
+    Index(
+        "ix_notifications_user_id_unread", "user_id", "created_at", "notification_id",
+        postgresql_where=text("NOT is_read")
+    )
+)
+
+# Unread notifications per user for the inbox badge, maintained by every path that
+# inserts notifications or marks them read
+NotificationCounters = Table(
+    "notification_counters", metadata,
+    Column("user_id", BigInteger, ForeignKey("users.user_id"), primary_key=True),
+    Column("unread_count", Integer, nullable=False, default=0)
+)
+# Versions applied by lib/migrations.py
+SchemaMigrations = Table(
+    "schema_migrations", metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(255), nullable=False),
+    Column("applied_at", TIMESTAMP, nullable=False)
 )
 
+# Columns returned by API reads; search vectors are only ever used inside queries
+question_columns = [c for c in Questions.c if c.name != "search_vector"]
+answer_columns = [c for c in Answers.c if c.name != "search_vector"]
+
+class QueryStats:
+    """Number of statements and total database time for one unit of work (e.g. a request)."""
+
+    __slots__ = ("count", "elapsed")
+
+    def __init__(self):
+        self.count = 0
+        self.elapsed = 0.0
+
+
+_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def track_queries() -> QueryStats:
+    """
+    Start counting the statements run from the current context (and tasks it
+    spawns afterwards). Counts arrive via asyncpg's query logger, which runs on
+    the next event loop iteration after each statement completes.
+    """
+    stats = QueryStats()
+    _query_stats.set(stats)
+    return stats
+
+
+def current_query_stats() -> Optional[QueryStats]:
+    return _query_stats.get()
+
+
+# The pool resets every connection it takes back; that isn't the request's work
+_reset_queries = set()
+
+
+def _log_query(record) -> None:
+    stats = _query_stats.get()
+    if stats is not None and record.query not in _reset_queries:
+        stats.count += 1
+        stats.elapsed += record.elapsed
+
+
+async def _init_connection(connection) -> None:
+    # Runs for every new pooled connection
+    _reset_queries.add(connection.get_reset_query())
+    connection.add_query_logger(_log_query)
+
+
+POOL_OPTIONS = dict(
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    max_queries=DB_POOL_MAX_QUERIES,
+    max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME,
+    init=_init_connection,
+    # Opt-in statement profiling, see lib/profiler.py
+    **({"connection_class": ProfilingConnection} if QUERY_PROFILE else {})
+)
+
+# The replica the current request reads from, if any
+_read_replica: ContextVar[Optional[Database]] = ContextVar("read_replica", default=None)
+
+
+def reading_from_replica() -> bool:
+    return _read_replica.get() is not None
+
+
+def pinned_to_primary(request: Request) -> bool:
+    # The client wrote recently, so its reads go to the primary (see get_connection)
+    return bool(replicas) and PRIMARY_COOKIE in request.cookies
+
+
+class RoutedDatabase(Database):
+    """
+    The primary, except that while get_connection has routed the current request
+    to a replica, connection() (and so every fetch, execute and transaction made
+    through this object) uses the replica instead.
+    """
+
+    def connection(self):
+        replica = _read_replica.get()
+        if replica is not None:
+            return replica.connection()
+        return super().connection()
+
+
+database = RoutedDatabase(DATABASE_URL, **POOL_OPTIONS)
+replicas = ReplicaSet(
+    [Database(url, **POOL_OPTIONS) for url in DATABASE_REPLICA_URLS],
+    check_interval=DB_REPLICA_CHECK_INTERVAL,
+    max_lag=DB_REPLICA_MAX_LAG
+)
+
+async def _acquire(connection) -> None:
+    await asyncio.wait_for(connection.__aenter__(), DB_POOL_ACQUIRE_TIMEOUT)
+
+@asynccontextmanager
+async def request_connection(request: Request, response: Optional[Response] = None):
+    """
+    Pin one pooled connection to the current request. Every database call (and
+    transaction) made inside the block reuses it, and it goes back to the pool
+    when the block exits.
+    GET requests are served from a read replica when one is configured and healthy
+    (see DATABASE_REPLICA_URLS), falling back to the primary if it can't be reached.
+    Raises a 503 if no connection frees up within DB_POOL_ACQUIRE_TIMEOUT seconds.
+    Other methods need the response, which gets the cookie pinning the client's
+    next reads to the primary.
+    """
+    replica: Optional[Replica] = None
+    if replicas:
+        if request.method not in ("GET", "HEAD"):
+            # Keep this client's reads on the primary until replicas have caught up
+            response.set_cookie(
+                PRIMARY_COOKIE, "1", max_age=DB_REPLICA_STICKY_SECONDS, httponly=True, samesite="lax"
+            )
+        elif not pinned_to_primary(request):
+            replica = replicas.choose()
+
+    if replica is not None:
+        connection = replica.database.connection()
+        try:
+            await _acquire(connection)
+        except asyncio.TimeoutError:
+            replica = None  # Busy rather than broken; this request uses the primary
+        except Exception as e:
+            replicas.mark_failed(replica, e)
+            replica = None
+
+    if replica is None:
+        connection = database.connection()
+        try:
+            await _acquire(connection)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Database is busy, please retry"
+            )
+    else:
+        _read_replica.set(replica.database)
+    try:
+        yield connection
+    finally:
+        _read_replica.set(None)
+        await connection.__aexit__(None, None, None)
 
-database = Database(DATABASE_URL)
\ No newline at end of file
+async def get_connection(request: Request, response: Response):
+    """
+    FastAPI dependency holding a request_connection for the whole handler. Routes
+    that can often answer without the database (e.g. from a cache) open
+    request_connection themselves, only when they need it.
+    """
+    async with request_connection(request, response) as connection:
+        yield connection
@@ -0,0 +1,41 @@
+from typing import Iterable
+
+# Row -> response dict for the shapes shared by several endpoints. Rows come from
+# selects over question_columns / answer_columns or from INSERT/UPDATE ... RETURNING
+# them; keyword arguments fill or override fields the caller already knows (e.g.
+# the author's username from the principal).
+
+QUESTION_FIELDS = (
+    "question_id", "user_id", "title", "description", "tags", "created_at", "updated_at", "username"
+)
+ANSWER_FIELDS = (
+    "answer_id", "question_id", "user_id", "description", "img_url", "img_status", "tags",
+    "upvotes", "downvotes", "is_accepted", "created_at", "updated_at", "username"
+)
+
+
+class RowMapper:
+    """
+    Copies a fixed tuple of fields out of result rows. The field list is fixed when
+    the mapper is built, and values are read from the driver row behind the Record
+    (row._mapping), skipping the per-access type lookups of Record.__getitem__;
+    enum columns therefore come back as their string values, as they are sent.
+    """
+
+    __slots__ = ("fields",)
+
+    def __init__(self, fields: Iterable[str]):
+        self.fields = tuple(fields)
+
+    def __call__(self, row, **known) -> dict:
+        values = getattr(row, "_mapping", row)
+        fields = self.fields
+        if known:
+            fields = [field for field in fields if field not in known]
+        mapped = {field: values[field] for field in fields}
+        mapped.update(known)
+        return mapped
+
+
+question_response = RowMapper(QUESTION_FIELDS)
+answer_response = RowMapper(ANSWER_FIELDS)
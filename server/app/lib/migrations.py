@@ -0,0 +1,288 @@
+import os
+from datetime import datetime
+from typing import Awaitable, Callable, List, NamedTuple, Optional
+from dotenv import load_dotenv
+from sqlalchemy import select, insert, text
+from .db import database, SchemaMigrations
+from .log import get_logger
+
+load_dotenv()
+
+# Versioned schema migrations, applied in order and recorded in schema_migrations.
+# Each migration spells out the DDL it introduces, frozen as it was written, so
+# applying version N always does the same thing whatever lib/db.py looks like
+# later. lib/db.py describes the current schema for queries; when changing it, add
+# a migration at the end of MIGRATIONS with the next version number and the
+# explicit DDL for the change, and never edit an applied one. Statements are
+# idempotent (IF NOT EXISTS and catalog checks), so a database created before
+# migrations existed is brought up to each version rather than failing on it.
+#
+# Run them with `python migrate.py` (see that file), or at startup with
+# DB_MIGRATE_ON_STARTUP=1. An advisory lock keeps concurrent runners (e.g. several
+# workers starting at once) from applying the same migration twice.
+DB_MIGRATE_ON_STARTUP = os.environ.get("DB_MIGRATE_ON_STARTUP", "0") == "1"
+MIGRATION_LOCK_KEY = 7201925
+
+logger = get_logger("migrations")
+
+CREATE_SCHEMA_MIGRATIONS = (
+    "CREATE TABLE IF NOT EXISTS schema_migrations ("
+    "version INTEGER PRIMARY KEY, name VARCHAR(255) NOT NULL, applied_at TIMESTAMP NOT NULL)"
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable[..., Awaitable[None]]
+    # Non-transactional migrations (e.g. CREATE INDEX CONCURRENTLY) must be safe
+    # to re-run after failing halfway, since nothing is rolled back
+    transactional: bool = True
+
+
+class IndexDefinition(NamedTuple):
+    name: str
+    definition: str  # everything after the index name: ON table [USING method] (...) [WHERE ...]
+
+
+async def _exists(connection, query: str, **values) -> bool:
+    return await connection.fetch_val(text(query).bindparams(**values)) is not None
+
+
+async def _create_enum_type(connection, name: str, values: List[str]) -> None:
+    if not await _exists(connection, "SELECT 1 FROM pg_type WHERE typname = :name", name=name):
+        labels = ", ".join(f"'{value}'" for value in values)
+        await connection.execute(f"CREATE TYPE {name} AS ENUM ({labels})")
+
+
+async def _add_constraint(connection, table: str, name: str, definition: str) -> None:
+    if not await _exists(connection, "SELECT 1 FROM pg_constraint WHERE conname = :name", name=name):
+        logger.info("Adding constraint", extra={"table": table, "constraint": name})
+        await connection.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+
+
+async def create_index_concurrently(connection, index: IndexDefinition) -> None:
+    """
+    Build an index without blocking writes to its table. A previous concurrent build
+    that failed leaves an INVALID index behind, which IF NOT EXISTS would keep, so
+    that is dropped and rebuilt.
+    """
+    valid = await connection.fetch_val(text(
+        "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"
+    ).bindparams(name=index.name))
+    if valid:
+        return
+    if valid is False:
+        logger.warning("Rebuilding invalid index", extra={"index": index.name})
+        await connection.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"')
+    logger.info("Building index", extra={"index": index.name})
+    await connection.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{index.name}" {index.definition}')
+
+
+# Version 1: the tables the app started with
+async def create_base_tables(connection) -> None:
+    await _create_enum_type(connection, "user_role", ["guest", "user", "admin"])
+    await _create_enum_type(connection, "notification_type", ["answer", "comment", "mention"])
+    await connection.execute(
+        "CREATE TABLE IF NOT EXISTS users ("
+        "user_id BIGSERIAL PRIMARY KEY, "
+        "username VARCHAR(50) NOT NULL UNIQUE, "
+        "email VARCHAR(255) NOT NULL UNIQUE, "
+        "password_hash VARCHAR(255) NOT NULL, "
+        "role user_role NOT NULL, "
+        "created_at TIMESTAMP NOT NULL, "
+        "is_banned BOOLEAN NOT NULL)"
+    )
+    await connection.execute(
+        "CREATE TABLE IF NOT EXISTS questions ("
+        "question_id BIGSERIAL PRIMARY KEY, "
+        "user_id BIGINT NOT NULL REFERENCES users (user_id), "
+        "title VARCHAR(255) NOT NULL, "
+        "description TEXT NOT NULL, "
+        "tags TEXT[] NOT NULL, "
+        "created_at TIMESTAMP NOT NULL, "
+        "updated_at TIMESTAMP)"
+    )
+    await connection.execute(
+        "CREATE TABLE IF NOT EXISTS answers ("
+        "answer_id BIGSERIAL PRIMARY KEY, "
+        "question_id BIGINT NOT NULL REFERENCES questions (question_id), "
+        "user_id BIGINT NOT NULL REFERENCES users (user_id), "
+        "description TEXT NOT NULL, "
+        "img_url VARCHAR(255), "
+        "tags TEXT[] NOT NULL, "
+        "upvotes INTEGER NOT NULL, "
+        "downvotes INTEGER NOT NULL, "
+        "is_accepted BOOLEAN NOT NULL, "
+        "created_at TIMESTAMP NOT NULL, "
+        "updated_at TIMESTAMP)"
+    )
+    await connection.execute(
+        "CREATE TABLE IF NOT EXISTS notifications ("
+        "notification_id BIGSERIAL PRIMARY KEY, "
+        "user_id BIGINT NOT NULL REFERENCES users (user_id), "
+        "type notification_type NOT NULL, "
+        "related_id BIGINT NOT NULL, "
+        "message VARCHAR(255) NOT NULL, "
+        "is_read BOOLEAN NOT NULL, "
+        "created_at TIMESTAMP NOT NULL)"
+    )
+
+
+# Version 2: search vectors, image upload status, votes, the tag and unread
+# counters, and at most one accepted answer per question
+async def add_columns_and_tables(connection) -> None:
+    await _create_enum_type(connection, "image_status", ["pending", "ready", "failed"])
+    await connection.execute(
+        "ALTER TABLE questions ADD COLUMN IF NOT EXISTS search_vector TSVECTOR GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(description, '')), 'B')) STORED"
+    )
+    await connection.execute("ALTER TABLE answers ADD COLUMN IF NOT EXISTS img_status image_status")
+    await connection.execute(
+        "ALTER TABLE answers ADD COLUMN IF NOT EXISTS search_vector TSVECTOR GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('english', coalesce(description, '')), 'C')) STORED"
+    )
+    # accept_answer didn't always clear the previous accepted answer, so keep only
+    # the most recently accepted one per question before enforcing it
+    await connection.execute(
+        "UPDATE answers SET is_accepted = false "
+        "WHERE is_accepted AND answer_id NOT IN ("
+        "SELECT DISTINCT ON (question_id) answer_id FROM answers WHERE is_accepted "
+        "ORDER BY question_id, coalesce(updated_at, created_at) DESC, answer_id DESC)"
+    )
+    await _add_constraint(
+        connection, "answers", "ex_answers_one_accepted",
+        "EXCLUDE USING btree (question_id WITH =) WHERE (is_accepted) DEFERRABLE INITIALLY DEFERRED"
+    )
+    await connection.execute(
+        "CREATE TABLE IF NOT EXISTS votes ("
+        "user_id BIGINT NOT NULL REFERENCES users (user_id), "
+        "answer_id BIGINT NOT NULL REFERENCES answers (answer_id), "
+        "vote SMALLINT NOT NULL, "
+        "created_at TIMESTAMP NOT NULL, "
+        "updated_at TIMESTAMP, "
+        "PRIMARY KEY (user_id, answer_id))"
+    )
+    await connection.execute(
+        "CREATE TABLE IF NOT EXISTS tag_counts ("
+        "tag TEXT PRIMARY KEY, "
+        "question_count INTEGER NOT NULL)"
+    )
+    await connection.execute(
+        "CREATE TABLE IF NOT EXISTS notification_counters ("
+        "user_id BIGINT PRIMARY KEY REFERENCES users (user_id), "
+        "unread_count INTEGER NOT NULL)"
+    )
+
+
+# Version 3: indexes for the feed, answer ranking, search, tags, votes and the inbox
+INDEXES_V3 = [
+    IndexDefinition("ix_answers_question_id_rank", "ON answers (question_id, is_accepted DESC, (upvotes - downvotes) DESC, answer_id DESC)"),
+    IndexDefinition("ix_answers_search_vector", "ON answers USING gin (search_vector)"),
+    IndexDefinition("ix_answers_tags", "ON answers USING gin (tags)"),
+    IndexDefinition("ix_notifications_user_id_created_at", "ON notifications (user_id, created_at, notification_id)"),
+    IndexDefinition("ix_notifications_user_id_unread", "ON notifications (user_id, created_at, notification_id) WHERE NOT is_read"),
+    IndexDefinition("ix_questions_created_at_id", "ON questions (created_at, question_id)"),
+    IndexDefinition("ix_questions_search_vector", "ON questions USING gin (search_vector)"),
+    IndexDefinition("ix_questions_tags", "ON questions USING gin (tags)"),
+    IndexDefinition("ix_questions_user_id_created_at", "ON questions (user_id, created_at, question_id)"),
+    IndexDefinition("ix_tag_counts_question_count", "ON tag_counts (question_count)"),
+    IndexDefinition("ix_tag_counts_tag_prefix", "ON tag_counts (tag text_pattern_ops)"),
+    IndexDefinition("ix_votes_answer_id", "ON votes (answer_id)"),
+]
+
+# Version 5: recency indexes the trending feed reconciles from
+INDEXES_V5 = [
+    IndexDefinition("ix_answers_created_at", "ON answers (created_at)"),
+    IndexDefinition("ix_votes_created_at", "ON votes (created_at)"),
+]
+
+
+def create_indexes(indexes: List[IndexDefinition]) -> Callable[..., Awaitable[None]]:
+    async def apply(connection) -> None:
+        for index in indexes:
+            await create_index_concurrently(connection, index)
+    return apply
+
+
+# Version 4: counters the app maintains incrementally, computed from their source rows
+async def backfill_counters(connection) -> None:
+    await connection.execute(
+        "INSERT INTO tag_counts (tag, question_count) "
+        "SELECT tag, count(*) FROM questions, unnest(tags) AS tag GROUP BY tag "
+        "ON CONFLICT (tag) DO UPDATE SET question_count = EXCLUDED.question_count"
+    )
+    await connection.execute(
+        "INSERT INTO notification_counters (user_id, unread_count) "
+        "SELECT user_id, count(*) FILTER (WHERE NOT is_read) FROM notifications GROUP BY user_id "
+        "ON CONFLICT (user_id) DO UPDATE SET unread_count = EXCLUDED.unread_count"
+    )
+
+
+# Version 6: when each question's answer was accepted. Acceptance times weren't
+# stored before, so existing accepted answers take their last update as one.
+async def add_accepted_at(connection) -> None:
+    await connection.execute("ALTER TABLE answers ADD COLUMN IF NOT EXISTS accepted_at TIMESTAMP")
+    await connection.execute(
+        "UPDATE answers SET accepted_at = coalesce(updated_at, created_at) "
+        "WHERE is_accepted AND accepted_at IS NULL"
+    )
+
+
+# Version 7: recent acceptances for the trending feed
+INDEXES_V7 = [
+    IndexDefinition("ix_answers_accepted_at", "ON answers (accepted_at) WHERE is_accepted"),
+]
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "create base tables", create_base_tables),
+    Migration(2, "add search vectors, image status, votes and counters", add_columns_and_tables),
+    Migration(3, "create indexes", create_indexes(INDEXES_V3), transactional=False),
+    Migration(4, "backfill tag and notification counters", backfill_counters),
+    Migration(5, "create answer and vote recency indexes", create_indexes(INDEXES_V5), transactional=False),
+    Migration(6, "add answers.accepted_at", add_accepted_at),
+    Migration(7, "create accepted answer recency index", create_indexes(INDEXES_V7), transactional=False),
+]
+
+
+async def migration_status() -> List[dict]:
+    async with database.connection() as connection:
+        await connection.execute(CREATE_SCHEMA_MIGRATIONS)
+        applied = {
+            row["version"]: row["applied_at"]
+            for row in await connection.fetch_all(select(SchemaMigrations.c.version, SchemaMigrations.c.applied_at))
+        }
+    return [
+        {"version": migration.version, "name": migration.name, "applied_at": applied.get(migration.version)}
+        for migration in MIGRATIONS
+    ]
+
+
+async def migrate(target: Optional[int] = None) -> List[Migration]:
+    """Apply pending migrations up to target (default: all). Returns the ones applied."""
+    done = []
+    async with database.connection() as connection:
+        await connection.execute(f"SELECT pg_advisory_lock({MIGRATION_LOCK_KEY})")
+        try:
+            await connection.execute(CREATE_SCHEMA_MIGRATIONS)
+            applied = {row["version"] for row in await connection.fetch_all(select(SchemaMigrations.c.version))}
+            for migration in MIGRATIONS:
+                if migration.version in applied or (target is not None and migration.version > target):
+                    continue
+                logger.info("Applying migration", extra={"version": migration.version, "migration": migration.name})
+                record = insert(SchemaMigrations).values(
+                    version=migration.version, name=migration.name, applied_at=datetime.utcnow()
+                )
+                if migration.transactional:
+                    async with connection.transaction():
+                        await migration.apply(connection)
+                        await connection.execute(record)
+                else:
+                    await migration.apply(connection)
+                    await connection.execute(record)
+                done.append(migration)
+        finally:
+            await connection.execute(f"SELECT pg_advisory_unlock({MIGRATION_LOCK_KEY})")
+    return done
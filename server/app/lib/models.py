@@ -1,4 +1,7 @@
 from pydantic import BaseModel,EmailStr
+from datetime import datetime
+from typing import List, Optional
+from .db import NotificationType, ImageStatus
 
 class UserRequest(BaseModel):
     username: str
@@ -13,4 +16,70 @@ class SignupRequest(BaseModel):
 
 class SigninRequest(BaseModel):
     username: str
-    password: str
\ No newline at end of file
+    password: str
+class NotificationResponse(BaseModel):
+    notification_id: int
+    user_id: int
+    type: NotificationType
+    related_id: int
+    message: str
+    is_read: bool
+    created_at: datetime
+
+class NotificationPage(BaseModel):
+    notifications: List[NotificationResponse]
+    next_cursor: Optional[str] = None
+
+class QuestionResponse(BaseModel):
+    question_id: int
+    user_id: int
+    title: str
+    description: str
+    tags: List[str]
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+    username: str
+
+class QuestionFeed(BaseModel):
+    questions: List[QuestionResponse]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+class RankedQuestion(QuestionResponse):
+    score: float
+
+class RankedFeed(BaseModel):
+    questions: List[RankedQuestion]
+    next_offset: Optional[int] = None
+
+class AnswerResponse(BaseModel):
+    answer_id: int
+    question_id: int
+    user_id: int
+    description: str
+    img_url: Optional[str] = None
+    img_status: Optional[ImageStatus] = None
+    tags: List[str]
+    upvotes: int
+    downvotes: int
+    is_accepted: bool
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+    username: str
+    score: Optional[int] = None  # present where answers are ranked
+
+class AnswerPage(BaseModel):
+    answers: List[AnswerResponse]
+    next_cursor: Optional[str] = None
+
+class QuestionPage(BaseModel):
+    question: QuestionResponse
+    answers: List[AnswerResponse]
+    answers_next_cursor: Optional[str] = None
+
+class Principal(BaseModel):
+    # The authenticated user behind a request, as cached by lib/auth.resolve_principal
+    user_id: int
+    username: str
+    role: str
+    is_banned: bool
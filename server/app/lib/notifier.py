@@ -0,0 +1,229 @@
+import asyncio
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from dotenv import load_dotenv
+from sqlalchemy import insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from .db import database, Notifications, NotificationCounters, NotificationType
+from .log import get_logger
+from .pubsub import notification_hub
+
+load_dotenv()
+
+logger = get_logger("notifier")
+
+# Notifications are written by a background worker in multi-row inserts of up to
+# NOTIFICATION_BATCH_SIZE rows, waiting at most NOTIFICATION_FLUSH_INTERVAL seconds
+# for a batch to fill. Failed batches are retried NOTIFICATION_MAX_RETRIES times,
+# then written a row at a time so one bad row only loses itself.
+NOTIFICATION_QUEUE_SIZE = int(os.environ.get("NOTIFICATION_QUEUE_SIZE", 10000))
+NOTIFICATION_BATCH_SIZE = int(os.environ.get("NOTIFICATION_BATCH_SIZE", 100))
+NOTIFICATION_FLUSH_INTERVAL = float(os.environ.get("NOTIFICATION_FLUSH_INTERVAL", 0.05))
+NOTIFICATION_MAX_RETRIES = int(os.environ.get("NOTIFICATION_MAX_RETRIES", 3))
+NOTIFICATION_RETRY_DELAY = float(os.environ.get("NOTIFICATION_RETRY_DELAY", 0.5))
+# On shutdown the worker writes everything still queued; it is cancelled only if
+# that takes longer than this many seconds
+NOTIFICATION_STOP_TIMEOUT = float(os.environ.get("NOTIFICATION_STOP_TIMEOUT", 10))
+
+# Queued by stop() behind everything already published
+_STOP = object()
+
+# Messages embed user-supplied text (usernames, titles) and are cut to fit the column
+MESSAGE_LENGTH = Notifications.c.message.type.length
+
+
+class NotificationSink(ABC):
+    """
+    Where write endpoints hand off notifications so they can return as soon as
+    their own row is committed. A durable outbox table can implement the same
+    interface: publish inside the request, deliver from a relay.
+    """
+
+    @abstractmethod
+    async def publish(self, notification: dict) -> None:
+        ...
+
+    @property
+    def depth(self) -> int:
+        return 0
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+
+class NotificationQueue(NotificationSink):
+    """In-process queue drained by one worker that batches inserts across requests."""
+
+    def __init__(
+        self,
+        maxsize: int = NOTIFICATION_QUEUE_SIZE,
+        batch_size: int = NOTIFICATION_BATCH_SIZE,
+        flush_interval: float = NOTIFICATION_FLUSH_INTERVAL,
+        max_retries: int = NOTIFICATION_MAX_RETRIES,
+        retry_delay: float = NOTIFICATION_RETRY_DELAY,
+        stop_timeout: float = NOTIFICATION_STOP_TIMEOUT
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.stop_timeout = stop_timeout
+        self._queue: "asyncio.Queue[dict]" = asyncio.Queue(maxsize)
+        self._worker_task: Optional[asyncio.Task] = None
+        self.failed = 0  # notifications dropped after exhausting retries
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    async def publish(self, notification: dict) -> None:
+        # Waits only when the queue is full, which pushes back on writers
+        await self._queue.put(notification)
+
+    async def start(self) -> None:
+        self._worker_task = asyncio.create_task(self._worker())
+
+    async def stop(self) -> None:
+        # Let the worker finish its current batch and write the rest of the queue
+        # before the pool closes; cancel it only if that runs past stop_timeout
+        if self._worker_task is None:
+            return
+        await self._queue.put(_STOP)
+        try:
+            await asyncio.wait_for(asyncio.shield(self._worker_task), self.stop_timeout)
+        except asyncio.TimeoutError:
+            logger.error("Notification queue did not drain before shutdown", extra={"pending": self.depth})
+            self._worker_task.cancel()
+            await asyncio.gather(self._worker_task, return_exceptions=True)
+        self._worker_task = None
+
+    def _take_batch(self, batch: List[dict]) -> bool:
+        # Adds up to a batch of queued notifications; True once the stop marker is taken
+        while len(batch) < self.batch_size and not self._queue.empty():
+            notification = self._queue.get_nowait()
+            if notification is _STOP:
+                return True
+            batch.append(notification)
+        return False
+
+    async def _worker(self) -> None:
+        stopping = False
+        while not stopping:
+            notification = await self._queue.get()
+            if notification is _STOP:
+                break
+            batch = [notification]
+            # Give concurrent requests a moment to add to this batch
+            if self._queue.qsize() < self.batch_size - 1:
+                await asyncio.sleep(self.flush_interval)
+            stopping = self._take_batch(batch)
+            await self._write(batch)
+        # Anything published while stopping
+        while not self._queue.empty():
+            batch = []
+            self._take_batch(batch)
+            if batch:
+                await self._write(batch)
+
+    async def _write(self, batch: List[dict]) -> None:
+        for attempt in range(self.max_retries + 1):
+            try:
+                rows = await insert_notifications(batch)
+                break
+            except Exception as e:
+                logger.warning(
+                    "Writing notifications failed",
+                    extra={"count": len(batch), "attempt": attempt + 1, "error": str(e)}
+                )
+                if attempt < self.max_retries:
+                    await asyncio.sleep(self.retry_delay * 2 ** attempt)
+        else:
+            if len(batch) > 1:
+                await self._write_each(batch)
+            else:
+                self.failed += 1
+            return
+        await publish_notifications(rows)
+
+    async def _write_each(self, batch: List[dict]) -> None:
+        # One attempt per row: if the batch kept failing because of a row the
+        # database rejects, the others still get written
+        rows = []
+        for notification in batch:
+            try:
+                rows.extend(await insert_notifications([notification]))
+            except Exception as e:
+                self.failed += 1
+                logger.error(
+                    "Dropped notification",
+                    extra={"user_id": notification["user_id"], "related_id": notification["related_id"], "error": str(e)}
+                )
+        if rows:
+            await publish_notifications(rows)
+
+
+async def insert_notifications(rows: List[dict]) -> list:
+    """
+    Insert notification rows with one multi-row INSERT and return the new rows.
+    Recipients' unread counters are bumped in the same transaction.
+    """
+    query = insert(Notifications).values(rows).returning(*Notifications.c)
+    async with database.transaction():
+        inserted = await database.fetch_all(query)
+        await count_unread(inserted)
+    return inserted
+
+
+async def count_unread(rows: Iterable) -> None:
+    """Add newly inserted unread notifications to their recipients' counters."""
+    deltas: Dict[int, int] = {}
+    for row in rows:
+        if not row["is_read"]:
+            deltas[row["user_id"]] = deltas.get(row["user_id"], 0) + 1
+    if not deltas:
+        return
+    # One upsert for all recipients, sorted so concurrent writers lock counter rows in the same order
+    query = pg_insert(NotificationCounters).values(
+        [{"user_id": user_id, "unread_count": delta} for user_id, delta in sorted(deltas.items())]
+    )
+    query = query.on_conflict_do_update(
+        index_elements=[NotificationCounters.c.user_id],
+        set_={"unread_count": NotificationCounters.c.unread_count + query.excluded.unread_count}
+    )
+    await database.execute(query)
+
+
+async def publish_notifications(rows: list) -> None:
+    """
+    Push freshly inserted notifications to connected clients. Delivery is best
+    effort: the rows are already committed, and clients that miss an event
+    replay it on reconnect.
+    """
+    try:
+        await notification_hub.publish(rows)
+    except Exception as e:
+        logger.warning("Publishing notifications failed", extra={"count": len(rows), "error": str(e)})
+
+
+def build_notification(user_id: int, type: NotificationType, related_id: int, message: str) -> dict:
+    return {
+        "user_id": user_id,
+        "type": type,
+        "related_id": related_id,
+        "message": message if len(message) <= MESSAGE_LENGTH else message[:MESSAGE_LENGTH - 1] + "…",
+        "is_read": False,
+        "created_at": datetime.utcnow()
+    }
+
+
+notification_queue = NotificationQueue()
+
+
+async def notify(user_id: int, type: NotificationType, related_id: int, message: str) -> None:
+    """Queue a notification; it is written shortly after the calling request returns."""
+    await notification_queue.publish(build_notification(user_id, type, related_id, message))
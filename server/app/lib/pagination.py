@@ -0,0 +1,64 @@
+import base64
+import json
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+from fastapi import HTTPException, status
+
+# Cursors are opaque to clients: a url-safe base64 JSON array of
+# [created_at, id, direction]. Direction is "next" (older rows) or "prev" (newer rows).
+NEXT = "next"
+PREV = "prev"
+
+
+def encode_cursor(created_at: datetime, row_id: int, direction: str = NEXT) -> str:
+    payload = json.dumps([created_at.isoformat(), row_id, direction], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int, str]:
+    """
+    Decode a cursor produced by encode_cursor.
+    Raises a 400 HTTPException if the cursor is malformed.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id, direction = json.loads(base64.urlsafe_b64decode(padded))
+        if direction not in (NEXT, PREV):
+            raise ValueError("Unknown cursor direction")
+        return datetime.fromisoformat(created_at), int(row_id), direction
+    except (ValueError, TypeError, json.JSONDecodeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    # created_at columns are naive UTC TIMESTAMPs; normalize client-supplied datetimes to match
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def encode_key(*values) -> str:
+    """Cursor for orderings other than (created_at, id): the sort key of the last row."""
+    payload = json.dumps(list(values), separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_key(cursor: str, *types: type) -> tuple:
+    """
+    Decode a cursor produced by encode_key, coercing each value to the given type.
+    Raises a 400 HTTPException if the cursor is malformed.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError("Wrong cursor length")
+        return tuple(kind(value) for kind, value in zip(types, values))
+    except (ValueError, TypeError, json.JSONDecodeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
@@ -0,0 +1,75 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# bcrypt work factor for new hashes; existing hashes with a different cost are
+# upgraded transparently on the next successful login.
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+
+# bcrypt releases the GIL while hashing, so a thread pool runs hashes in parallel
+# without blocking the event loop. Jobs beyond PASSWORD_HASH_MAX_PENDING
+# (queued + running) are rejected rather than queued behind a login burst.
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", os.cpu_count() or 2))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", 4 * PASSWORD_HASH_WORKERS))
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_pending = 0
+
+
+class PasswordPoolSaturated(Exception):
+    """Raised when the hashing pool already has PASSWORD_HASH_MAX_PENDING jobs."""
+
+
+async def _run(fn, *args):
+    global _pending
+    if _pending >= PASSWORD_HASH_MAX_PENDING:
+        raise PasswordPoolSaturated()
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+    finally:
+        _pending -= 1
+
+
+def _hash(password: str) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
+
+
+def _verify(password: str, password_hash: str) -> bool:
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+
+async def hash_password(password: str) -> str:
+    """
+    Hash a password with the configured work factor on the worker pool.
+    Raises PasswordPoolSaturated if the pool is full.
+    """
+    return await _run(_hash, password)
+
+
+async def verify_password(password: str, password_hash: str) -> bool:
+    """
+    Check a password against a stored bcrypt hash on the worker pool.
+    Raises PasswordPoolSaturated if the pool is full.
+    """
+    return await _run(_verify, password, password_hash)
+
+
+def needs_rehash(password_hash: str) -> bool:
+    # bcrypt hashes look like $2b$<cost>$<salt+digest>
+    try:
+        return int(password_hash.split('$')[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+
+def pending_jobs() -> int:
+    return _pending
+
+
+def shutdown_password_pool() -> None:
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,230 @@
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Callable, Dict, List, NamedTuple, Optional
+import asyncpg
+from dotenv import load_dotenv
+from .log import get_logger
+
+load_dotenv()
+
+# Opt-in statement profiler for development and tests. With QUERY_PROFILE=1 the
+# database pool hands out ProfilingConnection (see lib/db.py), which records every
+# statement run in a request with its timing and the app line that issued it, and
+# QueryProfilerMiddleware reports, per request:
+#   - statements of the same shape run QUERY_PROFILE_REPEAT_THRESHOLD or more
+#     times (N+1 suspects, e.g. a lookup inside a loop);
+#   - handlers that ran more statements than their @query_budget.
+# With QUERY_BUDGET_STRICT=1 an exceeded budget raises QueryBudgetExceeded instead
+# of logging a warning, so an in-process test client fails the test.
+# Transaction control (BEGIN, COMMIT, SAVEPOINT...) isn't counted.
+QUERY_PROFILE = os.environ.get("QUERY_PROFILE", "0") == "1"
+QUERY_PROFILE_REPEAT_THRESHOLD = int(os.environ.get("QUERY_PROFILE_REPEAT_THRESHOLD", 3))
+QUERY_BUDGET_STRICT = os.environ.get("QUERY_BUDGET_STRICT", "0") == "1"
+
+logger = get_logger("profiler")
+
+_APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Frames in these files are plumbing; the call site is the first app frame outside them
+_PLUMBING = {os.path.abspath(__file__)} | {os.path.join(_APP_DIR, "lib", name) for name in ("db.py", "queries.py")}
+
+_TRANSACTION_CONTROL = re.compile(r"^\s*(BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE|START TRANSACTION)\b", re.I)
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAMETER = re.compile(r"\$\d+")
+_PARAMETER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised in strict mode when a request runs more statements than its route allows."""
+
+
+class QueryRecord(NamedTuple):
+    sql: str
+    shape: str
+    elapsed: float
+    call_site: str
+
+
+def statement_shape(sql: str) -> str:
+    """
+    The statement with literals and parameters replaced by ?, and parameter lists
+    of any length collapsed, so statements that differ only in their values match.
+    """
+    shape = _STRING_LITERAL.sub("?", sql)
+    shape = _PARAMETER.sub("?", shape)
+    shape = _NUMBER_LITERAL.sub("?", shape)
+    shape = _PARAMETER_LIST.sub("?, ...", shape)
+    return _WHITESPACE.sub(" ", shape).strip()
+
+
+def call_site() -> str:
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename.startswith(_APP_DIR) and filename not in _PLUMBING:
+            return f"{os.path.relpath(filename, os.path.dirname(_APP_DIR))}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return "unknown"
+
+
+class QueryProfile:
+    """
+    Statements run in one unit of work (normally one request). Profiles nest:
+    statements are also recorded in the profile that was active when this one
+    started, so a test's profile sees the statements of the requests it makes.
+    """
+
+    def __init__(self, parent: Optional["QueryProfile"] = None):
+        self.parent = parent
+        self.records: List[QueryRecord] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.records)
+
+    @property
+    def elapsed(self) -> float:
+        return sum(record.elapsed for record in self.records)
+
+    def repeated(self, threshold: int = QUERY_PROFILE_REPEAT_THRESHOLD) -> Dict[str, List[QueryRecord]]:
+        by_shape: Dict[str, List[QueryRecord]] = defaultdict(list)
+        for record in self.records:
+            by_shape[record.shape].append(record)
+        return {shape: records for shape, records in by_shape.items() if len(records) >= threshold}
+
+    def check_budget(self, budget: int, label: str = "") -> None:
+        if self.count > budget:
+            sites = ", ".join(sorted({record.call_site for record in self.records}))
+            raise QueryBudgetExceeded(f"{label or 'Request'} ran {self.count} statements, budget is {budget} ({sites})")
+
+
+_profile: ContextVar[Optional[QueryProfile]] = ContextVar("query_profile", default=None)
+
+
+def profile_queries() -> QueryProfile:
+    """Start recording the statements run from the current context (e.g. in a test)."""
+    profile = QueryProfile(_profile.get())
+    _profile.set(profile)
+    return profile
+
+
+def query_budget(limit: int) -> Callable:
+    """
+    Declare the most statements a route handler may run. Put it below the route
+    decorator:
+
+        @router.get("/")
+        @query_budget(1)
+        async def get_questions(...):
+    """
+    def decorate(endpoint: Callable) -> Callable:
+        endpoint.query_budget = limit
+        return endpoint
+    return decorate
+
+
+def _record(sql: str, start: float, site: str) -> None:
+    profile = _profile.get()
+    if profile is None or _TRANSACTION_CONTROL.match(sql):
+        return
+    record = QueryRecord(sql, statement_shape(sql), time.perf_counter() - start, site)
+    while profile is not None:
+        profile.records.append(record)
+        profile = profile.parent
+
+
+class ProfilingConnection(asyncpg.Connection):
+    """asyncpg connection that records the statements it runs in the current QueryProfile."""
+
+    async def reset(self, *, timeout=None):
+        # The pool's reset on release isn't part of any request's work
+        token = _profile.set(None)
+        try:
+            return await super().reset(timeout=timeout)
+        finally:
+            _profile.reset(token)
+
+    async def execute(self, query, *args, **kwargs):
+        site, start = call_site(), time.perf_counter()
+        try:
+            return await super().execute(query, *args, **kwargs)
+        finally:
+            _record(query, start, site)
+
+    async def executemany(self, command, args, **kwargs):
+        site, start = call_site(), time.perf_counter()
+        try:
+            return await super().executemany(command, args, **kwargs)
+        finally:
+            _record(command, start, site)
+
+    async def fetch(self, query, *args, **kwargs):
+        site, start = call_site(), time.perf_counter()
+        try:
+            return await super().fetch(query, *args, **kwargs)
+        finally:
+            _record(query, start, site)
+
+    async def fetchrow(self, query, *args, **kwargs):
+        site, start = call_site(), time.perf_counter()
+        try:
+            return await super().fetchrow(query, *args, **kwargs)
+        finally:
+            _record(query, start, site)
+
+    async def fetchval(self, query, *args, **kwargs):
+        site, start = call_site(), time.perf_counter()
+        try:
+            return await super().fetchval(query, *args, **kwargs)
+        finally:
+            _record(query, start, site)
+
+
+class QueryProfilerMiddleware:
+    """Profiles the statements of every HTTP request and reports N+1 suspects and budget overruns."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = QueryProfile(_profile.get())
+        token = _profile.set(profile)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _profile.reset(token)
+
+        route = scope.get("route")
+        label = f"{scope['method']} {getattr(route, 'path', scope['path'])}"
+        logger.debug("Request statements", extra={
+            "route": label,
+            "statements": [
+                {"sql": record.shape, "ms": round(record.elapsed * 1000, 3), "at": record.call_site}
+                for record in profile.records
+            ]
+        })
+        for shape, records in profile.repeated().items():
+            logger.warning("Possible N+1 query", extra={
+                "route": label,
+                "count": len(records),
+                "statement": shape,
+                "call_sites": sorted({record.call_site for record in records})
+            })
+
+        budget = getattr(getattr(route, "endpoint", None), "query_budget", None)
+        if budget is not None:
+            try:
+                profile.check_budget(budget, label)
+            except QueryBudgetExceeded as e:
+                if QUERY_BUDGET_STRICT:
+                    raise
+                logger.warning("Query budget exceeded", extra={"route": label, "error": str(e)})
@@ -0,0 +1,242 @@
+import asyncio
+import json
+import os
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from enum import Enum
+from typing import Dict, Hashable, Iterable, Optional, Set
+import asyncpg
+from dotenv import load_dotenv
+from sqlalchemy import select, func, cast, literal, Text
+from sqlalchemy.dialects.postgresql import ARRAY
+from .auth import invalidate_principal, clear_principals
+from .cache import response_caches
+from .db import database
+from .log import get_logger
+
+load_dotenv()
+
+logger = get_logger("pubsub")
+
+# With NOTIFICATIONS_PG_BRIDGE=1 events are published through Postgres NOTIFY and
+# every worker process LISTENs on NOTIFICATIONS_CHANNEL, so a client connected to
+# any worker receives notifications written by any other.
+NOTIFICATIONS_PG_BRIDGE = os.environ.get("NOTIFICATIONS_PG_BRIDGE", "0") == "1"
+NOTIFICATIONS_CHANNEL = os.environ.get("NOTIFICATIONS_CHANNEL", "notifications")
+# The bridge also carries the ids of users whose cached principal (lib/auth.py) is stale
+PRINCIPALS_CHANNEL = os.environ.get("PRINCIPALS_CHANNEL", "principals")
+# ...and the keys invalidated in the per-worker response caches (lib/cache.py)
+CACHE_CHANNEL = os.environ.get("CACHE_CHANNEL", "cache_invalidations")
+# Events buffered per connected client before it is treated as too slow
+NOTIFICATION_SUBSCRIBER_BUFFER = int(os.environ.get("NOTIFICATION_SUBSCRIBER_BUFFER", 100))
+# The LISTEN connection is pinged every NOTIFICATIONS_LISTEN_CHECK_INTERVAL seconds.
+# When it is lost (a database restart or failover) it is reopened, retrying with
+# backoff up to NOTIFICATIONS_LISTEN_RETRY_MAX seconds apart, and every open stream
+# is ended so its client replays what was missed meanwhile.
+NOTIFICATIONS_LISTEN_CHECK_INTERVAL = float(os.environ.get("NOTIFICATIONS_LISTEN_CHECK_INTERVAL", 5))
+NOTIFICATIONS_LISTEN_RETRY_MAX = float(os.environ.get("NOTIFICATIONS_LISTEN_RETRY_MAX", 30))
+
+# Put on a subscriber's queue when it overflows; the stream ends and the client
+# reconnects with Last-Event-ID to replay what it missed from the table.
+OVERFLOW = None
+
+
+def notification_event(row) -> dict:
+    """JSON-safe form of a notifications row as delivered to clients."""
+    event = {}
+    for key in ("notification_id", "user_id", "type", "related_id", "message", "is_read", "created_at"):
+        value = row[key]
+        if isinstance(value, Enum):
+            value = value.value
+        elif isinstance(value, datetime):
+            value = value.isoformat()
+        event[key] = value
+    return event
+
+
+class NotificationHub:
+    """Fans newly written notifications out to the live streams of their recipients."""
+
+    def __init__(
+        self,
+        bridge: bool = NOTIFICATIONS_PG_BRIDGE,
+        channel: str = NOTIFICATIONS_CHANNEL,
+        principals_channel: str = PRINCIPALS_CHANNEL,
+        cache_channel: str = CACHE_CHANNEL,
+        buffer: int = NOTIFICATION_SUBSCRIBER_BUFFER,
+        check_interval: float = NOTIFICATIONS_LISTEN_CHECK_INTERVAL,
+        retry_max: float = NOTIFICATIONS_LISTEN_RETRY_MAX
+    ):
+        self.bridge = bridge
+        self.channel = channel
+        self.principals_channel = principals_channel
+        self.cache_channel = cache_channel
+        # Tells this worker's own cache invalidations apart from other workers'
+        self._origin = uuid.uuid4().hex
+        self.buffer = buffer
+        self.check_interval = check_interval
+        self.retry_max = retry_max
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = defaultdict(set)
+        self._listener: Optional[asyncpg.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(self.buffer + 1)  # room for OVERFLOW
+        self._subscribers[user_id].add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[user_id]
+
+    async def publish(self, rows: Iterable) -> None:
+        events = [notification_event(row) for row in rows]
+        if not events:
+            return
+        if not self.bridge:
+            for event in events:
+                self._dispatch(event)
+            return
+        # One round trip for the whole batch; listeners (this process included)
+        # dispatch when the NOTIFY arrives.
+        payload = func.unnest(
+            cast(literal([json.dumps(event) for event in events]), ARRAY(Text))
+        ).table_valued("payload")
+        await database.fetch_all(select(func.pg_notify(self.channel, payload.c.payload)))
+
+    def _dispatch(self, event: dict) -> None:
+        for queue in list(self._subscribers.get(event["user_id"], ())):
+            if queue.qsize() >= self.buffer:
+                # Slow client: end its stream rather than buffer without bound
+                queue.put_nowait(OVERFLOW)
+                self.unsubscribe(event["user_id"], queue)
+            else:
+                queue.put_nowait(event)
+
+    async def principal_changed(self, user_id: int) -> None:
+        """Invalidate a user's cached principal in this and, with the bridge, every worker."""
+        invalidate_principal(user_id)
+        if self.bridge:
+            await database.fetch_all(select(func.pg_notify(self.principals_channel, str(user_id))))
+
+    def _on_principal_changed(self, connection, pid, channel, payload) -> None:
+        try:
+            invalidate_principal(int(payload))
+        except ValueError as e:
+            logger.warning("Ignoring malformed principal payload", extra={"error": str(e)})
+
+    async def cache_invalidated(self, namespace: str, item_id: Hashable) -> None:
+        # Set as ResponseCache.broadcast; the write that invalidated has committed,
+        # so a failure here is logged rather than failing its request
+        payload = json.dumps({"origin": self._origin, "namespace": namespace, "id": item_id})
+        try:
+            await database.fetch_all(select(func.pg_notify(self.cache_channel, payload)))
+        except Exception as e:
+            logger.warning("Broadcasting cache invalidation failed", extra={"namespace": namespace, "error": str(e)})
+
+    async def _on_cache_invalidated(self, connection, pid, channel, payload) -> None:
+        try:
+            message = json.loads(payload)
+            if message["origin"] != self._origin:
+                await response_caches[message["namespace"]].invalidate_local(message["id"])
+        except (ValueError, KeyError) as e:
+            logger.warning("Ignoring malformed cache invalidation payload", extra={"error": str(e)})
+
+    def _on_notify(self, connection, pid, channel, payload) -> None:
+        try:
+            self._dispatch(json.loads(payload))
+        except (ValueError, KeyError) as e:
+            logger.warning("Ignoring malformed notification payload", extra={"error": str(e)})
+
+    def _end_streams(self) -> None:
+        for queues in self._subscribers.values():
+            for queue in queues:
+                queue.put_nowait(OVERFLOW)
+        self._subscribers.clear()
+
+    async def _listen(self) -> asyncpg.Connection:
+        # LISTEN needs a connection of its own for as long as the process runs
+        url = database.url
+        connection = await asyncpg.connect(
+            host=url.hostname,
+            port=url.port,
+            user=url.username,
+            password=url.password,
+            database=url.database
+        )
+        await connection.add_listener(self.channel, self._on_notify)
+        await connection.add_listener(self.principals_channel, self._on_principal_changed)
+        await connection.add_listener(self.cache_channel, self._on_cache_invalidated)
+        return connection
+
+    async def _reconnect(self) -> None:
+        delay = min(1.0, self.retry_max)
+        while True:
+            try:
+                self._listener = await self._listen()
+                break
+            except Exception as e:
+                logger.warning("Notification listener reconnect failed", extra={"error": str(e), "retry_in": delay})
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.retry_max)
+        logger.info("Notification listener reconnected")
+        # NOTIFYs sent while it was down are gone; ending the streams makes every
+        # client reconnect with Last-Event-ID and replay them from the table, and
+        # any principal or cache invalidation missed is covered by dropping them all
+        self._end_streams()
+        clear_principals()
+        for cache in response_caches.values():
+            await cache.clear()
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await asyncio.wait_for(self._listener.execute("SELECT 1"), self.check_interval)
+                continue
+            except Exception as e:
+                logger.warning("Notification listener lost", extra={"error": str(e)})
+            # Don't wait on a connection that may be half open
+            self._listener.terminate()
+            self._listener = None
+            await self._reconnect()
+
+    async def start(self) -> None:
+        if not self.bridge:
+            return
+        self._listener = await self._listen()
+        self._task = asyncio.create_task(self._watch())
+        for cache in response_caches.values():
+            cache.broadcast = self.cache_invalidated
+
+    async def stop(self) -> None:
+        for cache in response_caches.values():
+            cache.broadcast = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._listener is not None:
+            await self._listener.close()
+            self._listener = None
+        # Let open streams end instead of waiting for their keepalive
+        self._end_streams()
+
+
+notification_hub = NotificationHub()
+
+
+async def principal_changed(user_id: int) -> None:
+    await notification_hub.principal_changed(user_id)
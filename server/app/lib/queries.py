@@ -0,0 +1,94 @@
+from typing import Any, Callable, Dict, Hashable, List, Optional
+from sqlalchemy.dialects.postgresql import asyncpg as asyncpg_dialect
+from sqlalchemy.sql import ClauseElement
+from .db import database
+
+# Statements that run on every request are built once with named bindparam()s and
+# compiled once, instead of being rebuilt and recompiled by SQLAlchemy per call.
+# On PostgreSQL the compiled SQL goes straight to asyncpg, which keeps a prepared
+# statement per connection for each distinct SQL string, so repeat executions skip
+# parsing and planning too.
+#
+# Give bind parameters a type (bindparam(..., type_=column.type)) wherever the
+# column doesn't imply one, so values go through that type's bind processing.
+# Rows from the PostgreSQL path are asyncpg Records: values are what the driver
+# decodes (enum columns as their string values, JSON as text).
+#
+# Arguments are bound through SQLAlchemy's public compiler API (construct_params,
+# positiontup, binds and each type's bind_processor), and statements run on the
+# task's databases connection under its query lock, as databases' own calls do.
+# That lock is databases' only private attribute used here; requirements.txt pins
+# both libraries to the minor versions this was written against.
+
+_DIALECT = asyncpg_dialect.dialect()
+
+
+class Statement:
+    def __init__(self, statement: ClauseElement):
+        self.statement = statement
+        compiled = statement.compile(dialect=_DIALECT)
+        if "POSTCOMPILE" in compiled.string:
+            # Expanding IN lists etc. change the SQL per call, so they can't be cached
+            raise ValueError("Statements with expanding parameters can't be registered")
+        if compiled.positiontup is None:
+            raise ValueError("Statements must compile with a positional paramstyle")
+        self._compiled = compiled
+        self.sql = compiled.string
+        # Bind processors convert Python values (e.g. enums) the way SQLAlchemy would
+        self._processors = {}
+        for name in compiled.positiontup:
+            bind_type = compiled.binds[name].type
+            processor = bind_type.dialect_impl(_DIALECT).bind_processor(_DIALECT)
+            if processor is not None:
+                self._processors[name] = processor
+
+    def args(self, values: Dict[str, Any]) -> list:
+        # construct_params fills in constants bound at build time and raises for a
+        # required parameter that values leaves out
+        params = self._compiled.construct_params(values)
+        args = []
+        for name in self._compiled.positiontup:
+            value = params[name]
+            processor = self._processors.get(name)
+            args.append(processor(value) if processor is not None and value is not None else value)
+        return args
+
+
+_registry: Dict[Hashable, Statement] = {}
+
+
+def statement(key: Hashable, build: Callable[[], ClauseElement]) -> Statement:
+    """Return the registered statement for key, building and compiling it on first use."""
+    registered = _registry.get(key)
+    if registered is None:
+        registered = _registry[key] = Statement(build())
+    return registered
+
+
+def registered_count() -> int:
+    return len(_registry)
+
+
+def _use_driver() -> bool:
+    return database.url.dialect in ("postgresql", "postgres")
+
+
+async def fetch_all(stmt: Statement, **values) -> List[Any]:
+    if not _use_driver():
+        return await database.fetch_all(stmt.statement.params(**values))
+    async with database.connection() as connection, connection._query_lock:
+        return await connection.raw_connection.fetch(stmt.sql, *stmt.args(values))
+
+
+async def fetch_one(stmt: Statement, **values) -> Optional[Any]:
+    if not _use_driver():
+        return await database.fetch_one(stmt.statement.params(**values))
+    async with database.connection() as connection, connection._query_lock:
+        return await connection.raw_connection.fetchrow(stmt.sql, *stmt.args(values))
+
+
+async def fetch_val(stmt: Statement, **values) -> Any:
+    if not _use_driver():
+        return await database.fetch_val(stmt.statement.params(**values))
+    async with database.connection() as connection, connection._query_lock:
+        return await connection.raw_connection.fetchval(stmt.sql, *stmt.args(values))
@@ -0,0 +1,204 @@
+import asyncio
+import math
+import os
+import time
+from typing import Callable, Dict, NamedTuple
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request, status
+from .auth import token_user_id
+from .cache import TTLCache
+from .log import get_logger
+from .metrics import registry, Counter, Histogram
+
+load_dotenv()
+
+# Admission control for the API routers (auth, questions, answers), applied by the
+# admit dependency ahead of get_connection so a rejected request never holds a
+# database connection:
+#
+#   1. A token bucket per client and route class. The client is the user id of a
+#      validly signed access_token cookie, else the remote address (run uvicorn
+#      with --proxy-headers behind a proxy so that is the real client). Each class
+#      is configured as "<burst>/<seconds>": up to <burst> requests at once,
+#      refilled at <burst> per <seconds>. Over the limit responds 429 with
+#      Retry-After.
+#   2. A process-wide cap of ADMISSION_MAX_CONCURRENCY requests in flight. Up to
+#      ADMISSION_MAX_QUEUE more wait for a slot, for at most ADMISSION_QUEUE_TIMEOUT
+#      seconds; anything beyond that is shed with 503 rather than queued behind a
+#      burst. 0 disables the cap.
+#
+# Handlers pick their class with @rate_limit below; the rest default to "read" for
+# GET/HEAD and "write" otherwise. Limits are per process, like every other
+# in-process structure here: with N workers a client gets up to N times the rate.
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get("RATE_LIMIT_MAX_CLIENTS", 100000))
+ADMISSION_MAX_CONCURRENCY = int(os.environ.get("ADMISSION_MAX_CONCURRENCY", 64))
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", 128))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 1))
+
+logger = get_logger("ratelimit")
+
+
+class Limit(NamedTuple):
+    burst: int
+    per_seconds: float
+
+    @property
+    def rate(self) -> float:
+        return self.burst / self.per_seconds
+
+    @classmethod
+    def parse(cls, spec: str) -> "Limit":
+        burst, per_seconds = spec.split("/")
+        return cls(int(burst), float(per_seconds))
+
+
+RATE_LIMITS: Dict[str, Limit] = {
+    # login and signup each cost a bcrypt hash
+    "auth": Limit.parse(os.environ.get("RATE_LIMIT_AUTH", "10/60")),
+    "write": Limit.parse(os.environ.get("RATE_LIMIT_WRITE", "30/60")),
+    "vote": Limit.parse(os.environ.get("RATE_LIMIT_VOTE", "120/60")),
+    "read": Limit.parse(os.environ.get("RATE_LIMIT_READ", "600/60")),
+}
+
+rate_limit_requests = registry.register(Counter(
+    "rate_limit_requests_total", "Requests checked against a rate limit, by route class and outcome", ("route_class", "outcome")
+))
+admission_shed = registry.register(Counter(
+    "admission_shed_total", "Requests shed by the concurrency limiter", ("reason",)
+))
+admission_wait = registry.register(Histogram(
+    "admission_wait_seconds", "Time requests waited for a concurrency slot"
+))
+
+
+class TokenBuckets:
+    """
+    One token bucket per client for a route class. A bucket left alone for
+    per_seconds is full again, so idle ones are dropped (and recreated full)
+    rather than kept.
+    """
+
+    def __init__(self, limit: Limit, maxsize: int = RATE_LIMIT_MAX_CLIENTS):
+        self.limit = limit
+        self._buckets = TTLCache(maxsize=maxsize, ttl=limit.per_seconds)
+
+    def take(self, client) -> float:
+        """Spend a token for client. Returns 0, or the seconds until one is available."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(client, (self.limit.burst, now))
+        tokens = min(self.limit.burst, tokens + (now - updated) * self.limit.rate)
+        if tokens < 1:
+            self._buckets.set(client, (tokens, now))
+            return (1 - tokens) / self.limit.rate
+        self._buckets.set(client, (tokens - 1, now))
+        return 0
+
+
+class ConcurrencyLimiter:
+    """Caps requests in flight, queueing a bounded number of others for a bounded time."""
+
+    def __init__(self, limit: int, max_queue: int, queue_timeout: float):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(limit) if limit > 0 else None
+
+    async def acquire(self) -> bool:
+        """Take a slot, or return False if the request should be shed."""
+        if self._slots is None:
+            return True
+        if self._slots.locked():
+            if self.waiting >= self.max_queue:
+                admission_shed.inc(("queue_full",))
+                return False
+            self.waiting += 1
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                admission_shed.inc(("queue_timeout",))
+                return False
+            finally:
+                self.waiting -= 1
+                admission_wait.observe((), time.perf_counter() - start)
+        else:
+            await self._slots.acquire()
+            admission_wait.observe((), 0)
+        self.active += 1
+        return True
+
+    def release(self) -> None:
+        if self._slots is not None:
+            self.active -= 1
+            self._slots.release()
+
+
+_buckets = {name: TokenBuckets(limit) for name, limit in RATE_LIMITS.items()}
+limiter = ConcurrencyLimiter(ADMISSION_MAX_CONCURRENCY, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT)
+
+
+def rate_limit(route_class: str) -> Callable:
+    """
+    Put a route handler in a rate limit class from RATE_LIMITS. Put it below the
+    route decorator:
+
+        @router.post("/login")
+        @rate_limit("auth")
+        async def login(...):
+    """
+    if route_class not in RATE_LIMITS:
+        raise ValueError(f"Unknown rate limit class: {route_class}")
+
+    def decorate(endpoint: Callable) -> Callable:
+        endpoint.rate_limit = route_class
+        return endpoint
+    return decorate
+
+
+def _route_class(request: Request) -> str:
+    endpoint = getattr(request.scope.get("route"), "endpoint", None)
+    route_class = getattr(endpoint, "rate_limit", None)
+    if route_class is not None:
+        return route_class
+    return "read" if request.method in ("GET", "HEAD") else "write"
+
+
+def _client(request: Request):
+    user_id = token_user_id(request.cookies.get("access_token"))
+    if user_id is not None:
+        return ("user", user_id)
+    return ("ip", request.client.host if request.client else "unknown")
+
+
+async def admit(request: Request):
+    """
+    FastAPI dependency applying the client's rate limit for the route and then the
+    concurrency limit, holding a slot until the handler is done. List it before
+    get_connection.
+    """
+    if RATE_LIMIT_ENABLED:
+        route_class = _route_class(request)
+        retry_after = _buckets[route_class].take(_client(request))
+        if retry_after:
+            rate_limit_requests.inc((route_class, "limited"))
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, please slow down",
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+        rate_limit_requests.inc((route_class, "allowed"))
+
+    if not await limiter.acquire():
+        logger.debug("Shed request", extra={"path": request.url.path, "waiting": limiter.waiting})
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server busy, please retry",
+            headers={"Retry-After": "1"}
+        )
+    try:
+        yield
+    finally:
+        limiter.release()
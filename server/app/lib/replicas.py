@@ -0,0 +1,102 @@
+import asyncio
+import time
+from typing import Optional
+from .log import get_logger
+
+logger = get_logger("replicas")
+
+# Replication lag in seconds, 0 when the replica has replayed everything it has
+# received (so an idle primary doesn't make it look stale), NULL on a primary
+LAG_QUERY = (
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+class Replica:
+    def __init__(self, database):
+        self.database = database
+        self.healthy = False  # until its first successful check
+        self.lag: Optional[float] = None
+        self.failed_at: Optional[float] = None
+
+
+class ReplicaSet:
+    """
+    Read replicas used round-robin by GET handlers (see get_connection in lib/db.py).
+    A background task checks every replica each check_interval seconds; a replica
+    that can't be reached or lags more than max_lag seconds is skipped until a
+    later check passes. Requests fall back to the primary when none is healthy.
+    """
+
+    def __init__(self, databases: list, check_interval: float, max_lag: float):
+        self.replicas = [Replica(database) for database in databases]
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self._next = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def __bool__(self) -> bool:
+        return bool(self.replicas)
+
+    @property
+    def healthy_count(self) -> int:
+        return sum(replica.healthy for replica in self.replicas)
+
+    def choose(self) -> Optional[Replica]:
+        # Round-robin over the healthy replicas
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[self._next % len(self.replicas)]
+            self._next += 1
+            if replica.healthy:
+                return replica
+        return None
+
+    def mark_failed(self, replica: Replica, error: Exception) -> None:
+        if replica.healthy or replica.failed_at is None:
+            logger.warning("Replica marked unhealthy", extra={"replica": str(replica.database.url.obscure_password), "error": str(error)})
+        replica.healthy = False
+        replica.failed_at = time.monotonic()
+
+    async def check(self, replica: Replica) -> None:
+        try:
+            if not replica.database.is_connected:
+                await replica.database.connect()
+            lag = await asyncio.wait_for(replica.database.fetch_val(LAG_QUERY), self.check_interval)
+        except Exception as e:
+            self.mark_failed(replica, e)
+            return
+        replica.lag = float(lag) if lag is not None else 0.0
+        if replica.lag > self.max_lag:
+            self.mark_failed(replica, Exception(f"lagging {replica.lag:.1f}s behind the primary"))
+            return
+        if not replica.healthy:
+            logger.info("Replica healthy", extra={"replica": str(replica.database.url.obscure_password), "lag": replica.lag})
+        replica.healthy = True
+
+    async def check_all(self) -> None:
+        await asyncio.gather(*(self.check(replica) for replica in self.replicas))
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self.check_all()
+
+    async def start(self) -> None:
+        if not self.replicas:
+            return
+        # An unreachable replica doesn't stop startup; it stays unhealthy until it answers
+        await self.check_all()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for replica in self.replicas:
+            if replica.database.is_connected:
+                await replica.database.disconnect()
@@ -0,0 +1,54 @@
+import os
+import shutil
+from abc import ABC, abstractmethod
+from typing import Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Which backend stores uploaded images: "cloudinary" (default) or "local"
+IMAGE_STORAGE_BACKEND = os.environ.get("IMAGE_STORAGE_BACKEND", "cloudinary")
+LOCAL_STORAGE_ROOT = os.environ.get("LOCAL_STORAGE_ROOT", "uploads")
+LOCAL_STORAGE_BASE_URL = os.environ.get("LOCAL_STORAGE_BASE_URL", "/uploads")
+
+
+class StorageBackend(ABC):
+    """
+    Stores a file from local disk and returns the URL it can be fetched from.
+    upload is blocking and is run off the event loop by the upload workers.
+    """
+
+    @abstractmethod
+    def upload(self, path: str, folder: Optional[str] = None) -> str:
+        ...
+
+
+class CloudinaryStorage(StorageBackend):
+    def upload(self, path: str, folder: Optional[str] = None) -> str:
+        # Imported lazily so the local backend works without Cloudinary credentials
+        from .cloudinary import upload_image_file
+        with open(path, "rb") as file:
+            return upload_image_file(file, folder=folder)
+
+
+class LocalStorage(StorageBackend):
+    """Copies files under root; for development, tests and benchmarks."""
+
+    def __init__(self, root: str = LOCAL_STORAGE_ROOT, base_url: str = LOCAL_STORAGE_BASE_URL):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+
+    def upload(self, path: str, folder: Optional[str] = None) -> str:
+        name = os.path.basename(path)
+        target_dir = os.path.join(self.root, folder) if folder else self.root
+        os.makedirs(target_dir, exist_ok=True)
+        shutil.copyfile(path, os.path.join(target_dir, name))
+        return f"{self.base_url}/{folder}/{name}" if folder else f"{self.base_url}/{name}"
+
+
+def get_storage_backend(name: str = IMAGE_STORAGE_BACKEND) -> StorageBackend:
+    if name == "cloudinary":
+        return CloudinaryStorage()
+    if name == "local":
+        return LocalStorage()
+    raise ValueError(f"Unknown image storage backend: {name}")
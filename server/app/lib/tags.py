@@ -0,0 +1,57 @@
+import re
+from typing import Dict, Iterable, List
+from sqlalchemy.dialects.postgresql import insert
+from .db import database, TagCounts
+
+MAX_TAGS = 10
+MAX_TAG_LENGTH = 50
+
+_whitespace = re.compile(r"\s+")
+
+
+def normalize_tag(tag: str) -> str:
+    # "  Machine Learning " -> "machine-learning"
+    return _whitespace.sub("-", tag.strip().lower())
+
+
+def normalize_tags(tags: Iterable) -> List[str]:
+    """
+    Normalize tags at write time so stored tags match the GIN-indexed lookups.
+    Drops empty and duplicate tags (keeping the first occurrence's order).
+    Raises ValueError for non-string, overlong or too many tags.
+    """
+    normalized = []
+    for tag in tags:
+        if not isinstance(tag, str):
+            raise ValueError("Tags must be strings")
+        tag = normalize_tag(tag)
+        if not tag or tag in normalized:
+            continue
+        if len(tag) > MAX_TAG_LENGTH:
+            raise ValueError(f"Tags must be at most {MAX_TAG_LENGTH} characters")
+        normalized.append(tag)
+    if len(normalized) > MAX_TAGS:
+        raise ValueError(f"At most {MAX_TAGS} tags are allowed")
+    return normalized
+
+
+async def adjust_tag_counts(added: Iterable[str] = (), removed: Iterable[str] = ()) -> None:
+    """
+    Apply question-count deltas to tag_counts with a single upsert.
+    Call inside the transaction that writes the question's tags.
+    """
+    deltas: Dict[str, int] = {}
+    for tag in added:
+        deltas[tag] = deltas.get(tag, 0) + 1
+    for tag in removed:
+        deltas[tag] = deltas.get(tag, 0) - 1
+    # Sorted so concurrent writers lock tag rows in the same order
+    rows = [{"tag": tag, "question_count": delta} for tag, delta in sorted(deltas.items()) if delta]
+    if not rows:
+        return
+    query = insert(TagCounts).values(rows)
+    query = query.on_conflict_do_update(
+        index_elements=[TagCounts.c.tag],
+        set_={"question_count": TagCounts.c.question_count + query.excluded.question_count}
+    )
+    await database.execute(query)
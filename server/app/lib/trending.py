@@ -0,0 +1,268 @@
+import asyncio
+import heapq
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from dotenv import load_dotenv
+from sqlalchemy import select, union_all, cast, func, bindparam, true, Float, TIMESTAMP
+from .db import Questions, Answers, Votes, answer_score
+from .log import get_logger
+from . import queries
+
+load_dotenv()
+
+# Hot and trending question feeds (api/feeds.py), ranked in memory and kept current
+# by the write paths instead of being computed per request over questions/answers.
+#
+#   hot:      the question's points (1 + weighted answers, net votes and an accepted
+#             answer) halved every HOT_HALF_LIFE_HOURS of the question's age.
+#   trending: the sum of the question's recent activity (each answer, vote and
+#             accept, weighted the same way) halved every TRENDING_HALF_LIFE_HOURS
+#             since it happened.
+#
+# Both decay towards a shared epoch, so a question's ranking key only changes when
+# something happens to it: a question's key is its score times 2^((t - epoch) / half
+# life). The top FEED_SIZE of each feed are kept sorted, rebuilt at most every
+# FEED_REFRESH_INTERVAL seconds after a change. Every FEED_RECONCILE_INTERVAL seconds
+# the state is recomputed from the database (questions from the last HOT_WINDOW_DAYS,
+# and activity from the last TRENDING_WINDOW_HOURS), which picks up writes made by
+# other workers, resets the epoch and corrects any drift.
+FEED_SIZE = int(os.environ.get("FEED_SIZE", 100))
+FEED_CANDIDATES = int(os.environ.get("FEED_CANDIDATES", 5000))
+FEED_REFRESH_INTERVAL = float(os.environ.get("FEED_REFRESH_INTERVAL", 1))
+FEED_RECONCILE_INTERVAL = float(os.environ.get("FEED_RECONCILE_INTERVAL", 60))
+HOT_HALF_LIFE = float(os.environ.get("HOT_HALF_LIFE_HOURS", 12)) * 3600
+HOT_WINDOW = timedelta(days=float(os.environ.get("HOT_WINDOW_DAYS", 7)))
+TRENDING_HALF_LIFE = float(os.environ.get("TRENDING_HALF_LIFE_HOURS", 6)) * 3600
+TRENDING_WINDOW = timedelta(hours=float(os.environ.get("TRENDING_WINDOW_HOURS", 48)))
+ANSWER_WEIGHT = float(os.environ.get("FEED_ANSWER_WEIGHT", 2))
+VOTE_WEIGHT = float(os.environ.get("FEED_VOTE_WEIGHT", 1))
+ACCEPTED_WEIGHT = float(os.environ.get("FEED_ACCEPTED_WEIGHT", 3))
+
+logger = get_logger("trending")
+
+
+class QuestionActivity:
+    __slots__ = ("created_at", "answers", "votes", "accepted", "activity")
+
+    def __init__(self, created_at: Optional[datetime] = None, answers: int = 0, votes: int = 0, accepted: bool = False, activity: float = 0.0):
+        # created_at is None for a question only seen through events since the last
+        # reconcile; its totals are unknown, so it isn't ranked as hot until then
+        self.created_at = created_at
+        self.answers = answers
+        self.votes = votes
+        self.accepted = accepted
+        self.activity = activity  # trending key, in epoch scale
+
+    @property
+    def points(self) -> float:
+        return max(0.0, 1 + self.answers * ANSWER_WEIGHT + self.votes * VOTE_WEIGHT + self.accepted * ACCEPTED_WEIGHT)
+
+
+class Ranking(NamedTuple):
+    version: int
+    built_at: float
+    entries: List[Tuple[float, int]]  # (key, question_id), best first
+
+
+def build_reconcile_query():
+    """
+    Per candidate question (created since :hot_since, or with answers or votes since
+    :trending_since): its creation time, answer count, net votes, whether it has an
+    accepted answer, and its trending activity scaled to :epoch.
+    """
+    epoch = bindparam("epoch", type_=TIMESTAMP)
+    trending_since = bindparam("trending_since", type_=TIMESTAMP)
+
+    def decayed(at, weight):
+        return weight * func.power(2.0, cast(func.extract("epoch", at - epoch), Float) / TRENDING_HALF_LIFE)
+
+    recent_answers = select(
+        Answers.c.question_id,
+        decayed(Answers.c.created_at, ANSWER_WEIGHT).label("activity")
+    ).where(Answers.c.created_at >= trending_since)
+    # Served by ix_answers_accepted_at; one row per question, however old the answer
+    recent_accepts = select(
+        Answers.c.question_id,
+        decayed(Answers.c.accepted_at, ACCEPTED_WEIGHT).label("activity")
+    ).where(Answers.c.is_accepted, Answers.c.accepted_at >= trending_since)
+    recent_votes = select(
+        Answers.c.question_id,
+        decayed(Votes.c.created_at, VOTE_WEIGHT * Votes.c.vote).label("activity")
+    ).select_from(Votes.join(Answers, Votes.c.answer_id == Answers.c.answer_id)).where(Votes.c.created_at >= trending_since)
+    activity = union_all(recent_answers, recent_accepts, recent_votes).subquery("activity")
+    recent = select(
+        activity.c.question_id, func.sum(activity.c.activity).label("activity")
+    ).group_by(activity.c.question_id).cte("recent")
+
+    candidates = select(Questions.c.question_id).where(
+        Questions.c.created_at >= bindparam("hot_since", type_=TIMESTAMP)
+    ).union(select(recent.c.question_id)).cte("candidates")
+    # Served by ix_answers_question_id_rank
+    totals = select(
+        func.count().label("answers"),
+        func.coalesce(func.sum(answer_score), 0).label("votes"),
+        func.coalesce(func.bool_or(Answers.c.is_accepted), False).label("accepted")
+    ).where(Answers.c.question_id == Questions.c.question_id).lateral("totals")
+    return select(
+        Questions.c.question_id,
+        Questions.c.created_at,
+        totals.c.answers,
+        totals.c.votes,
+        totals.c.accepted,
+        func.coalesce(recent.c.activity, 0.0).label("activity")
+    ).select_from(
+        candidates.join(Questions, Questions.c.question_id == candidates.c.question_id)
+        .join(totals, true())
+        .outerjoin(recent, recent.c.question_id == Questions.c.question_id)
+    )
+
+
+class QuestionFeeds:
+    """
+    Ranked hot and trending question ids for this process. The write paths report
+    events (question_created, answer_added, votes_changed, answer_accepted) after
+    they commit; reads go through top().
+    """
+
+    def __init__(
+        self,
+        size: int = FEED_SIZE,
+        candidates: int = FEED_CANDIDATES,
+        refresh_interval: float = FEED_REFRESH_INTERVAL,
+        reconcile_interval: float = FEED_RECONCILE_INTERVAL
+    ):
+        self.size = size
+        self.candidates = candidates
+        self.refresh_interval = refresh_interval
+        self.reconcile_interval = reconcile_interval
+        self.epoch = datetime.utcnow()
+        self._questions: Dict[int, QuestionActivity] = {}
+        self._version = 0
+        self._rankings: Dict[str, Ranking] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._keys: Dict[str, Callable[[QuestionActivity], Optional[float]]] = {
+            "hot": self._hot_key,
+            "trending": lambda question: question.activity,
+        }
+        self._half_lives = {"hot": HOT_HALF_LIFE, "trending": TRENDING_HALF_LIFE}
+
+    @property
+    def tracked(self) -> int:
+        return len(self._questions)
+
+    def _scale(self, at: datetime, half_life: float) -> float:
+        return 2 ** ((at - self.epoch).total_seconds() / half_life)
+
+    def _hot_key(self, question: QuestionActivity) -> Optional[float]:
+        if question.created_at is None:
+            return None
+        return question.points * self._scale(question.created_at, HOT_HALF_LIFE)
+
+    def _question(self, question_id: int) -> QuestionActivity:
+        question = self._questions.get(question_id)
+        if question is None:
+            if len(self._questions) >= 2 * self.candidates:
+                self._questions = self._trim(self._questions)
+            question = self._questions[question_id] = QuestionActivity()
+        return question
+
+    def _record(self, question: QuestionActivity, weight: float, at: datetime) -> None:
+        question.activity += weight * self._scale(at, TRENDING_HALF_LIFE)
+        self._version += 1
+
+    def question_created(self, question_id: int, created_at: datetime) -> None:
+        self._question(question_id).created_at = created_at
+        self._version += 1
+
+    def answer_added(self, question_id: int, at: datetime) -> None:
+        question = self._question(question_id)
+        question.answers += 1
+        self._record(question, ANSWER_WEIGHT, at)
+
+    def votes_changed(self, question_id: int, net_delta: int, at: datetime) -> None:
+        if not net_delta:
+            return
+        question = self._question(question_id)
+        question.votes += net_delta
+        self._record(question, VOTE_WEIGHT * net_delta, at)
+
+    def answer_accepted(self, question_id: int, at: datetime) -> None:
+        question = self._question(question_id)
+        if question.accepted:
+            return  # Moving the accepted flag to another answer isn't new activity
+        question.accepted = True
+        self._record(question, ACCEPTED_WEIGHT, at)
+
+    def _top(self, questions: Dict[int, QuestionActivity], feed: str, count: int) -> List[Tuple[float, int]]:
+        key = self._keys[feed]
+        keyed = ((key(question), question_id) for question_id, question in questions.items())
+        return heapq.nlargest(count, ((k, question_id) for k, question_id in keyed if k is not None and k > 0))
+
+    def _trim(self, questions: Dict[int, QuestionActivity]) -> Dict[int, QuestionActivity]:
+        # Keep the questions most likely to reach either feed
+        keep = set()
+        for feed in self._keys:
+            keep.update(question_id for _, question_id in self._top(questions, feed, self.candidates))
+        return {question_id: questions[question_id] for question_id in keep}
+
+    def top(self, feed: str) -> List[Tuple[int, float]]:
+        """The feed's question ids, best first, with their current scores."""
+        now = time.monotonic()
+        ranking = self._rankings.get(feed)
+        if ranking is None or (ranking.version != self._version and now - ranking.built_at >= self.refresh_interval):
+            ranking = self._rankings[feed] = Ranking(self._version, now, self._top(self._questions, feed, self.size))
+        # Keys are scores at the epoch; bring them forward to now
+        decay = 1 / self._scale(datetime.utcnow(), self._half_lives[feed])
+        return [(question_id, key * decay) for key, question_id in ranking.entries]
+
+    async def reconcile(self) -> None:
+        now = datetime.utcnow()
+        rows = await queries.fetch_all(
+            queries.statement("feeds.reconcile", build_reconcile_query),
+            epoch=now,
+            hot_since=now - HOT_WINDOW,
+            trending_since=now - TRENDING_WINDOW
+        )
+        questions = {
+            row["question_id"]: QuestionActivity(
+                row["created_at"], row["answers"], row["votes"], row["accepted"], row["activity"]
+            )
+            for row in rows
+        }
+        # Events recorded while the query ran may be counted again or missed; the
+        # next reconcile settles them
+        self.epoch = now
+        self._questions = self._trim(questions)
+        self._version += 1
+        self._rankings.clear()
+        logger.debug("Reconciled feeds", extra={"candidates": len(rows), "tracked": len(self._questions)})
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                await self.reconcile()
+            except Exception:
+                logger.exception("Feed reconcile failed")
+
+    async def start(self) -> None:
+        try:
+            await self.reconcile()
+        except Exception:
+            # The feeds fill from events meanwhile and the next reconcile retries
+            logger.exception("Feed reconcile failed")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+question_feeds = QuestionFeeds()
@@ -0,0 +1,215 @@
+import asyncio
+import fcntl
+import os
+import shutil
+import tempfile
+from typing import BinaryIO, List, Optional
+from dotenv import load_dotenv
+from sqlalchemy import update
+from .db import database, Answers, ImageStatus
+from .storage import StorageBackend, get_storage_backend
+from .cache import question_pages
+from .log import get_logger
+
+load_dotenv()
+
+logger = get_logger("uploads")
+
+# Images are spooled to IMAGE_SPOOL_DIR on the request path and uploaded to the
+# storage backend by IMAGE_UPLOAD_WORKERS background workers, with up to
+# IMAGE_UPLOAD_RETRIES retries (exponential backoff from IMAGE_UPLOAD_RETRY_DELAY).
+# Each process spools into its own worker-* subdirectory, which it holds an
+# exclusive flock on while it runs, so several workers can share IMAGE_SPOOL_DIR.
+IMAGE_SPOOL_DIR = os.environ.get("IMAGE_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "stackit-uploads"))
+IMAGE_UPLOAD_WORKERS = int(os.environ.get("IMAGE_UPLOAD_WORKERS", 4))
+IMAGE_UPLOAD_RETRIES = int(os.environ.get("IMAGE_UPLOAD_RETRIES", 3))
+IMAGE_UPLOAD_RETRY_DELAY = float(os.environ.get("IMAGE_UPLOAD_RETRY_DELAY", 1))
+IMAGE_UPLOAD_FOLDER = "answers"
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+_LOCK_FILE = ".lock"
+
+
+def discard_spooled(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _lock_spool_dir(directory: str) -> Optional[int]:
+    """Take the directory's lock without waiting; None if its owner is still running."""
+    try:
+        fd = os.open(os.path.join(directory, _LOCK_FILE), os.O_RDWR | os.O_CREAT)
+    except FileNotFoundError:
+        return None  # Removed by another worker recovering it
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+class ImageUploadQueue:
+    """
+    Uploads spooled answer images in the background and fills in answers.img_url.
+
+    Once the answer row is committed, its spooled file is renamed to
+    answer-<answer_id><ext>. When a process stops or crashes its lock is
+    released, and the next worker to start adopts its spool directory in
+    recover(): committed uploads are moved into the adopter's own directory
+    (a rename, so only one worker gets each file) and the rest are dropped.
+    """
+
+    def __init__(
+        self,
+        backend: StorageBackend,
+        workers: int = IMAGE_UPLOAD_WORKERS,
+        retries: int = IMAGE_UPLOAD_RETRIES,
+        retry_delay: float = IMAGE_UPLOAD_RETRY_DELAY
+    ):
+        self.backend = backend
+        self.workers = workers
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._queue: "asyncio.Queue[tuple]" = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self.spool_dir: Optional[str] = None
+        self._lock: Optional[int] = None
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    async def start(self) -> None:
+        await asyncio.to_thread(self._open_spool_dir)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        await self.recover()
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._lock is not None:
+            # Anything still spooled is adopted by the next worker to start
+            os.close(self._lock)
+            self._lock = None
+            self.spool_dir = None
+
+    def _open_spool_dir(self) -> None:
+        # Created and locked under a name recover() ignores, then renamed, so no
+        # other worker ever sees a worker-* directory that isn't locked yet
+        os.makedirs(IMAGE_SPOOL_DIR, exist_ok=True)
+        directory = tempfile.mkdtemp(prefix="new-", dir=IMAGE_SPOOL_DIR)
+        self._lock = _lock_spool_dir(directory)
+        self.spool_dir = os.path.join(IMAGE_SPOOL_DIR, "worker-" + os.path.basename(directory)[len("new-"):])
+        os.rename(directory, self.spool_dir)
+
+    def spool(self, file: BinaryIO, filename: Optional[str] = None) -> str:
+        """
+        Copy an uploaded file to this process's spool directory and return its path.
+        Blocking; call it with asyncio.to_thread.
+        """
+        suffix = os.path.splitext(filename or "")[1]
+        fd, path = tempfile.mkstemp(prefix="tmp-", suffix=suffix, dir=self.spool_dir)
+        with os.fdopen(fd, "wb") as spooled:
+            shutil.copyfileobj(file, spooled, _CHUNK_SIZE)
+        return path
+
+    async def recover(self) -> None:
+        for answer_id, path in await asyncio.to_thread(self._adopt_orphans):
+            self._queue.put_nowait((answer_id, path))
+
+    def _adopt_orphans(self) -> List[tuple]:
+        # Take over the spool directories of workers that are no longer running:
+        # re-enqueue uploads for committed answers, drop spools that never got one
+        adopted = []
+        for name in os.listdir(IMAGE_SPOOL_DIR):
+            directory = os.path.join(IMAGE_SPOOL_DIR, name)
+            if not name.startswith("worker-") or directory == self.spool_dir:
+                continue
+            lock = _lock_spool_dir(directory)
+            if lock is None:
+                continue
+            try:
+                for entry in os.listdir(directory):
+                    path = os.path.join(directory, entry)
+                    if entry.startswith("answer-"):
+                        try:
+                            answer_id = int(os.path.splitext(entry)[0][len("answer-"):])
+                        except ValueError:
+                            continue
+                        claimed = os.path.join(self.spool_dir, entry)
+                        os.replace(path, claimed)
+                        adopted.append((answer_id, claimed))
+                    elif entry.startswith("tmp-"):
+                        discard_spooled(path)
+                discard_spooled(os.path.join(directory, _LOCK_FILE))
+                os.rmdir(directory)
+            except OSError as e:
+                logger.warning("Could not adopt spool directory", extra={"directory": directory, "error": str(e)})
+            finally:
+                os.close(lock)
+        if adopted:
+            logger.info("Recovered spooled uploads", extra={"count": len(adopted)})
+        return adopted
+
+    async def enqueue(self, answer_id: int, spooled_path: str) -> None:
+        """
+        Hand a spooled image for an already committed answer to the workers. If it
+        can't be queued the answer's image is marked failed, so it never stays pending.
+        """
+        path = os.path.join(
+            os.path.dirname(spooled_path),
+            f"answer-{answer_id}{os.path.splitext(spooled_path)[1]}"
+        )
+        try:
+            await asyncio.to_thread(os.replace, spooled_path, path)
+        except OSError as e:
+            logger.error("Could not queue image upload", extra={"answer_id": answer_id, "error": str(e)})
+            await self._finish(answer_id, spooled_path, None, ImageStatus.failed)
+            return
+        await self._queue.put((answer_id, path))
+
+    async def _worker(self) -> None:
+        while True:
+            answer_id, path = await self._queue.get()
+            try:
+                await self._process(answer_id, path)
+            except Exception as e:
+                logger.error("Image upload failed", extra={"answer_id": answer_id, "error": str(e)})
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, answer_id: int, path: str) -> None:
+        for attempt in range(self.retries + 1):
+            try:
+                url = await asyncio.to_thread(self.backend.upload, path, IMAGE_UPLOAD_FOLDER)
+                break
+            except Exception as e:
+                logger.warning(
+                    "Image upload attempt failed",
+                    extra={"answer_id": answer_id, "attempt": attempt + 1, "error": str(e)}
+                )
+                if attempt == self.retries:
+                    await self._finish(answer_id, path, None, ImageStatus.failed)
+                    return
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+        await self._finish(answer_id, path, url, ImageStatus.ready)
+
+    async def _finish(self, answer_id: int, path: str, url: Optional[str], img_status: ImageStatus) -> None:
+        question_id = await database.fetch_val(
+            update(Answers).where(Answers.c.answer_id == answer_id)
+            .values(img_url=url, img_status=img_status)
+            .returning(Answers.c.question_id)
+        )
+        if question_id is not None:
+            await question_pages.invalidate(question_id)
+        discard_spooled(path)
+
+
+image_uploads = ImageUploadQueue(get_storage_backend())
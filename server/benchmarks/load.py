@@ -0,0 +1,380 @@
+"""
+Latency, throughput and database queries per request for the main endpoints,
+driving the app from main.py in process (httpx over ASGI, lifespan included)
+against a database filled by benchmarks/seed.py.
+
+Each scenario sends --requests requests from --concurrency concurrent clients
+after --warmup untimed ones, and reports p50/p95/p99 latency, requests per
+second, statements and database time per request, and the status codes seen.
+A run where any scenario gets a status other than 200, 201 or 304 exits 1
+without saving, since it timed an error path rather than the endpoint.
+Run from the server directory with DATABASE_URL pointing at the seeded database:
+
+    python -m benchmarks.load                        # every scenario
+    python -m benchmarks.load feed question_detail   # just these
+    python -m benchmarks.load --save main            # store as baselines/main.json
+    python -m benchmarks.load --compare main         # exit 1 on a regression
+
+A scenario regresses when its p95 latency grows, or its throughput drops, by
+more than --threshold (a fraction), or when it runs more statements per request
+than the baseline did. Baselines are only comparable between runs on the same
+machine with the same seeded volumes; both are stored with the results.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+from collections import Counter
+from typing import Callable, Dict, List, NamedTuple, Optional
+import httpx
+
+# Every simulated client shares one address and a handful of users, so per-client
+# rate limits would measure the limiter rather than the endpoints. The concurrency
+# limit still applies, as it does in production.
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+
+# Every login request hashes a password. The hashing pool sheds jobs beyond
+# PASSWORD_HASH_MAX_PENDING (4 per CPU by default) with 503, which on a small
+# machine is fewer than the clients, so let it take one per client. Read from the
+# command line here because lib/passwords.py reads its setting on import.
+DEFAULT_CONCURRENCY = 16
+_concurrency = argparse.ArgumentParser(add_help=False)
+_concurrency.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+os.environ.setdefault("PASSWORD_HASH_MAX_PENDING", str(_concurrency.parse_known_args()[0].concurrency))
+
+from jose import jwt
+from app.lib.auth import ACCESS_TOKEN_SECRET
+from app.lib.db import database, track_queries
+from app.lib.pagination import encode_key
+from benchmarks.seed import BENCHMARK_PASSWORD, TAG_POOL
+from main import app
+
+BASELINES_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+# Anything else means a scenario measured an error path rather than the endpoint
+EXPECTED_STATUSES = {200, 201, 304}
+
+
+class Request(NamedTuple):
+    method: str
+    url: str
+    user_id: Optional[int] = None  # sent as the access_token cookie
+    revalidate: bool = False  # send If-None-Match with the ETag last seen for the url
+    json: Optional[dict] = None
+    # A question detail page to take a next-page answers cursor from (untimed, before
+    # the run); the cursor is appended to url
+    cursor_from: Optional[str] = None
+
+
+class Sample(NamedTuple):
+    latency: float
+    status: int
+    queries: int
+    db_time: float
+
+
+class Volumes(NamedTuple):
+    users: int
+    questions: int
+    answers: int
+    notifications: int
+
+
+# Each scenario builds its next request from a seeded random generator and the
+# volumes found in the database, so runs replay the same request sequence.
+
+def feed(rng, volumes):
+    return Request("GET", "/api/questions/")
+
+
+def feed_by_tag(rng, volumes):
+    return Request("GET", f"/api/questions/?tag=tag{rng.randrange(TAG_POOL)}")
+
+
+def question_detail(rng, volumes):
+    return Request("GET", f"/api/questions/{rng.randint(1, volumes.questions)}")
+
+
+def question_not_modified(rng, volumes):
+    # Only the first 100 questions, so most requests revalidate a page already seen
+    return Request("GET", f"/api/questions/{rng.randint(1, min(100, volumes.questions))}", revalidate=True)
+
+
+def answers_page(rng, volumes):
+    question_id = rng.randint(1, volumes.questions)
+    return Request("GET", f"/api/questions/{question_id}/answers?limit=5", cursor_from=f"/api/questions/{question_id}")
+
+
+def search(rng, volumes):
+    return Request("GET", f"/api/search/?q=question+tag{rng.randrange(TAG_POOL)}")
+
+
+def tags(rng, volumes):
+    return Request("GET", f"/api/tags/?prefix=tag{rng.randrange(10)}")
+
+
+def notifications(rng, volumes):
+    return Request("GET", "/api/notifications/?unread_only=true", user_id=rng.randint(1, volumes.users))
+
+
+def unread_count(rng, volumes):
+    return Request("GET", "/api/notifications/unread-count", user_id=rng.randint(1, volumes.users))
+
+
+def vote(rng, volumes):
+    return Request(
+        "POST", f"/api/answers/{rng.randint(1, volumes.answers)}/vote",
+        user_id=rng.randint(1, volumes.users),
+        json={"vote_type": rng.choice(("upvote", "downvote", "none"))}
+    )
+
+
+def login(rng, volumes):
+    return Request(
+        "POST", "/api/auth/login",
+        json={"username": f"bench_user_{rng.randint(1, volumes.users)}", "password": BENCHMARK_PASSWORD}
+    )
+
+
+SCENARIOS: Dict[str, Callable] = {
+    scenario.__name__: scenario
+    for scenario in (
+        feed, feed_by_tag, question_detail, question_not_modified, answers_page,
+        search, tags, notifications, unread_count, vote, login
+    )
+}
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    # Nearest rank
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(samples: List[Sample], wall_time: float) -> dict:
+    latencies = sorted(sample.latency for sample in samples)
+    count = len(samples)
+    return {
+        "requests": count,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "throughput_rps": round(count / wall_time, 1),
+        "queries_per_request": round(sum(sample.queries for sample in samples) / count, 2),
+        "db_ms_per_request": round(sum(sample.db_time for sample in samples) / count * 1000, 3),
+        "status": {str(code): n for code, n in sorted(Counter(sample.status for sample in samples).items())}
+    }
+
+
+class LoadGenerator:
+    def __init__(self, client: httpx.AsyncClient, volumes: Volumes, concurrency: int, seed: int):
+        self.client = client
+        self.volumes = volumes
+        self.concurrency = concurrency
+        self.seed = seed
+        self._etags: Dict[str, str] = {}
+        self._cursors: Dict[str, str] = {}
+
+    def _headers(self, request: Request) -> Dict[str, str]:
+        headers = {}
+        if request.user_id is not None:
+            token = jwt.encode({"user_id": request.user_id}, ACCESS_TOKEN_SECRET, algorithm="HS256")
+            headers["Cookie"] = f"access_token={token}"
+        if request.revalidate and request.url in self._etags:
+            headers["If-None-Match"] = self._etags[request.url]
+        return headers
+
+    async def _answers_cursor(self, detail_url: str) -> str:
+        # The cursor the server hands out for the page after the detail page's, or,
+        # when the question has no second page at the default size, the one it would
+        # hand out after a page of one answer
+        response = await self.client.get(detail_url)
+        response.raise_for_status()
+        page = response.json()
+        if page["answers_next_cursor"]:
+            return page["answers_next_cursor"]
+        answers = page["answers"]
+        if not answers:
+            raise SystemExit(f"{detail_url} has no answers to page through; reseed with --answers-per-question")
+        first = answers[0]
+        return encode_key(first["is_accepted"], first["score"], first["answer_id"])
+
+    async def _prepare(self, requests: List[Request]) -> List[Request]:
+        for url in {request.cursor_from for request in requests if request.cursor_from} - self._cursors.keys():
+            self._cursors[url] = await self._answers_cursor(url)
+        return [
+            request._replace(url=f"{request.url}&cursor={self._cursors[request.cursor_from]}") if request.cursor_from else request
+            for request in requests
+        ]
+
+    async def _send(self, request: Request) -> Sample:
+        headers = self._headers(request)
+        stats = track_queries()
+        start = time.perf_counter()
+        response = await self.client.request(request.method, request.url, headers=headers, json=request.json)
+        latency = time.perf_counter() - start
+        # Query counts arrive from the driver's query logger one loop iteration later
+        await asyncio.sleep(0)
+        etag = response.headers.get("etag")
+        if etag is not None:
+            self._etags[request.url] = etag
+        return Sample(latency, response.status_code, stats.count, stats.elapsed)
+
+    async def run(self, scenario: Callable, requests: int) -> List[Sample]:
+        rng = random.Random(self.seed)
+        pending = await self._prepare([scenario(rng, self.volumes) for _ in range(requests)])
+        pending.reverse()
+        samples: List[Sample] = []
+
+        async def client():
+            # Each client is its own task, so its query counts stay separate
+            while pending:
+                samples.append(await self._send(pending.pop()))
+
+        await asyncio.gather(*(client() for _ in range(self.concurrency)))
+        return samples
+
+
+async def seeded_volumes() -> Volumes:
+    row = await database.fetch_one(
+        "SELECT (SELECT count(*) FROM users) AS users, (SELECT count(*) FROM questions) AS questions, "
+        "(SELECT count(*) FROM answers) AS answers, (SELECT count(*) FROM notifications) AS notifications"
+    )
+    volumes = Volumes(row["users"], row["questions"], row["answers"], row["notifications"])
+    if not volumes.users or not volumes.questions or not volumes.answers:
+        raise SystemExit("The database has no seeded data; run python -m benchmarks.seed first")
+    return volumes
+
+
+async def run(args) -> dict:
+    results = {}
+    async with app.router.lifespan_context(app):
+        volumes = await seeded_volumes()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            generator = LoadGenerator(client, volumes, args.concurrency, args.seed)
+            for name in args.scenarios or SCENARIOS:
+                scenario = SCENARIOS[name]
+                if args.warmup:
+                    await generator.run(scenario, args.warmup)
+                start = time.perf_counter()
+                samples = await generator.run(scenario, args.requests)
+                results[name] = summarize(samples, time.perf_counter() - start)
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "volumes": volumes._asdict(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed": args.seed
+        },
+        "results": results
+    }
+
+
+def print_results(results: Dict[str, dict], baseline: Optional[Dict[str, dict]] = None):
+    print(f"{'scenario':<24}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'queries':>9}{'db ms':>9}  status")
+    for name, result in results.items():
+        print(
+            f"{name:<24}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+            f"{result['throughput_rps']:>10.1f}{result['queries_per_request']:>9.2f}{result['db_ms_per_request']:>9.2f}"
+            f"  {' '.join(f'{code}x{n}' for code, n in result['status'].items())}"
+        )
+        previous = (baseline or {}).get(name)
+        if previous:
+            print(
+                f"{'  vs baseline':<24}{change(previous['p50_ms'], result['p50_ms']):>10}"
+                f"{change(previous['p95_ms'], result['p95_ms']):>10}{change(previous['p99_ms'], result['p99_ms']):>10}"
+                f"{change(previous['throughput_rps'], result['throughput_rps']):>10}"
+                f"{result['queries_per_request'] - previous['queries_per_request']:>+9.2f}"
+            )
+
+
+def unexpected_statuses(results: Dict[str, dict]) -> List[str]:
+    return [
+        f"{name}: {' '.join(f'{code}x{n}' for code, n in result['status'].items() if int(code) not in EXPECTED_STATUSES)}"
+        for name, result in results.items()
+        if any(int(code) not in EXPECTED_STATUSES for code in result["status"])
+    ]
+
+
+def change(old: float, new: float) -> str:
+    return f"{(new - old) / old:+.0%}" if old else "n/a"
+
+
+def regressions(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    found = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if result["p95_ms"] > previous["p95_ms"] * (1 + threshold):
+            found.append(f"{name}: p95 {previous['p95_ms']:.2f} -> {result['p95_ms']:.2f} ms")
+        if result["throughput_rps"] < previous["throughput_rps"] * (1 - threshold):
+            found.append(f"{name}: throughput {previous['throughput_rps']:.1f} -> {result['throughput_rps']:.1f} req/s")
+        if result["queries_per_request"] > previous["queries_per_request"]:
+            found.append(
+                f"{name}: queries per request {previous['queries_per_request']:.2f} -> {result['queries_per_request']:.2f}"
+            )
+    return found
+
+
+def baseline_path(name: str) -> str:
+    return os.path.join(BASELINES_DIR, f"{name}.json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenarios", nargs="*", metavar="scenario", help=f"scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument("--requests", type=int, default=500, help="timed requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--warmup", type=int, default=50, help="untimed requests per scenario")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", metavar="NAME", help="save the results as baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="compare with baselines/NAME.json")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed p95/throughput change (default 0.10)")
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    baseline = None
+    if args.compare:
+        with open(baseline_path(args.compare)) as f:
+            baseline = json.load(f)
+
+    report = asyncio.run(run(args))
+    print_results(report["results"], baseline["results"] if baseline else None)
+
+    # Timings of failed requests say nothing about the endpoint; don't save or pass them
+    failed = unexpected_statuses(report["results"])
+    if failed:
+        print("Scenarios with unexpected statuses:")
+        for line in failed:
+            print(f"  {line}")
+        sys.exit(1)
+
+    if args.save:
+        os.makedirs(BASELINES_DIR, exist_ok=True)
+        with open(baseline_path(args.save), "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved {baseline_path(args.save)}")
+
+    if baseline:
+        if baseline["environment"]["volumes"] != report["environment"]["volumes"]:
+            print("Warning: the baseline was recorded against different seeded volumes")
+        found = regressions(report["results"], baseline["results"], args.threshold)
+        if found:
+            print("Regressions:")
+            for line in found:
+                print(f"  {line}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
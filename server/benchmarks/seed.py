@@ -0,0 +1,133 @@
+"""
+Migrate a disposable PostgreSQL database and fill it with synthetic users,
+questions, answers and notifications for the load benchmark (benchmarks/load.py).
+Volumes are configurable; the same volumes always produce the same data, so
+results from different runs are comparable.
+
+Full-text search, GIN indexes, the exclusion constraint on accepted answers and
+LISTEN/NOTIFY are PostgreSQL features, so there is no in-memory stand-in: point
+DATABASE_URL at a throwaway database (e.g. a local `postgres` container) and run
+from the server directory:
+
+    python -m benchmarks.seed --reset --users 1000 --questions 10000
+
+--reset drops every table this app owns before recreating them. Every seeded
+user's password is BENCHMARK_PASSWORD.
+"""
+import argparse
+import asyncio
+from sqlalchemy import Enum
+from sqlalchemy.schema import DropTable
+from app.lib.db import database, metadata
+from app.lib.migrations import migrate
+from app.lib.passwords import hash_password, shutdown_password_pool
+
+BENCHMARK_PASSWORD = "benchmark-password"
+TAG_POOL = 200  # distinct tags; each question gets three of them
+
+
+async def reset_schema():
+    for table in reversed(metadata.sorted_tables):
+        await database.execute(DropTable(table, if_exists=True))
+    enum_types = {
+        column.type.name
+        for table in metadata.sorted_tables for column in table.columns if isinstance(column.type, Enum)
+    }
+    for name in enum_types:
+        await database.execute(f"DROP TYPE IF EXISTS {name}")
+
+
+# Rows are generated server side with generate_series, so seeding a few million
+# rows doesn't push them through the client one by one. Ids come from fresh
+# sequences (the tables were just created), so row n of each table has id n.
+
+SEED_USERS = """
+INSERT INTO users (username, email, password_hash, role, created_at, is_banned)
+SELECT 'bench_user_' || n, 'bench_user_' || n || '@example.com', CAST(:password_hash AS text),
+       CASE WHEN n = 1 THEN 'admin' ELSE 'user' END::user_role,
+       now() - n * interval '1 minute', false
+FROM generate_series(1, CAST(:users AS integer)) AS n
+"""
+
+SEED_QUESTIONS = """
+INSERT INTO questions (user_id, title, description, tags, created_at)
+SELECT 1 + n % CAST(:users AS integer),
+       'Benchmark question ' || n || ' about tag' || n % :tag_pool,
+       repeat('Steps to reproduce, what I expected and what happened instead. ', 1 + n % 8),
+       ARRAY['tag' || n % :tag_pool, 'tag' || (n * 7) % :tag_pool, 'tag' || (n * 13) % :tag_pool],
+       now() - n * interval '10 seconds'
+FROM generate_series(1, CAST(:questions AS integer)) AS n
+"""
+
+# The last answer of every third question is the accepted one
+SEED_ANSWERS = """
+INSERT INTO answers (question_id, user_id, description, tags, upvotes, downvotes, is_accepted, accepted_at, created_at)
+SELECT 1 + (n - 1) / :per_question, 1 + (n * 7) % CAST(:users AS integer),
+       repeat('This fixed it for me, with a short explanation of why. ', 1 + n % 5),
+       ARRAY[]::text[], n % 13, n % 3,
+       accepted, CASE WHEN accepted THEN now() - n * interval '1 second' END,
+       now() - n * interval '2 seconds'
+FROM generate_series(1, CAST(:questions AS integer) * :per_question) AS n,
+     LATERAL (SELECT n % :per_question = 0 AND (n / :per_question) % 3 = 0 AS accepted) AS a
+"""
+
+SEED_NOTIFICATIONS = """
+INSERT INTO notifications (user_id, type, related_id, message, is_read, created_at)
+SELECT 1 + (n - 1) / :per_user, 'answer'::notification_type, 1 + n % CAST(:questions AS integer),
+       'Someone answered your question', n % 4 <> 0, now() - n * interval '5 seconds'
+FROM generate_series(1, CAST(:users AS integer) * :per_user) AS n
+"""
+
+
+async def seed(users: int, questions: int, answers_per_question: int, notifications_per_user: int):
+    password_hash = await hash_password(BENCHMARK_PASSWORD)
+    async with database.transaction():
+        await database.execute(SEED_USERS, {"users": users, "password_hash": password_hash})
+        await database.execute(SEED_QUESTIONS, {"users": users, "questions": questions, "tag_pool": TAG_POOL})
+        if answers_per_question:
+            await database.execute(SEED_ANSWERS, {
+                "users": users, "questions": questions, "per_question": answers_per_question
+            })
+        if notifications_per_user:
+            await database.execute(SEED_NOTIFICATIONS, {
+                "users": users, "questions": questions, "per_user": notifications_per_user
+            })
+
+
+async def run(args):
+    await database.connect()
+    try:
+        existing = await database.fetch_val("SELECT to_regclass('users') IS NOT NULL")
+        if existing and not args.reset:
+            raise SystemExit("Tables already exist; pass --reset to drop and recreate them")
+        if args.reset:
+            await reset_schema()
+        # Tables first and indexes after the bulk load, which is faster than
+        # maintaining them row by row; the last migration fills the counters
+        await migrate(target=2)
+        await seed(args.users, args.questions, args.answers_per_question, args.notifications_per_user)
+        await migrate()
+        # Fresh statistics, so the planner sees the seeded volumes
+        await database.execute("ANALYZE")
+        print(
+            f"Seeded {args.users} users, {args.questions} questions, "
+            f"{args.questions * args.answers_per_question} answers and "
+            f"{args.users * args.notifications_per_user} notifications"
+        )
+    finally:
+        await database.disconnect()
+        shutdown_password_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reset", action="store_true", help="drop the app's tables first")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--questions", type=int, default=10000)
+    parser.add_argument("--answers-per-question", type=int, default=5)
+    parser.add_argument("--notifications-per-user", type=int, default=20)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Per-request serialization cost of the question feed and question detail responses,
+comparing the old path (Record -> hand-built dict -> jsonable_encoder -> json.dumps)
+with the current one (RowMapper -> Pydantic response model dumped to JSON bytes for
+the feed; RowMapper + orjson for the detail page, whose answers arrive as JSON).
+
+No database is needed. Run from the server directory with the app's environment
+configured (DATABASE_URL etc., as for the app itself):
+
+    python -m benchmarks.serialization
+"""
+import json
+import timeit
+from datetime import datetime, timedelta
+import orjson
+from databases.backends.common.records import Record, create_column_maps
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy import select
+from app.lib.db import database, question_columns, answer_columns, Questions, Answers, Users
+from app.lib.mappers import question_response
+from app.lib.models import QuestionFeed
+
+REPEAT = 5
+
+
+class DriverRow:
+    """Stand-in for asyncpg.Record: indexable by position and by column name."""
+
+    __slots__ = ("_values", "_index")
+
+    def __init__(self, values: tuple, index: dict):
+        self._values = values
+        self._index = index
+
+    def __getitem__(self, key):
+        return self._values[key if isinstance(key, int) else self._index[key]]
+
+
+def make_records(query, rows):
+    # Wrap driver rows the way databases does for a real result of this query
+    compiled = query.compile(dialect=database._backend._dialect)
+    column_maps = create_column_maps(compiled._result_columns)
+    names = [column[0] for column in compiled._result_columns]
+    index = {name: i for i, name in enumerate(names)}
+    return [
+        Record(DriverRow(tuple(row[name] for name in names), index), compiled._result_columns, database._backend._dialect, column_maps)
+        for row in rows
+    ]
+
+
+def question_rows(count):
+    now = datetime(2025, 7, 12, 10, 30)
+    return [
+        {
+            "question_id": 100000 - i,
+            "user_id": i % 97,
+            "title": f"How do I make question {i} faster?",
+            "description": "Some description of the problem with a bit of <b>markup</b>. " * 8,
+            "tags": ["python", "fastapi", "postgresql"],
+            "created_at": now - timedelta(minutes=i),
+            "updated_at": None,
+            "username": f"user{i % 97}"
+        }
+        for i in range(count)
+    ]
+
+
+def answer_rows(count):
+    now = datetime(2025, 7, 12, 10, 30)
+    return [
+        {
+            "answer_id": 500000 - i,
+            "question_id": 100000,
+            "user_id": i % 89,
+            "description": "An answer that explains the fix in a couple of sentences. " * 6,
+            "img_url": None,
+            "img_status": None,
+            "tags": ["python"],
+            "upvotes": count - i,
+            "downvotes": i % 3,
+            "is_accepted": i == 0,
+            "created_at": now - timedelta(minutes=i),
+            "updated_at": None,
+            "username": f"user{i % 89}",
+            "score": count - i - i % 3
+        }
+        for i in range(count)
+    ]
+
+
+def legacy_render(content) -> bytes:
+    # What JSONResponse did with a handler's dict after jsonable_encoder
+    return json.dumps(
+        jsonable_encoder(content), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def legacy_question(q):
+    return {
+        "question_id": q["question_id"],
+        "user_id": q["user_id"],
+        "title": q["title"],
+        "description": q["description"],
+        "tags": q["tags"],
+        "created_at": q["created_at"],
+        "updated_at": q["updated_at"],
+        "username": q["username"]
+    }
+
+
+def legacy_answer(a):
+    return {
+        "answer_id": a["answer_id"],
+        "user_id": a["user_id"],
+        "description": a["description"],
+        "img_url": a["img_url"],
+        "img_status": a["img_status"],
+        "tags": a["tags"],
+        "upvotes": a["upvotes"],
+        "downvotes": a["downvotes"],
+        "is_accepted": a["is_accepted"],
+        "created_at": a["created_at"],
+        "updated_at": a["updated_at"],
+        "username": a["username"]
+    }
+
+
+def bench_feed(size):
+    query = select(*question_columns, Users.c.username).join(Users, Questions.c.user_id == Users.c.user_id)
+    records = make_records(query, question_rows(size))
+    feed = TypeAdapter(QuestionFeed)
+
+    def before():
+        return legacy_render({"questions": [legacy_question(q) for q in records], "next_cursor": "x", "prev_cursor": None})
+
+    def after():
+        # FastAPI validates against the response model and dumps straight to bytes
+        content = {"questions": [question_response(q) for q in records], "next_cursor": "x", "prev_cursor": None}
+        return feed.dump_json(feed.validate_python(content))
+
+    return before, after
+
+
+def bench_detail(answer_count):
+    question_query = select(*question_columns, Users.c.username).join(Users, Questions.c.user_id == Users.c.user_id)
+    answers_query = select(*answer_columns, Users.c.username).join(Users, Answers.c.user_id == Users.c.user_id)
+    question = make_records(question_query, question_rows(1))[0]
+    answers = make_records(answers_query, answer_rows(answer_count))
+    # The detail query returns the answers page already encoded as JSON text
+    answers_json = json.dumps(jsonable_encoder(answer_rows(answer_count)))
+
+    def before():
+        return legacy_render({"question": legacy_question(question), "answers": [legacy_answer(a) for a in answers]})
+
+    def after():
+        return orjson.dumps({
+            "question": question_response(question),
+            "answers": orjson.loads(answers_json),
+            "answers_next_cursor": None
+        })
+
+    return before, after
+
+
+def measure(fn) -> float:
+    number = max(1, int(0.2 / timeit.timeit(fn, number=1)))
+    best = min(timeit.repeat(fn, number=number, repeat=REPEAT))
+    return best / number * 1e6
+
+
+def main():
+    cases = [
+        ("feed, 20 questions", bench_feed(20)),
+        ("feed, 100 questions", bench_feed(100)),
+        ("detail, 20 answers", bench_detail(20)),
+        ("detail, 200 answers", bench_detail(200))
+    ]
+    print(f"{'case':<24}{'before (us)':>14}{'after (us)':>14}{'speedup':>10}")
+    for name, (before, after) in cases:
+        old, new = measure(before), measure(after)
+        print(f"{name:<24}{old:>14.1f}{new:>14.1f}{old / new:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
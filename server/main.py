@@ -1,10 +1,47 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.answers import router as answers_router
+from app.api.auth import userRouter as auth_router
+from app.api.feeds import router as feeds_router
+from app.api.metrics import router as metrics_router
+from app.api.notifications import router as notifications_router, stream_router as notifications_stream_router
 from app.api.questions import router as questions_router
-from app.lib.db import database
+from app.api.search import router as search_router
+from app.api.tags import router as tags_router
+from app.lib.db import database, replicas
+from app.lib.metrics import MetricsMiddleware
+from app.lib.migrations import DB_MIGRATE_ON_STARTUP, migrate
+from app.lib.profiler import QUERY_PROFILE, QueryProfilerMiddleware
+from app.lib.passwords import shutdown_password_pool
+from app.lib.uploads import image_uploads
+from app.lib.notifier import notification_queue
+from app.lib.pubsub import notification_hub
+from app.lib.trending import question_feeds
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One connection pool for the life of the process; requests borrow from it
+    await database.connect()
+    if DB_MIGRATE_ON_STARTUP:
+        await migrate()
+    await replicas.start()
+    await image_uploads.start()
+    await notification_hub.start()
+    await notification_queue.start()
+    await question_feeds.start()
+    try:
+        yield
+    finally:
+        await question_feeds.stop()
+        await notification_queue.stop()
+        await notification_hub.stop()
+        await image_uploads.stop()
+        await replicas.stop()
+        await database.disconnect()
+        shutdown_password_pool()
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "*"  # Restrict to specific origins in production, e.g., ["http://localhost:3000"]
@@ -17,14 +54,17 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if QUERY_PROFILE:
+    app.add_middleware(QueryProfilerMiddleware)
+# Outermost, so recorded latencies include the other middleware
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(answers_router)
+app.include_router(auth_router)
+app.include_router(feeds_router)
+app.include_router(metrics_router)
+app.include_router(notifications_router)
+app.include_router(notifications_stream_router)
 app.include_router(questions_router)
-
-@app.on_event("startup")
-async def startup():
-    await database.connect()
-
-@app.on_event("shutdown")
-async def shutdown():
-    await database.disconnect()
\ No newline at end of file
+app.include_router(search_router)
+app.include_router(tags_router)
@@ -0,0 +1,42 @@
+"""
+Apply pending schema migrations (app/lib/migrations.py) to DATABASE_URL.
+
+    python migrate.py               # apply everything pending
+    python migrate.py --target 2    # stop after version 2
+    python migrate.py --status      # list migrations and when they were applied
+
+Index migrations build with CREATE INDEX CONCURRENTLY, so they can run against a
+live database without blocking writes; they take longer than a plain build.
+"""
+import argparse
+import asyncio
+from app.lib.db import database
+from app.lib.migrations import migrate, migration_status
+
+
+async def run(args):
+    await database.connect()
+    try:
+        if args.status:
+            for migration in await migration_status():
+                applied = migration["applied_at"] or "pending"
+                print(f"{migration['version']:>4}  {migration['name']:<45}{applied}")
+            return
+        applied = await migrate(args.target)
+        for migration in applied:
+            print(f"Applied {migration.version}: {migration.name}")
+        if not applied:
+            print("Nothing to apply")
+    finally:
+        await database.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--status", action="store_true", help="list migrations instead of applying them")
+    parser.add_argument("--target", type=int, help="apply migrations up to this version only")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()